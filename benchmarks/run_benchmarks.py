@@ -0,0 +1,434 @@
+#-------- benchmark suite: ---------#
+# Offline benchmarks of the tokenization pipelines and the crawler, against the bundled sample corpora
+# (crawler/policies/sample_policies_*) and a local stub HTTP server. Every benchmark runs in its own process
+# so peak RSS is per benchmark. Results are written as JSON, and --compare prints the change against an
+# earlier run.
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --only ja zh --repeat 3 --compare benchmarks/results/<earlier>.json
+
+import os
+import sys
+import json
+import time
+import glob
+import random
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+import tempfile
+import multiprocessing
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES = os.path.join(REPO, "crawler", "policies")
+RESULTS = os.path.join(REPO, "benchmarks", "results")
+
+BENCHMARKS = ["ja", "ko", "zh", "token_store", "html_extract", "crawl"]
+
+#-------- measurements: ---------#
+
+def _percentile(values : list, q : float):
+    """Nearest rank percentile, None for no values"""
+
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+def _peak_rss_mb():
+    #ru_maxrss is in kilobytes on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+def summarize(latencies : list, tokens : int, size : int, elapsed : float):
+    """Throughput and latency figures of one benchmark run
+
+    Parameters
+    ----------
+    latencies : seconds per document
+    tokens : total tokens (or links for the crawler) produced
+    size : total input bytes
+    elapsed : wall time of the run in seconds
+    """
+
+    return {
+        "docs": len(latencies),
+        "tokens": tokens,
+        "bytes": size,
+        "seconds": elapsed,
+        "docs_per_sec": len(latencies) / elapsed if elapsed else None,
+        "tokens_per_sec": tokens / elapsed if elapsed else None,
+        "mb_per_sec": size / (1 << 20) / elapsed if elapsed else None,
+        "p50_ms": _percentile(latencies, 50) * 1000 if latencies else None,
+        "p99_ms": _percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+def _read_samples(language : str):
+    """(name, text) of every sample policy of a language, sorted by name"""
+
+    texts = []
+    for file in sorted(glob.glob(os.path.join(SAMPLES, f"sample_policies_{language}", "*.txt"))):
+        with open(file, "r", encoding = "utf-8") as f:
+            texts.append((os.path.basename(file), f.read()))
+    return texts
+
+def _time_documents(texts : list, tokenize):
+    """Runs tokenize(text) -> token count over texts, returns summarize() of the run"""
+
+    latencies = []
+    tokens = 0
+    start = time.perf_counter()
+    for _, text in texts:
+        t = time.perf_counter()
+        tokens += tokenize(text)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, tokens, sum(len(text.encode("utf-8")) for _, text in texts), elapsed)
+
+#-------- language pipelines: ---------#
+
+#characters that grow under Sudachi's input normalization (㍿ -> 株式会社, ﷺ -> 18 characters, İ -> i̇)
+EXPANDING_CHARACTERS = ["㍿", "ﷺ", "İ", "ｶﾞ"]
+
+def _check_chunker(text_chunker, tokenizer):
+    """Tokenizes the chunks of texts filled with expanding characters up to the byte bound, Sudachi raises if one is too long"""
+
+    for character in EXPANDING_CHARACTERS:
+        text = "これは文です。" * 100 + character * (text_chunker.SUDACHI_MAX_BYTES // len(character.encode("utf-8")))
+        chunks = list(text_chunker.iter_chunks(text))
+        if "".join(chunks) != text:
+            raise ValueError(f"chunks of the {character} text don't join back to the text")
+        for chunk in chunks:
+            tokenizer.tokenize(chunk)
+
+def _check_file_matcher(Preprocessing, link_registry):
+    """file_matcher_str/_bool count distinct urls, not rows: a hash listed twice with one url matches, two urls don't"""
+
+    import pandas as pd
+    table = pd.DataFrame({"hash": ["same", "same", "two", "two"], "url": ["https://a.jp/p", "https://a.jp/p", "https://b.jp/p", "https://c.jp/p"]})
+    expected = {"same": ("https://a.jp/p", True), "two": ("two has too many associated URL's", False), "missing": ("missing has no associated URL", False)}
+    for url_table in (table, link_registry.LinkRegistry.from_frame(table)):
+        for hash, (url, valid) in expected.items():
+            got = (Preprocessing.file_matcher_str(url_table, hash), Preprocessing.file_matcher_bool(url_table, hash))
+            if got != (url, valid):
+                raise ValueError(f"file_matcher on a {type(url_table).__name__} gave {got} for {hash}, expected {(url, valid)}")
+
+def bench_ja(options : dict):
+    """Preprocessing.tokenize_rows (SudachiPy, split mode C, B/A splits) over the japanese samples"""
+
+    #Preprocessing reads misc/kana.txt relative to its own folder at import
+    os.chdir(os.path.join(REPO, "workFolder4Phillip"))
+    sys.path.insert(0, os.getcwd())
+    import sudachipy
+    import Preprocessing
+    import morpheme_cache
+    import text_chunker
+    import link_registry
+
+    with open("misc/stopwords-ja.txt", "r", encoding = "utf-8") as f:
+        stopwords = set(f.read().split("\n"))
+    tokenizer = sudachipy.Dictionary(dict = options["sudachi_dict"]).create(mode = sudachipy.SplitMode.C)
+    _check_chunker(text_chunker, tokenizer)
+    _check_file_matcher(Preprocessing, link_registry)
+    cache = morpheme_cache.MorphemeCache()
+
+    result = _time_documents(_read_samples("japanese"), lambda text: sum(1 for _ in Preprocessing.tokenize_rows(text, tokenizer, stopwords = stopwords, cache = cache)))
+    result["cache"] = cache.stats()
+    return result
+
+def bench_ko(options : dict):
+    """korean_preprocess.tokenize_korean (Okt) over the korean samples"""
+
+    sys.path.insert(0, os.path.join(REPO, "policy_corpus"))
+    import korean_preprocess
+
+    try:
+        okt = korean_preprocess.Okt()
+    except Exception as e:
+        #konlpy imports without a JVM and only fails when Okt starts one
+        raise ImportError(f"Okt could not start: {e}") from e
+    return _time_documents(_read_samples("korean"), lambda text: len(korean_preprocess.tokenize_korean(korean_preprocess.clean_korean_text(text), okt)))
+
+def bench_zh(options : dict):
+    """chinese_preprocess.tokenize_chinese (jieba POS tagging) over the chinese samples"""
+
+    sys.path.insert(0, os.path.join(REPO, "policy_corpus"))
+    import jieba
+    import chinese_preprocess
+
+    jieba.setLogLevel(jieba.logging.WARNING)
+    jieba.initialize() #dictionary loading is not part of the per document latency
+    return _time_documents(_read_samples("chinese"), lambda text: sum(1 for _ in chinese_preprocess.tokenize_chinese(chinese_preprocess.clean_chinese_text(text))))
+
+#-------- token store: ---------#
+
+#tokenized csvs of the repo, the japanese ones are notebook written (mostly quoted) csvs without a Section column
+CORPORA = {"ja": "japanese_preprocessed", "ko": "korean_preprocessed", "zh": "chinese_processed"}
+
+#surfaces that only survive if a csv is read with the quoting it was written with
+QUOTED_SURFACES = ['"', '""', 'a"b', '"a"']
+
+def _check_quoting(token_store, corpus_stats):
+    """Round trips quote surfaces through a Preprocessing (unquoted) and a pandas (quoted) written japanese csv"""
+
+    folder = tempfile.mkdtemp(prefix = "bench_quoting_")
+    columns = ["Surface", "Normalized", "Reading", "Dictionary", "POS1", "POS2", "POS3", "POS4", "Conj_Type", "Conj", "OOV", "B_Split", "A_Split"]
+    rows = [[surface, surface, "キゴウ", surface, "補助記号", "一般", "*", "*", "*", "*", "False", "*", "*"] for surface in QUOTED_SURFACES]
+
+    #Preprocessing.tokenize_file: joined by hand, with a Section column
+    with open(os.path.join(folder, "unquoted.csv"), "w", encoding = "utf-8") as f:
+        f.write(",".join(columns + ["Section"]) + "\n")
+        f.writelines(",".join(row + ["1"]) + "\n" for row in rows)
+    #the notebook: pandas to_csv, no Section column, plus a surface that needs quoting for its comma
+    import pandas as pd
+    pd.DataFrame(rows + [["a,b", "a,b"] + rows[0][2:]], columns = columns).to_csv(os.path.join(folder, "quoted.csv"), index = False)
+
+    expected = {"unquoted": QUOTED_SURFACES, "quoted": QUOTED_SURFACES + ["a,b"]}
+    root = os.path.join(folder, "store")
+    token_store.csv_folder_to_store(folder, root, "ja")
+    stored = token_store.load_tokens(root, columns = ["hash", "Surface"]).to_pandas()
+    table = corpus_stats.read_csv_files([os.path.join(folder, f"{name}.csv") for name in expected], ["Surface"], workers = 1).to_pandas()
+    for name, surfaces in expected.items():
+        for reader, found in (("token store", stored), ("corpus_stats", table)):
+            got = found.loc[found["hash"] == name, "Surface"].tolist()
+            if got != surfaces:
+                raise ValueError(f"{reader} read {got} from {name}.csv, expected {surfaces}")
+
+def bench_token_store(options : dict):
+    """token_store.read_token_csv + TokenStoreWriter over the first tokenized csvs of every corpus, read back and checked"""
+
+    sys.path.insert(0, os.path.join(REPO, "workFolder4Phillip"))
+    import token_store
+    import corpus_stats
+
+    _check_quoting(token_store, corpus_stats)
+
+    root = tempfile.mkdtemp(prefix = "bench_token_store_")
+    latencies = []
+    rows = {}
+    size = 0
+    start = time.perf_counter()
+    for language, folder in CORPORA.items():
+        files = sorted(glob.glob(os.path.join(REPO, "policy_corpus", "corpus", folder, "*.csv")))
+        files = [file for file in files if os.path.basename(file) != "readability.csv"][:options["store_docs"]]
+        rows[language] = 0
+        with token_store.TokenStoreWriter(root, language) as writer:
+            for file in files:
+                t = time.perf_counter()
+                tokens = token_store.read_token_csv(file)
+                writer.add_frame(os.path.splitext(os.path.basename(file))[0], tokens)
+                latencies.append(time.perf_counter() - t)
+                rows[language] += len(tokens)
+                size += os.path.getsize(file)
+    elapsed = time.perf_counter() - start
+
+    #every csv row has to come back out of the store
+    stored = token_store.load_tokens(root, columns = ["language"]).to_pandas()["language"].value_counts().to_dict()
+    for language, count in rows.items():
+        if stored.get(language, 0) != count:
+            raise ValueError(f"token store has {stored.get(language, 0)} {language} rows, the csvs {count}")
+    return summarize(latencies, sum(rows.values()), size, elapsed)
+
+#-------- crawler: ---------#
+
+def _stub_site(pages : int, links_per_page : int, seed : int = 0):
+    """path -> html body of a deterministic site whose pages carry the sample policies as text"""
+
+    rng = random.Random(seed)
+    texts = [text for language in ("japanese", "korean", "chinese") for _, text in _read_samples(language)]
+    site = {}
+    for i in range(pages):
+        links = "".join(f'<li><a href="/page/{rng.randrange(pages)}">link {j}</a></li>' for j in range(links_per_page))
+        paragraphs = "".join(f"<p>{line}</p>" for line in texts[i % len(texts)].splitlines()[:60] if line.strip())
+        footer = '<footer><a href="/privacy">プライバシーポリシー</a></footer>'
+        site["/" if i == 0 else f"/page/{i}"] = f"<html><head><meta charset='utf-8'><title>page {i}</title></head><body><ul>{links}</ul>{paragraphs}{footer}</body></html>".encode("utf-8")
+    site["/privacy"] = site["/page/1"]
+    return site
+
+def _serve(site : dict):
+    """Starts a threaded HTTP server for site on a free local port, returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" #keep-alive, like real servers
+        disable_nagle_algorithm = True #headers and body are separate writes, Nagle + delayed ACK would add ~40 ms each
+
+        def do_GET(self):
+            body = site.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+def bench_html_extract(options : dict):
+    """html_extract.extract_page over the stub site pages"""
+
+    sys.path.insert(0, os.path.join(REPO, "crawler"))
+    import html_extract
+
+    pages = list(_stub_site(options["pages"], options["links_per_page"]).items())
+    latencies = []
+    links = 0
+    start = time.perf_counter()
+    for path, body in pages:
+        t = time.perf_counter()
+        links += len(html_extract.extract_page(body, f"http://stub.local{path}").links)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, links, sum(len(body) for _, body in pages), elapsed)
+
+def bench_crawl(options : dict):
+    """async_crawler.crawl_domain_async against the stub server, no politeness delay"""
+
+    sys.path.insert(0, os.path.join(REPO, "crawler"))
+    #error logs and the failure ledger are written relative to the working directory, keep them out of the repo
+    os.chdir(tempfile.mkdtemp(prefix = "bench_crawl_"))
+    os.makedirs("error_logging")
+    import asyncio
+    import async_crawler
+
+    site = _stub_site(options["pages"], options["links_per_page"])
+    server = _serve(site)
+    domain = f"127.0.0.1:{server.server_address[1]}"
+
+    latencies = []
+    served = [0]
+
+    class TimedFetcher(async_crawler.AsyncFetcher):
+        async def fetch(self, url):
+            t = time.perf_counter()
+            result = await super().fetch(url)
+            latencies.append(time.perf_counter() - t)
+            served[0] += len(result[1])
+            return result
+
+    async def run():
+        async with TimedFetcher(per_host = options["concurrency"], delay = 0) as fetcher:
+            return await async_crawler.crawl_domain_async(fetcher, f"http://{domain}/", domain, "benchmark", max_depth = options["max_depth"], concurrency = options["concurrency"])
+
+    try:
+        start = time.perf_counter()
+        _, links = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    return summarize(latencies, len(links), served[0], elapsed)
+
+#-------- runner: ---------#
+
+def _run_one(name : str, options : dict):
+    """Runs one benchmark (in a fresh process), returns its result with peak RSS"""
+
+    result = {"status": "ok"}
+    try:
+        result.update(globals()[f"bench_{name}"](options))
+    except ImportError as e:
+        #optional pipelines (e.g. konlpy needs a JVM) are reported instead of failing the suite
+        result = {"status": "skipped", "reason": f"{type(e).__name__}: {e}"}
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+def run_benchmark(name : str, options : dict, repeat : int = 1):
+    """Runs a benchmark repeat times, each in its own spawned process, and keeps the fastest run
+
+    Returns
+    -------
+    dict
+        result of the fastest run, with every run's seconds under "runs"
+    """
+
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        with context.Pool(1) as pool:
+            runs.append(pool.apply(_run_one, (name, options)))
+        if runs[-1]["status"] != "ok":
+            return runs[-1]
+
+    best = min(runs, key = lambda run: run["seconds"])
+    best["runs"] = [run["seconds"] for run in runs]
+    return best
+
+def environment():
+    """Machine, interpreter, package versions and git commit the results were measured with"""
+
+    from importlib import metadata
+
+    versions = {}
+    for package in ("sudachipy", "sudachidict_core", "sudachidict_full", "jieba", "konlpy", "pyarrow", "numpy", "pandas", "aiohttp", "lxml", "beautifulsoup4"):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            pass
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = REPO, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(), "commit": commit, "packages": versions}
+
+def compare(current : dict, previous : dict):
+    """Prints throughput and latency of current relative to previous"""
+
+    for name, result in current["benchmarks"].items():
+        before = previous.get("benchmarks", {}).get(name)
+        if result.get("status") != "ok" or not before or before.get("status") != "ok":
+            continue
+        changes = []
+        for key in ("docs_per_sec", "mb_per_sec", "p50_ms", "p99_ms", "peak_rss_mb"):
+            if result.get(key) and before.get(key):
+                changes.append(f"{key} {result[key] / before[key] - 1:+.1%}")
+        print(f"{name:>14}: " + ", ".join(changes))
+
+def main(argv : list = None):
+    parser = argparse.ArgumentParser(description = "Offline benchmarks of the tokenization pipelines and the crawler")
+    parser.add_argument("--only", nargs = "+", choices = BENCHMARKS, default = BENCHMARKS)
+    parser.add_argument("--repeat", type = int, default = 1, help = "runs per benchmark, the fastest is kept")
+    parser.add_argument("--sudachi-dict", default = "full", help = "sudachi dictionary for the japanese pipeline (full, core, small)")
+    parser.add_argument("--store-docs", type = int, default = 50, help = "csvs per corpus packed by the token_store benchmark")
+    parser.add_argument("--pages", type = int, default = 300, help = "pages of the stub site")
+    parser.add_argument("--links-per-page", type = int, default = 20)
+    parser.add_argument("--max-depth", type = int, default = 3)
+    parser.add_argument("--concurrency", type = int, default = 8)
+    parser.add_argument("--output", default = None, help = "result file, default benchmarks/results/<timestamp>.json")
+    parser.add_argument("--compare", default = None, help = "earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    options = {"sudachi_dict": args.sudachi_dict, "store_docs": args.store_docs, "pages": args.pages, "links_per_page": args.links_per_page, "max_depth": args.max_depth, "concurrency": args.concurrency}
+    results = {"timestamp": datetime.now().isoformat(timespec = "seconds"), "environment": environment(), "options": options, "benchmarks": {}}
+
+    for name in args.only:
+        result = run_benchmark(name, options, repeat = args.repeat)
+        results["benchmarks"][name] = result
+        if result["status"] == "ok":
+            print(f"{name:>14}: {result['docs']} docs, {result['docs_per_sec']:.1f} docs/s, {result['tokens_per_sec']:.0f} tokens/s, {result['mb_per_sec']:.2f} MB/s, p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, peak RSS {result['peak_rss_mb']:.0f} MB")
+        else:
+            print(f"{name:>14}: {result['status']} ({result['reason']})")
+
+    output = args.output or os.path.join(RESULTS, f"{results['timestamp'].replace(':', '-')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+    with open(output, "w", encoding = "utf-8") as f:
+        json.dump(results, f, ensure_ascii = False, indent = 1)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding = "utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -10,24 +10,39 @@
 # 4. Filtered Search Keywords:
 #    - Updated the search keywords to include only Chinese, Korean, Mandarin, and English.
 
+import asyncio
 import requests
-from bs4 import BeautifulSoup
 import random
 import time
-from urllib.parse import urlparse, urljoin
-from tinydb import TinyDB, Query
+from urllib.parse import urlparse, urljoin, unquote
+import threading
 from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
+from crawl_frontier import CrawlFrontier
+from crawl_store import CrawlStore, COUNTRY_BY_LANGUAGE
+from html_extract import extract_page
+from page_cache import get_page_cache
+from host_scheduler import get_host_scheduler, host_of, retry_after_seconds
+from failure_ledger import get_failure_ledger
 
 keywords_primary = [
     'privac', 'poli', 'ethic', 'terms', 'servic', 'policy', 'data', 'safety',  # English
     '隐私', '政策', '条款', '服务', '数据', '安全',  # Chinese
-    '개인정보', '정책', '이용약관', '서비스', '데이터', '안전'  # Korean
+    '개인정보', '정책', '이용약관', '서비스', '데이터', '안전',  # Korean
+    'プライバシー', '個人情報', 'ポリシー', '規約', '方針', 'サービス', 'データ', '安全'  # Japanese
 ]
 
-visited_links = set()
-all_links = []
+# keywords that on their own almost always mean a privacy policy, used to weight the best-first crawl
+keywords_strong = [
+    'privac', 'personal-information', 'personal_information', 'personalinfo',  # English
+    '隐私', '个人信息', '隱私', '個人資料',  # Chinese
+    '개인정보', '프라이버시',  # Korean
+    'プライバシー', '個人情報'  # Japanese
+]
+
+# a fetched page scoring at least this much counts as a found policy page in the best-first crawl
+CONFIDENT_POLICY_SCORE = 10
 
 def get_random_user_agent():
     user_agents = [
@@ -36,211 +51,229 @@ def get_random_user_agent():
     ]
     return random.choice(user_agents)
 
+# record a failed fetch in the failure ledger (for retry scheduling) and append a line to the error logger file of that country
+def log_error(country, domain, error, url=None):
+    get_failure_ledger().record_failure(url or f"https://{domain}", domain, country, error, stage="crawl")
+    error_files = {"Korea": "korea", "China": "china", "Japan": "japan"}
+    if country in error_files:
+        with open(f"error_logging/{error_files[country]}_error_log.txt", "a") as f:
+            f.write(f"{domain}: {error}\n")
+
+# links of a landing page, shared by the threaded and the async crawler
+def parse_home_page_links(url, content):
+    return extract_page(content, url).home_links
+
+# absolute http(s) links of all anchors on a page, shared by the threaded and the async crawler
+def parse_links(url, content):
+    return extract_page(content, url).links
+
+# (link, anchor text, in footer) for all anchors on a page, used for keyword scoring
+# (policy links usually live in the page footer)
+def parse_anchor_links(url, content):
+    return extract_page(content, url).anchors
+
+# keyword score of a link: strong keywords in the url or anchor text count most, footer links get a bonus
+def score_link(link, text="", in_footer=False):
+    url_text = unquote(link).lower()
+    text = text.lower()
+    score = 0
+
+    for keyword in keywords_strong:
+        if keyword in url_text:
+            score += 6
+        if keyword in text:
+            score += 8
+    for keyword in keywords_primary:
+        if keyword in url_text:
+            score += 1
+        if keyword in text:
+            score += 2
+
+    if in_footer and score > 0:
+        score += 3
+    return score
+
+# one GET of the threaded crawler: served from the page cache when possible, otherwise sent in the host's next
+# politeness slot with a timeout fitted to the host, and the outcome fed back into the host's rate
+def fetch_page(url):
+    scheduler = get_host_scheduler()
+    host = host_of(url)
+    sent_at = []
+
+    def before_request():
+        scheduler.wait(host)
+        sent_at.append(time.monotonic())
+
+    try:
+        page = get_page_cache().get(url, headers={'User-Agent': get_random_user_agent()}, timeout=scheduler.timeout(host), before_request=before_request)
+    except requests.RequestException as e:
+        if sent_at:
+            response = e.response
+            if response is None:
+                scheduler.record(host, time.monotonic() - sent_at[0], failed=True)
+            else:
+                scheduler.record(host, time.monotonic() - sent_at[0], status=response.status_code, retry_after=retry_after_seconds(response.headers.get("Retry-After")))
+        raise
+    if sent_at:
+        scheduler.record(host, time.monotonic() - sent_at[0], status=page.status)
+    get_failure_ledger().record_success(url, stage="crawl")
+    return page
+
 def extract_home_page_links(url, domain, country):
-    headers = {'User-Agent': get_random_user_agent()}
     try:
-        response = requests.get(url, timeout=5, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        links = set()
-        
-        for tag in soup.find_all(["a", "img", "script", "iframe", "form"], href=True, src=True, action=True):
-            link = tag.get("href") or tag.get("src") or tag.get("action")
-            if link:
-                links.add(urljoin(url, link))
-        
-        return list(links)
+        # usually the page the crawl fetched a moment ago, served from the shared page cache
+        page = fetch_page(url)
+        return parse_home_page_links(url, page.content)
     
     except requests.RequestException as e:
         # write into error logger file for that country
-        if country == "Korea":
-            with open("error_logging/korea_error_log.txt", "a") as f:
-                f.write(f"{domain}: {e}\n")
-        elif country == "China":
-            with open("error_logging/china_error_log.txt", "a") as f:
-                f.write(f"{domain}: {e}\n")
-        elif country == "Japan":
-            with open("error_logging/japan_error_log.txt", "a") as f:
-                f.write(f"{domain}: {e}\n")
-        
+        log_error(country, domain, e, url)
         print(f"Error accessing landing page & home links {url}: {e}")
         return []
 
-def extract_links(url, original_domain, country):
-    headers = {'User-Agent': get_random_user_agent()}
+def extract_links(url, original_domain, country, with_text=False):
     try:
-        response = requests.get(url, timeout=5, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
-        links = []
-        
-        for link in soup.find_all("a", href=True):
-            full_link = urljoin(url, link.get("href"))
-            if full_link and full_link.startswith("http"):
-                links.append(full_link)
-        return links
+        page = fetch_page(url)
+        if with_text:
+            return parse_anchor_links(url, page.content)
+        return parse_links(url, page.content)
     
     except requests.RequestException as e:
         # log error into an erro logger file with domain name, country, and error message. if file not exist, create a new file for that country
-        if country == "Korea":
-            with open("error_logging/korea_error_log.txt", "a") as f:
-                f.write(f"{original_domain}: {e}\n")
-        elif country == "China":
-            with open("error_logging/china_error_log.txt", "a") as f:
-                f.write(f"{original_domain}: {e}\n")
-        elif country == "Japan":
-            with open("error_logging/japan_error_log.txt", "a") as f:
-                f.write(f"{original_domain}: {e}\n")
+        log_error(country, original_domain, e, url)
         # print(f"Error accessing {url}: {e}")
         return []
 
-def recursive_extract(url, original_domain, country, max_depth=3, current_depth=0, start_time=None):
-    if current_depth > max_depth:
-        return
-    if start_time and datetime.now() - start_time > timedelta(minutes=3):
-        print(f"Stopping recursion for {original_domain} -> {url} after 3 minutes at depth {current_depth}")
-        return
-    if url not in visited_links:
-        visited_links.add(url)
-        if original_domain in url:
-
-            # print(f"Extracting links from: {url}")
+# crawl of one domain, all state lives in the frontier so domains can run in parallel threads
+# strategy "bfs" expands every in-domain link breadth first,
+# strategy "best_first" fetches the links with the most policy keywords first and stops once a policy page is found
+def crawl_domain(url, original_domain, country, max_depth=3, time_limit=180, frontier=None, strategy="bfs"):
+    best_first = strategy == "best_first"
+    if frontier is None:
+        frontier = CrawlFrontier(original_domain, max_depth=max_depth, time_limit=time_limit, max_pages=50 if best_first else None)
+    frontier.add(url, 0)
+    scheduler = get_host_scheduler()
+    ledger = get_failure_ledger()
+
+    while True:
+        next_url = frontier.pop()
+        if next_url is None:
+            break
+        url, depth = next_url
+
+        # dead links (404, SSL, ...) of earlier runs are not fetched again
+        if ledger.is_permanent(url) or not scheduler.allowed(url, get_page_cache(), headers={'User-Agent': get_random_user_agent()}):
+            continue
+        # a host backing off past the time limit would only hold this thread, give it to the next domain
+        if not scheduler.fits(host_of(url), frontier.time_left()):
+            print(f"Stopping crawl for {original_domain}, host is backing off past the time limit")
+            break
+
+        # print(f"Extracting links from: {url}")
+        if best_first:
+            links = extract_links(url, original_domain, country, with_text=True)
+            for link, text, in_footer in links:
+                frontier.add(link, depth + 1, priority=score_link(link, text, in_footer))
+        else:
             links = extract_links(url, original_domain, country)
             for link in links:
-                parsed_link = urlparse(link)
-                if parsed_link.netloc.endswith(original_domain):
-                    all_links.append(link)
-                    recursive_extract(link, original_domain, country, max_depth, current_depth + 1, start_time)
-                    time.sleep(1)
-
-def process_domains(domains, country, max_depth=3):
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        future_to_domain = {executor.submit(process_single_domain, domain, country, max_depth): domain for domain in domains}
-        for future in as_completed(future_to_domain):
-            domain = future_to_domain[future]
-            try:
-                future.result()
-            except Exception as e:
-                # log error into an erro logger file with domain name, country, and error message. if file not exist, create a new file for that country
-                if country == "Korea":
-                    with open("error_logging/korea_error_log.txt", "a") as f:
-                        f.write(f"{domain}: {e}\n")
-                elif country == "China":
-                    with open("error_logging/china_error_log.txt", "a") as f:
-                        f.write(f"{domain}: {e}\n")
-                elif country == "Japan":
-                    with open("error_logging/japan_error_log.txt", "a") as f:
-                        f.write(f"{domain}: {e}\n")
-
-                # print(f"Error processing domain {domain}: {e}")
-
-def process_single_domain(domain, country, max_depth):
-    global visited_links, all_links
-    visited_links = set()
+                frontier.add(link, depth + 1)
+
+        # an empty result means the fetch failed, so only a page that actually loaded ends the crawl
+        if best_first and links and frontier.priorities.get(url, 0) >= CONFIDENT_POLICY_SCORE:
+            print(f"Found policy page for {original_domain}: {url}")
+            break
+
+    if frontier.expired():
+        print(f"Stopping crawl for {original_domain} after {frontier.time_limit} seconds, {len(frontier)} links left in frontier")
+    return frontier.links
+
+def process_domains(domains, country, max_depth=3, engine="threads", strategy="bfs"):
+    # the async engine crawls all domains from one event loop with pooled keep-alive connections
+    if engine == "async":
+        from async_crawler import process_domains_async
+        asyncio.run(process_domains_async(domains, country, max_depth, strategy=strategy))
+    else:
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            future_to_domain = {executor.submit(process_single_domain, domain, country, max_depth, strategy): domain for domain in domains}
+            for future in as_completed(future_to_domain):
+                domain = future_to_domain[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    log_error(country, domain, e)
+
+                    # print(f"Error processing domain {domain}: {e}")
+
+    # the links are committed by the store's writer thread, wait until they are on disk
+    get_crawl_store().flush()
+
+def process_single_domain(domain, country, max_depth, strategy="bfs"):
     all_links = []
     home_links = []
-    start_time = datetime.now()
     try:
         print(f"Processing domain: {domain}")
-        recursive_extract(f"https://{domain}", domain, country, max_depth, start_time=start_time)
+        all_links = crawl_domain(f"https://{domain}", domain, country, max_depth, strategy=strategy)
         home_links = extract_home_page_links(f"https://{domain}", domain, country)
     except Exception as e:
         print(f"Error processing domain https://{domain}: {e}")
-        if country == "Korea":
-            with open("error_logging/korea_error_log.txt", "a") as f:
-                f.write(f"{domain}: {e}\n")
-        elif country == "China":
-            with open("error_logging/china_error_log.txt", "a") as f:
-                f.write(f"{domain}: {e}\n")
-        elif country == "Japan":
-            with open("error_logging/japan_error_log.txt", "a") as f:
-                f.write(f"{domain}: {e}\n")
+        log_error(country, domain, e)
         try:
-            recursive_extract(f"http://{domain}", domain, country, max_depth, start_time=start_time)
+            all_links += crawl_domain(f"http://{domain}", domain, country, max_depth, strategy=strategy)
             home_links = extract_home_page_links(f"http://{domain}", domain, country)
         except Exception as e:
             print(f"Error processing domain http://{domain} with http: {e}")
-            if country == "Korea":
-                with open("error_logging/korea_error_log.txt", "a") as f:
-                    f.write(f"{domain}: {e}\n")
-            elif country == "China":
-                with open("error_logging/china_error_log.txt", "a") as f:
-                    f.write(f"{domain}: {e}\n")
-            elif country == "Japan":
-                with open("error_logging/japan_error_log.txt", "a") as f:
-                    f.write(f"{domain}: {e}\n")
-
-    db = TinyDB('websites_by_language2.json')
-    table = db.table('policy_links')
-
-
-    timeprocessed = datetime.now().isoformat()
-    home_links = list(set(home_links))
-    all_links = list(set(all_links))
-    data = {
-        'domain': domain,
-        'home_links': home_links,
-        'all_links': all_links,
-        'timeprocessed': timeprocessed,
-        'country': country
-    }
-    table.insert(data)
+            log_error(country, domain, e)
 
-def get_remaining_domains(country_code):
+    save_domain_links(domain, country, home_links, all_links)
+
+# one store shared by all crawl threads, opened on first use
+crawl_store = None
+crawl_store_lock = threading.Lock()
+
+def get_crawl_store():
+    global crawl_store
+    with crawl_store_lock:
+        if crawl_store is None:
+            crawl_store = CrawlStore('crawl.db')
+    return crawl_store
 
-    all_country_websites = []
-    db = TinyDB('websites_by_language.json')
-    websites_table = db.table('websites')
-    Website = Query()
-    country_websites = websites_table.search(Website.language == country_code)
+def save_domain_links(domain, country, home_links, all_links):
+    # queued for the store's writer thread, committed in batches
+    get_crawl_store().add_policy_links(domain, country, set(home_links), set(all_links), datetime.now().isoformat())
+
+def get_remaining_domains(country_code):
+    store = get_crawl_store()
+    candidates = None
 
     if "zh" in country_code:
         with open("top3K_chinese_mandarin_domains.txt", "r") as f:
             chinese_mandarin_domains_to_process = f.readlines()
             # remove the newline character
-            chinese_mandarin_domains_to_process = [domain.strip() for domain in chinese_mandarin_domains_to_process]
-            all_country_websites = chinese_mandarin_domains_to_process
-            # print(all_country_websites[:10])
-
+            candidates = [domain.strip() for domain in chinese_mandarin_domains_to_process]
     else:
-        all_country_websites = [website['url'] for website in country_websites]
-        print(f"Total {country_code} websites: {len(set(all_country_websites))}")
-
-    # websites_to_process = korean_websites[:100]
-    # websites_to_process = [website['url'] for website in websites_to_process]
-    # print(websites_to_process)
-
-    policy_links_table = db.table('policy_links')
-    existing_policy_links = policy_links_table.all()
-    # only korean domains which has policy_link['country'] == "Korea"
-
+        print(f"Total {country_code} websites: {len(store.websites(country_code))}")
 
+    country = COUNTRY_BY_LANGUAGE.get(country_code, country_code)
+    print(f"Number of {country_code} domains in policy links table: {len(store.processed_domains(country))}")
 
-    if country_code == "ko":
-        existing_policy_links = [policy_link['domain'] for policy_link in existing_policy_links if policy_link['country'] == "Korea"]
-    elif country_code == "zh-cn" or country_code == "zh":
-        existing_policy_links = [policy_link['domain'] for policy_link in existing_policy_links if policy_link['country'] == "China"]
-    elif country_code == "ja":
-        existing_policy_links = [policy_link['domain'] for policy_link in existing_policy_links if policy_link['country'] == "Japan"]
-
-    # existing_policy_links = [policy_link['domain'] for policy_link in existing_policy_links if policy_link['country'] == "Korea"]
-    # existing_policy_links = [policy_link['domain'] for policy_link in existing_policy_links]
-    # existing_policy_links = [policy_link['domain'] for policy_link in existing_policy_links]
-
-    print(f"Number of {country_code} domains in policy links table: {len(set(existing_policy_links))}")
-    # print(existing_policy_links[:10])
-
-    remaining_websites = []
-
-    for each_website in all_country_websites:
-        if each_website not in existing_policy_links:
-            remaining_websites.append(each_website)
+    # indexed anti-join in sqlite instead of loading both tables
+    remaining_websites = store.remaining_domains(country_code, candidates=candidates)
     print(f"Total remaining website {len(remaining_websites)}")
 
     return remaining_websites
 
+# domains whose crawl had transient failures (timeouts, 5xx, DNS, ...) that are due for a retry; pages that
+# loaded last time come from the page cache, so a retry mostly refetches what failed
+def get_retry_domains(country):
+    retry_domains = get_failure_ledger().due_domains("crawl", country)
+    print(f"Total {country} domains due for a retry {len(retry_domains)}")
+    return retry_domains
+
 if __name__ == "__main__":
 
+    # process_domains(get_retry_domains("Japan"), "Japan")
+
     # ko_websites_to_process = get_remaining_domains("ko")
     # process_domains(ko_websites_to_process, "Korea")
 
@@ -252,4 +285,5 @@ if __name__ == "__main__":
     chinese_mandarin_websites_to_process = get_remaining_domains("zh")
     # print(len(chinese_mandarin_websites_to_process))
     process_domains(chinese_mandarin_websites_to_process, "China")
+    get_crawl_store().close()
 
@@ -0,0 +1,189 @@
+# Asyncio crawl engine for PolicyLinkExtractor.
+#
+# One aiohttp session is shared by every domain, so connections are kept alive and pooled per host
+# instead of doing a new TCP + TLS handshake for every link. Concurrency is bounded globally
+# (max_connections, derived from how many fetches can be in flight) and per host (per_host), and the politeness delay between two requests to the
+# same host is an asyncio.sleep, so waiting on one host never blocks the others. The interval, backoff,
+# robots.txt rules and request timeout of every host come from host_scheduler.HostScheduler.
+# With a page cache, pages fetched by the threaded crawler or the language classifier are served from
+# disk (or revalidated with a conditional GET) and only actual network requests wait for a politeness slot.
+# Error logs and failure ledger updates (sqlite and file writes) run in worker threads, never on the event loop.
+#
+# Usage, same arguments as the threaded version:
+#   process_domains(domains, "Japan", engine="async")
+# or directly:
+#   asyncio.run(process_domains_async(domains, "Japan"))
+
+import asyncio
+import time
+
+import aiohttp
+
+from PolicyLinkExtractor import get_random_user_agent, parse_links, parse_anchor_links, parse_home_page_links, score_link, log_error, save_domain_links, CONFIDENT_POLICY_SCORE
+from crawl_frontier import CrawlFrontier
+from page_cache import get_page_cache
+from host_scheduler import HostScheduler, get_host_scheduler, host_of, retry_after_seconds
+from failure_ledger import get_failure_ledger
+
+# upper bound of open connections, well below the usual limit of 1024 file descriptors
+MAX_CONNECTIONS = 256
+
+class AsyncFetcher:
+    """Shared aiohttp session with bounded global/per-host concurrency and per-host politeness from a HostScheduler"""
+
+    def __init__(self, max_connections=100, per_host=4, delay=1.0, timeout=5, cache=None, scheduler=None):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+        # page_cache.PageCache shared with the other fetch paths, None fetches everything from the network
+        self.cache = cache
+        # request slots, backoff and adaptive timeouts per host; delay is only the base interval of an own scheduler,
+        # delay=0 turns politeness off, so slow answers don't stretch the interval either (only backoff remains)
+        if scheduler is None:
+            scheduler = HostScheduler(base_delay=delay, latency_factor=1.0 if delay > 0 else 0.0)
+        self.scheduler = scheduler
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host, ttl_dns_cache=300, keepalive_timeout=30)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def allowed(self, url):
+        """robots.txt check, robots.txt goes through the page cache like any other page"""
+        return await self.scheduler.allowed_async(url, self.session, self.cache, {'User-Agent': get_random_user_agent()})
+
+    async def fetch(self, url):
+        """GET url, returns (final url, body bytes). Raises aiohttp.ClientError or asyncio.TimeoutError"""
+        host = host_of(url)
+        headers = {'User-Agent': get_random_user_agent()}
+        timeout = aiohttp.ClientTimeout(total=self.scheduler.timeout(host))
+        sent_at = []
+
+        async def before_request():
+            await self.scheduler.wait_async(host)
+            sent_at.append(time.monotonic())
+
+        try:
+            if self.cache is not None:
+                page = await self.cache.get_async(self.session, url, headers, before_request=before_request, timeout=timeout)
+                final_url, content, status = page.final_url, page.content, page.status
+            else:
+                await before_request()
+                async with self.session.get(url, headers=headers, timeout=timeout) as response:
+                    response.raise_for_status()
+                    final_url, content, status = str(response.url), await response.read(), response.status
+        except aiohttp.ClientResponseError as e:
+            if sent_at:
+                self.scheduler.record(host, time.monotonic() - sent_at[0], status=e.status, retry_after=retry_after_seconds((e.headers or {}).get("Retry-After")))
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if sent_at:
+                self.scheduler.record(host, time.monotonic() - sent_at[0], failed=True)
+            raise
+
+        if sent_at:
+            self.scheduler.record(host, time.monotonic() - sent_at[0], status=status)
+        return final_url, content
+
+async def crawl_domain_async(fetcher, start_url, original_domain, country, max_depth=3, time_limit=180, concurrency=4, strategy="bfs"):
+    """Crawl of one domain from its own frontier with `concurrency` fetches in flight. Returns (home_links, all_links)
+
+    Same scope and strategies as crawl_domain: in-domain links up to max_depth, stopped after time_limit seconds,
+    and with strategy="best_first" keyword scored links go first and the crawl ends at the first policy page.
+    All state is local to this call, so any number of domains can be crawled at once.
+    """
+    best_first = strategy == "best_first"
+    frontier = CrawlFrontier(original_domain, max_depth=max_depth, time_limit=time_limit, max_pages=50 if best_first else None)
+    frontier.add(start_url, 0)
+    home_links = []
+    in_flight = 0
+    found = False
+    given_up = False
+    progress = asyncio.Event()
+    ledger = get_failure_ledger()
+
+    async def worker():
+        nonlocal home_links, in_flight, found, given_up
+        while not found and not given_up:
+            next_url = frontier.pop()
+            if next_url is None:
+                # nothing queued right now, but a fetch in flight may still add links
+                if in_flight == 0 or frontier.expired():
+                    return
+                progress.clear()
+                await progress.wait()
+                continue
+
+            url, depth = next_url
+            in_flight += 1
+            try:
+                # dead links (404, SSL, ...) of earlier runs are not fetched again
+                # the ledger is only read (in a thread) for urls that failed before
+                if ledger.has_failure(url) and await asyncio.to_thread(ledger.is_permanent, url):
+                    continue
+                if not await fetcher.allowed(url):
+                    continue
+                # a host backing off past the time limit would only hold this domain's slot, give up on it
+                if not fetcher.scheduler.fits(host_of(url), frontier.time_left()):
+                    print(f"Stopping crawl for {original_domain}, host is backing off past the time limit")
+                    given_up = True
+                    continue
+                _, content = await fetcher.fetch(url)
+                if ledger.has_failure(url):
+                    await asyncio.to_thread(ledger.record_success, url, stage="crawl")
+                if depth == 0:
+                    home_links = parse_home_page_links(url, content)
+                if best_first:
+                    for link, text, in_footer in parse_anchor_links(url, content):
+                        frontier.add(link, depth + 1, priority=score_link(link, text, in_footer))
+                    if frontier.priorities.get(url, 0) >= CONFIDENT_POLICY_SCORE:
+                        print(f"Found policy page for {original_domain}: {url}")
+                        found = True
+                else:
+                    for link in parse_links(url, content):
+                        frontier.add(link, depth + 1)
+            except Exception as e:
+                await asyncio.to_thread(log_error, country, original_domain, e, url)
+            finally:
+                in_flight -= 1
+                progress.set()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    if frontier.expired():
+        print(f"Stopping crawl for {original_domain} after {time_limit} seconds, {len(frontier)} links left in frontier")
+    return home_links, frontier.links
+
+async def process_single_domain_async(fetcher, domain, country, max_depth=3, strategy="bfs", concurrency=4):
+    print(f"Processing domain: {domain}")
+    home_links, all_links = await crawl_domain_async(fetcher, f"https://{domain}", domain, country, max_depth, concurrency=concurrency, strategy=strategy)
+    if not all_links and not home_links:
+        home_links, all_links = await crawl_domain_async(fetcher, f"http://{domain}", domain, country, max_depth, concurrency=concurrency, strategy=strategy)
+    return home_links, all_links
+
+async def process_domains_async(domains, country, max_depth=3, max_domains=200, fetcher=None, strategy="bfs", concurrency=4):
+    """Async drop-in for process_domains. Crawls up to max_domains domains at once, each with `concurrency` fetches in flight"""
+    domains = list(domains)
+    if fetcher is None:
+        # no more connections than fetches can be in flight at once
+        max_connections = max(1, min(MAX_CONNECTIONS, min(len(domains), max_domains) * concurrency))
+        async with AsyncFetcher(max_connections=max_connections, per_host=concurrency, cache=get_page_cache(), scheduler=get_host_scheduler()) as fetcher:
+            return await process_domains_async(domains, country, max_depth, max_domains, fetcher, strategy, concurrency)
+
+    domain_slots = asyncio.Semaphore(max_domains)
+
+    async def run(domain):
+        async with domain_slots:
+            try:
+                home_links, all_links = await process_single_domain_async(fetcher, domain, country, max_depth, strategy=strategy, concurrency=concurrency)
+            except Exception as e:
+                await asyncio.to_thread(log_error, country, domain, e)
+                return
+            # only queues the row, the store's writer thread commits it
+            save_domain_links(domain, country, home_links, all_links)
+
+    await asyncio.gather(*(run(domain) for domain in domains))
@@ -0,0 +1,107 @@
+# Per-domain crawl frontier.
+#
+# Replaces the module-level visited_links/all_links of PolicyLinkExtractor: every domain gets its own
+# frontier, so crawls running in parallel threads (or coroutines) can't clobber each other's state.
+# URLs are normalized before dedup, scheduled by priority then breadth first (lower depth first,
+# then discovery order), and the crawl is bounded by depth, wall-clock time and number of pages.
+
+import heapq
+import itertools
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url):
+    """Canonical form used for dedup: lowercase scheme/host, no default port, no fragment, '/' for empty path"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+class CrawlFrontier:
+    """Priority ordered, breadth first frontier for a single domain
+
+    Parameters
+    ----------
+    domain : links are in scope if their host ends with this domain
+    max_depth : links deeper than this are recorded but never fetched
+    time_limit : seconds after which pop() stops handing out urls
+    max_pages : maximum number of urls handed out by pop(), None for no limit
+    """
+
+    def __init__(self, domain, max_depth=3, time_limit=180, max_pages=None):
+        self.domain = domain.lower()
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.max_pages = max_pages
+        self.start_time = time.monotonic()
+        self.pages_popped = 0
+        # every in-scope link discovered, normalized and in discovery order
+        self.links = []
+        # priority each link was added with
+        self.priorities = {}
+        self._seen = set()
+        self._popped = set()
+        self._heap = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def in_scope(self, url):
+        parts = urlsplit(url)
+        return parts.scheme in DEFAULT_PORTS and parts.netloc.lower().endswith(self.domain)
+
+    def add(self, url, depth, priority=0):
+        """Adds a discovered link, returns True if it was new and in scope"""
+        if not self.in_scope(url):
+            return False
+        url = normalize_url(url)
+
+        with self._lock:
+            if url in self._seen:
+                # seen again with a better score (e.g. more telling anchor text): requeue, pop() skips the stale entry
+                if priority > self.priorities[url] and url not in self._popped and depth <= self.max_depth:
+                    self.priorities[url] = priority
+                    heapq.heappush(self._heap, (-priority, depth, next(self._order), url))
+                return False
+            self._seen.add(url)
+            self.priorities[url] = priority
+            if depth > 0:
+                self.links.append(url)
+            if depth <= self.max_depth:
+                # heapq pops the smallest tuple: highest priority, then lowest depth, then oldest
+                heapq.heappush(self._heap, (-priority, depth, next(self._order), url))
+        return True
+
+    def expired(self):
+        return self.time_limit is not None and time.monotonic() - self.start_time > self.time_limit
+
+    def time_left(self):
+        """Seconds until the time limit, None without one"""
+        if self.time_limit is None:
+            return None
+        return self.time_limit - (time.monotonic() - self.start_time)
+
+    def exhausted(self):
+        return self.max_pages is not None and self.pages_popped >= self.max_pages
+
+    def pop(self):
+        """Next (url, depth) to fetch, or None if the frontier is empty or out of budget"""
+        with self._lock:
+            while self._heap and not self.expired() and not self.exhausted():
+                _, depth, _, url = heapq.heappop(self._heap)
+                if url in self._popped:
+                    continue
+                self._popped.add(url)
+                self.pages_popped += 1
+                return url, depth
+            return None
+
+    def __len__(self):
+        return len(self._heap)
@@ -0,0 +1,220 @@
+# SQLite storage for the crawler, replacing the TinyDB json files
+# (websites_by_language.json / websites_by_language2.json).
+#
+# The database runs in WAL mode so readers never block the writer. All inserts go through one writer
+# thread that commits in batches, so the 20 crawl threads only put rows on a queue instead of each
+# rewriting a whole json file. Queued rows are committed by close(), which also runs at interpreter exit, so
+# callers that never close the store (notebooks, library use) don't lose the last batch. url/domain/country/language are indexed, so resume queries like
+# "remaining domains for ja" are index lookups.
+#
+# One-shot migration of the old json files:
+#   python crawl_store.py migrate websites_by_language.json websites_by_language2.json
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS websites (
+    url TEXT PRIMARY KEY,
+    domain TEXT,
+    language TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_websites_language ON websites(language);
+CREATE INDEX IF NOT EXISTS idx_websites_domain ON websites(domain);
+
+CREATE TABLE IF NOT EXISTS policy_links (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL,
+    country TEXT,
+    home_links TEXT,
+    all_links TEXT,
+    timeprocessed TEXT,
+    UNIQUE (domain, country, timeprocessed)
+);
+CREATE INDEX IF NOT EXISTS idx_policy_links_domain_country ON policy_links(domain, country);
+CREATE INDEX IF NOT EXISTS idx_policy_links_country ON policy_links(country);
+"""
+
+# country names stored by the crawler for each langdetect code
+COUNTRY_BY_LANGUAGE = {"ko": "Korea", "ja": "Japan", "zh": "China", "zh-cn": "China", "zh-tw": "China"}
+
+# stop marker for the writer thread
+_STOP = object()
+
+def domain_of(url):
+    """Lowercase host of a url or bare domain, without a leading www."""
+    host = url.split("://", 1)[-1].split("/", 1)[0].lower()
+    return host[4:] if host.startswith("www.") else host
+
+class CrawlStore:
+    """SQLite store with a single batching writer thread; safe to use from any number of threads"""
+
+    def __init__(self, path="crawl.db", batch_size=500, batch_wait=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+        self._queue = queue.Queue()
+        self._closed = False
+        # a daemon thread joined by close() at exit: python waits for non-daemon threads before running atexit
+        # handlers, so a non-daemon writer would never be told to stop
+        self._writer = threading.Thread(target=self._write_loop, name="crawl-store-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        # sqlite connections can't be shared between threads, so every reading thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    #-------- writing --------#
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # gather whatever else arrives shortly after, and commit it all in one transaction
+            while item is not _STOP and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=self.batch_wait)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            rows = [entry for entry in batch if entry is not _STOP]
+            try:
+                with conn:
+                    for sql, params in rows:
+                        conn.execute(sql, params)
+            except sqlite3.Error as e:
+                print(f"Error writing {len(rows)} rows to {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if len(rows) != len(batch):
+                conn.close()
+                return
+
+    def add_website(self, url, language, timestamp=None):
+        self._queue.put((
+            "INSERT OR REPLACE INTO websites (url, domain, language, timestamp) VALUES (?, ?, ?, ?)",
+            (url, domain_of(url), language, timestamp or datetime.now().isoformat()),
+        ))
+
+    def add_policy_links(self, domain, country, home_links, all_links, timeprocessed=None):
+        self._queue.put((
+            "INSERT OR IGNORE INTO policy_links (domain, country, home_links, all_links, timeprocessed) VALUES (?, ?, ?, ?, ?)",
+            (domain, country, json.dumps(list(home_links), ensure_ascii=False), json.dumps(list(all_links), ensure_ascii=False),
+             timeprocessed or datetime.now().isoformat()),
+        ))
+
+    def flush(self):
+        """Blocks until every queued row is committed"""
+        self._queue.join()
+
+    def close(self):
+        """Commits the queued rows and stops the writer thread, safe to call more than once"""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(_STOP)
+        self._writer.join()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #-------- reading --------#
+
+    def processed_urls(self):
+        return {row[0] for row in self._reader().execute("SELECT url FROM websites")}
+
+    def websites(self, language):
+        return [row[0] for row in self._reader().execute("SELECT url FROM websites WHERE language = ?", (language,))]
+
+    def processed_domains(self, country):
+        return {row[0] for row in self._reader().execute("SELECT DISTINCT domain FROM policy_links WHERE country = ?", (country,))}
+
+    def remaining_domains(self, language, candidates=None):
+        """Websites of a language that have no policy_links row for the matching country yet
+
+        candidates replaces the websites table as the source list (e.g. the top3K chinese domain file)
+        """
+        country = COUNTRY_BY_LANGUAGE.get(language, language)
+        if candidates is not None:
+            done = self.processed_domains(country)
+            return [domain for domain in candidates if domain not in done]
+
+        rows = self._reader().execute(
+            "SELECT w.url FROM websites w WHERE w.language = ? "
+            "AND NOT EXISTS (SELECT 1 FROM policy_links p WHERE p.domain = w.url AND p.country = ?)",
+            (language, country),
+        )
+        return [row[0] for row in rows]
+
+    def policy_links(self, country=None):
+        sql = "SELECT domain, country, home_links, all_links, timeprocessed FROM policy_links"
+        params = ()
+        if country is not None:
+            sql += " WHERE country = ?"
+            params = (country,)
+        return [
+            {"domain": domain, "country": country, "home_links": json.loads(home_links), "all_links": json.loads(all_links), "timeprocessed": timeprocessed}
+            for domain, country, home_links, all_links, timeprocessed in self._reader().execute(sql, params)
+        ]
+
+#-------- migration from TinyDB --------#
+
+def migrate_tinydb(json_path, store):
+    """Copies the websites and policy_links tables of a TinyDB json file into the store. Safe to run twice"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        tables = json.load(f)
+
+    websites = tables.get("websites", {}).values()
+    for doc in websites:
+        store.add_website(doc["url"], doc.get("language"), doc.get("timestamp"))
+
+    policy_links = tables.get("policy_links", {}).values()
+    for doc in policy_links:
+        store.add_policy_links(doc["domain"], doc.get("country"), doc.get("home_links", []), doc.get("all_links", []), doc.get("timeprocessed"))
+
+    store.flush()
+    print(f"Migrated {len(websites)} websites and {len(policy_links)} policy link rows from {json_path}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "migrate":
+        print("usage: python crawl_store.py migrate <tinydb json> [<tinydb json> ...]")
+        sys.exit(1)
+
+    with CrawlStore() as store:
+        for json_path in sys.argv[2:]:
+            if os.path.exists(json_path):
+                migrate_tinydb(json_path, store)
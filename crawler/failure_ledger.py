@@ -0,0 +1,285 @@
+# Structured failure ledger for the crawler, next to the free text error_logging/*_error_log.txt files.
+#
+# Every failed fetch is one row per (stage, url): domain, country, error class, HTTP status, attempts and
+# the time it may be retried. Failures are split into transient ones (timeouts, connection resets, DNS,
+# 429/5xx, ...), which are retried with exponential backoff until max_attempts, and permanent ones
+# (404/410/403, SSL, invalid urls, redirect loops), which are never retried. A later success removes the row.
+#
+# Reruns ask the ledger what is due instead of re-queuing every line of the text logs:
+#   ledger = get_failure_ledger()
+#   ledger.due("classify")                      # urls for website_language_classifier
+#   ledger.due_domains("crawl", "Japan")        # domains for process_domains
+#
+# Old text logs can be imported once (first line of each "domain: message" entry):
+#   python failure_ledger.py import crawl Japan error_logging/japan_error_log.txt
+#   python failure_ledger.py import classify - error_urls.txt
+#   python failure_ledger.py report
+
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import aiohttp
+import requests
+
+from host_scheduler import retry_after_seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS failures (
+    stage TEXT NOT NULL,
+    url TEXT NOT NULL,
+    domain TEXT,
+    country TEXT,
+    error_class TEXT,
+    status INTEGER,
+    message TEXT,
+    transient INTEGER NOT NULL,
+    attempts INTEGER NOT NULL,
+    first_failed_at REAL,
+    last_failed_at REAL,
+    next_retry_at REAL,
+    PRIMARY KEY (stage, url)
+);
+CREATE INDEX IF NOT EXISTS idx_failures_due ON failures(stage, transient, next_retry_at);
+CREATE INDEX IF NOT EXISTS idx_failures_domain ON failures(domain);
+"""
+
+# statuses worth asking again later, every other 4xx/5xx is taken as the final answer
+TRANSIENT_STATUSES = {408, 425, 429, 500, 502, 503, 504, 520, 521, 522, 523, 524, 530}
+
+# error classes that never fix themselves by waiting
+PERMANENT_CLASSES = {"http", "ssl", "invalid_url", "redirects"}
+
+def classify_error(error):
+    """(error_class, status, transient) of an exception raised by requests or aiohttp"""
+    if isinstance(error, (requests.HTTPError, aiohttp.ClientResponseError)):
+        response = getattr(error, "response", None)
+        status = response.status_code if response is not None else getattr(error, "status", None)
+        return "http", status, status in TRANSIENT_STATUSES
+    if isinstance(error, (requests.exceptions.SSLError, aiohttp.ClientSSLError)):
+        return "ssl", None, False
+    if isinstance(error, (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema, aiohttp.InvalidURL)):
+        return "invalid_url", None, False
+    if isinstance(error, (requests.TooManyRedirects, aiohttp.TooManyRedirects)):
+        return "redirects", None, False
+    error_class, status, transient = classify_message(str(error))
+    if error_class == "other" and isinstance(error, (requests.Timeout, TimeoutError)):
+        return "timeout", None, True
+    if error_class == "other" and isinstance(error, (requests.ConnectionError, aiohttp.ClientError)):
+        return "connection", None, True
+    return error_class, status, transient
+
+# message patterns of the text logs (and of exceptions that only tell by their text), checked in order
+MESSAGE_PATTERNS = [
+    (re.compile(r"(\d{3}) (?:Client|Server) Error"), "http"),
+    (re.compile(r"SSLError|SSL:|CERTIFICATE"), "ssl"),
+    (re.compile(r"NameResolutionError|getaddrinfo|Name or service not known|nodename nor servname"), "dns"),
+    (re.compile(r"Read timed out|ReadTimeout"), "read_timeout"),
+    (re.compile(r"ConnectTimeout|Connection to .* timed out|connect timeout"), "connect_timeout"),
+    (re.compile(r"ConnectionResetError|RemoteDisconnected|Connection aborted|ConnectionRefused|Failed to establish"), "connection"),
+    (re.compile(r"Exceeded \d+ redirects"), "redirects"),
+    (re.compile(r"Invalid URL|No connection adapters|MissingSchema"), "invalid_url"),
+    (re.compile(r"ProxyError|Unable to connect to proxy"), "proxy"),
+]
+
+def classify_message(message):
+    """(error_class, status, transient) from an error message, for text logs and unrecognised exceptions"""
+    for pattern, error_class in MESSAGE_PATTERNS:
+        match = pattern.search(message)
+        if match is None:
+            continue
+        if error_class == "http":
+            status = int(match.group(1))
+            return "http", status, status in TRANSIENT_STATUSES
+        return error_class, None, error_class not in PERMANENT_CLASSES
+    # anything else (parse errors, bugs fixed since) gets the normal retry budget
+    return "other", None, True
+
+class FailureLedger:
+    """Thread-safe sqlite ledger of failed fetches
+
+    Parameters
+    ----------
+    path : sqlite file
+    base_delay : seconds before the first retry of a transient failure, doubled with every attempt
+    max_delay : upper bound of the retry delay
+    max_attempts : a transient failure seen this often is given up (becomes permanent)
+    """
+
+    def __init__(self, path="failures.db", base_delay=3600, max_delay=7 * 24 * 3600, max_attempts=4):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # (stage, url) of every row, so a success only touches the database if the url failed before
+        self._keys = set(self._conn.execute("SELECT stage, url FROM failures"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    #-------- writing --------#
+
+    def retry_delay(self, attempts, retry_after=None):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return max(delay, retry_after) if retry_after else delay
+
+    def record_failure(self, url, domain, country, error, stage="crawl", now=None):
+        """Records one failed fetch of url (error is an exception or a message), returns True if it will be retried"""
+        if isinstance(error, BaseException):
+            error_class, status, transient = classify_error(error)
+            response = getattr(error, "response", None)
+            headers = response.headers if response is not None else getattr(error, "headers", None)
+            retry_after = retry_after_seconds(headers.get("Retry-After")) if headers else None
+        else:
+            error_class, status, transient = classify_message(error)
+            retry_after = None
+        return self._record(stage, url, domain, country, error_class, status, transient, str(error)[:500], retry_after, now)
+
+    def _record(self, stage, url, domain, country, error_class, status, transient, message, retry_after=None, now=None):
+        now = now or time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT attempts, first_failed_at FROM failures WHERE stage = ? AND url = ?", (stage, url)).fetchone()
+            attempts, first_failed_at = (row[0] + 1, row[1]) if row else (1, now)
+            transient = transient and attempts < self.max_attempts
+            next_retry_at = now + self.retry_delay(attempts, retry_after) if transient else None
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (stage, url, domain, country, error_class, status, message, int(transient), attempts, first_failed_at, now, next_retry_at),
+                )
+            self._keys.add((stage, url))
+        return transient
+
+    def record_success(self, url, stage="crawl"):
+        """Forgets the failures of url once it was fetched"""
+        if (stage, url) not in self._keys:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM failures WHERE stage = ? AND url = ?", (stage, url))
+            self._keys.discard((stage, url))
+
+    def import_text_log(self, path, stage="crawl", country=None):
+        """Imports a "domain: message" text log, returns the number of entries imported
+
+        The crawl logs name the domain for every failed page, so all lines of one target count as one failed
+        attempt, which is transient if any of its lines is. The log has no timestamps, so transient entries
+        are due right away.
+        """
+        entries = {}
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                # continuation lines of multi line messages start with whitespace or punctuation, not with a domain
+                match = re.match(r"^([\w.-]+\.[A-Za-z]{2,}(?::\d+)?|https?://\S+?): (.*)$", line.rstrip("\n"))
+                if match is None:
+                    continue
+                # the logs name what was fetched: a bare domain for the classifier, the domain for crawl errors
+                target, message = match.groups()
+                error_class, status, transient = classify_message(message)
+                previous = entries.get(target)
+                if previous is None or transient or not previous[2]:
+                    entries[target] = (error_class, status, transient, message[:500])
+
+        now = time.time()
+        for target, (error_class, status, transient, message) in entries.items():
+            domain = target.split("://", 1)[-1].split("/", 1)[0]
+            self._record(stage, target, domain, country, error_class, status, transient, message, now=now - self.retry_delay(1))
+        return len(entries)
+
+    #-------- retry scheduling --------#
+
+    def due(self, stage="crawl", country=None, now=None, limit=None):
+        """Urls whose transient failure may be retried now, oldest due first"""
+        query = "SELECT url FROM failures WHERE stage = ? AND transient = 1 AND next_retry_at <= ?"
+        params = [stage, now or time.time()]
+        if country is not None:
+            query += " AND country = ?"
+            params.append(country)
+        query += " ORDER BY next_retry_at"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query, params)]
+
+    def due_domains(self, stage="crawl", country=None, now=None):
+        """Domains with at least one failure due for a retry"""
+        query = "SELECT DISTINCT domain FROM failures WHERE stage = ? AND transient = 1 AND next_retry_at <= ?"
+        params = [stage, now or time.time()]
+        if country is not None:
+            query += " AND country = ?"
+            params.append(country)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query, params)]
+
+    def waiting(self, stage="crawl", now=None):
+        """Urls that should not be fetched now: permanent failures and transient ones not due yet"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url FROM failures WHERE stage = ? AND (transient = 0 OR next_retry_at > ?)", (stage, now or time.time()))
+            return {row[0] for row in rows}
+
+    def has_failures(self, stage):
+        return any(key[0] == stage for key in self._keys)
+
+    def has_failure(self, url, stage="crawl"):
+        """True if url has a failure row. Only checks memory, never the database"""
+        return (stage, url) in self._keys
+
+    def is_permanent(self, url, stage="crawl"):
+        """True if url failed for good, so it should not be fetched again"""
+        if (stage, url) not in self._keys:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT transient FROM failures WHERE stage = ? AND url = ?", (stage, url)).fetchone()
+        return row is not None and not row[0]
+
+    def report(self, stage=None):
+        """Counts per stage, error class and transient/permanent"""
+        query = "SELECT stage, error_class, transient, COUNT(*) FROM failures"
+        params = []
+        if stage is not None:
+            query += " WHERE stage = ?"
+            params.append(stage)
+        query += " GROUP BY stage, error_class, transient ORDER BY COUNT(*) DESC"
+        with self._lock:
+            return [{"stage": s, "error_class": c, "transient": bool(t), "count": n} for s, c, t, n in self._conn.execute(query, params)]
+
+# one ledger shared by every crawl thread, opened on first use
+failure_ledger = None
+failure_ledger_lock = threading.Lock()
+
+def get_failure_ledger(path="failures.db"):
+    global failure_ledger
+    with failure_ledger_lock:
+        if failure_ledger is None:
+            failure_ledger = FailureLedger(path)
+    return failure_ledger
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 5 and sys.argv[1] == "import":
+        stage, country = sys.argv[2], None if sys.argv[3] == "-" else sys.argv[3]
+        with FailureLedger() as ledger:
+            for path in sys.argv[4:]:
+                print(f"Imported {ledger.import_text_log(path, stage, country)} failures from {path}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "report":
+        with FailureLedger() as ledger:
+            for row in ledger.report():
+                print(row)
+    else:
+        print("usage: python failure_ledger.py import <stage> <country or -> <text log> [<text log> ...]")
+        print("       python failure_ledger.py report")
+        sys.exit(1)
@@ -0,0 +1,228 @@
+# Per-host politeness for both crawl engines.
+#
+# Replaces the fixed time.sleep(1) after every page and the hard coded 5s timeouts. Every host gets its own
+# request interval: at least the base delay or the robots.txt Crawl-delay, stretched when the host answers
+# slowly, doubled with exponential backoff (or Retry-After) on 429/5xx/timeouts and relaxed again on
+# success. Request timeouts follow the observed latency of the host instead of one value for every site.
+#
+# reserve() only books the next slot of a host and returns how long to wait, so the threaded crawler sleeps
+# and the async crawler awaits; waiting on one host never holds a slot of another. A domain whose next slot
+# lies beyond its crawl deadline is dropped instead of sleeping (see fits()), so a throttled or failing
+# site gives its worker back to the other domains.
+#
+# robots.txt is fetched through the shared page cache when one is given (so it is also kept between runs)
+# and parsed once per host per robots_ttl.
+
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import aiohttp
+import requests
+
+# statuses that mean "slow down", everything else counts as a healthy answer
+BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+
+class HostState:
+    def __init__(self, delay):
+        # current interval between two requests to this host
+        self.delay = delay
+        # lower bound of delay: base delay or robots.txt Crawl-delay
+        self.min_delay = delay
+        # earliest time the next request may start
+        self.next_slot = 0.0
+        # exponentially weighted response time in seconds, None until the first answer
+        self.latency = None
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        # parsed robots.txt, None while unknown
+        self.robots = None
+        self.robots_loaded_at = None
+
+def host_of(url):
+    return (urlsplit(url).hostname or "").lower()
+
+def retry_after_seconds(value):
+    """Retry-After header in seconds (only the delta-seconds form), None if missing or a date"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+class HostScheduler:
+    """Thread-safe per-host request scheduler, shared by all domains of a crawl
+
+    Parameters
+    ----------
+    base_delay : minimum seconds between two requests to the same host
+    max_delay : upper bound of the interval and of a backoff
+    backoff_base : first backoff in seconds, doubled with every consecutive failure
+    initial_timeout : request timeout of a host that has not answered yet
+    min_timeout, max_timeout : bounds of the adaptive request timeout
+    timeout_factor : timeout is this many times the host's average latency
+    latency_factor : interval is stretched to this many times the host's average latency
+    latency_weight : weight of the newest sample in the latency average
+    robots_ttl : seconds a parsed robots.txt is reused
+    user_agent : agent name matched against robots.txt rules
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, backoff_base=1.0, initial_timeout=10.0, min_timeout=3.0, max_timeout=20.0,
+                 timeout_factor=4.0, latency_factor=1.0, latency_weight=0.3, robots_ttl=24 * 3600, user_agent="*"):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.backoff_base = backoff_base
+        self.initial_timeout = initial_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.latency_factor = latency_factor
+        self.latency_weight = latency_weight
+        self.robots_ttl = robots_ttl
+        self.user_agent = user_agent
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.base_delay)
+        return state
+
+    #-------- slots --------#
+
+    def reserve(self, host):
+        """Books the next request slot of host, returns the seconds to wait before sending it"""
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            slot = max(now, state.next_slot)
+            state.next_slot = slot + state.delay
+            return slot - now
+
+    def wait(self, host):
+        time.sleep(self.reserve(host))
+
+    async def wait_async(self, host):
+        await asyncio.sleep(self.reserve(host))
+
+    def fits(self, host, time_left):
+        """False if the next free slot of host comes later than time_left seconds from now"""
+        if time_left is None:
+            return True
+        with self._lock:
+            state = self.hosts.get(host)
+            return state is None or state.next_slot - time.monotonic() <= time_left
+
+    def timeout(self, host):
+        """Request timeout for host: a multiple of its average latency, initial_timeout until it answered once"""
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is None or state.latency is None:
+                return self.initial_timeout
+            return min(self.max_timeout, max(self.min_timeout, state.latency * self.timeout_factor))
+
+    def record(self, host, latency=None, status=None, failed=False, retry_after=None):
+        """Outcome of one request: latency in seconds, HTTP status, failed for timeouts/connection errors"""
+        with self._lock:
+            state = self._state(host)
+            state.requests += 1
+
+            if failed or status in BACKOFF_STATUSES:
+                state.failures += 1
+                state.consecutive_failures += 1
+                # exponential backoff with jitter, so hosts throttled together don't retry in lockstep
+                backoff = min(self.max_delay, self.backoff_base * 2 ** (state.consecutive_failures - 1)) * random.uniform(0.75, 1.25)
+                if retry_after is not None:
+                    backoff = max(backoff, min(self.max_delay, retry_after))
+                state.delay = min(self.max_delay, max(state.delay * 2, state.min_delay, self.backoff_base))
+                state.next_slot = max(state.next_slot, time.monotonic() + backoff)
+                return
+
+            state.consecutive_failures = 0
+            if latency is not None:
+                state.latency = latency if state.latency is None else (1 - self.latency_weight) * state.latency + self.latency_weight * latency
+            # relax towards the target interval, a slow host keeps a longer one
+            target = max(state.min_delay, (state.latency or 0) * self.latency_factor)
+            state.delay = min(self.max_delay, max(target, state.delay * 0.75))
+
+    #-------- robots.txt --------#
+
+    def _robots_stale(self, host):
+        state = self.hosts.get(host)
+        return state is None or state.robots_loaded_at is None or time.monotonic() - state.robots_loaded_at > self.robots_ttl
+
+    def _set_robots(self, host, text):
+        # a robots.txt that can't be fetched allows everything
+        parser = RobotFileParser()
+        parser.parse((text or "").splitlines())
+        delay = parser.crawl_delay(self.user_agent)
+        with self._lock:
+            state = self._state(host)
+            state.robots = parser
+            state.robots_loaded_at = time.monotonic()
+            if delay is not None:
+                state.min_delay = min(self.max_delay, max(self.base_delay, float(delay)))
+                state.delay = max(state.delay, state.min_delay)
+
+    def _can_fetch(self, host, url):
+        state = self.hosts.get(host)
+        return state is None or state.robots is None or state.robots.can_fetch(self.user_agent, url)
+
+    def allowed(self, url, cache=None, headers=None):
+        """robots.txt check, fetching robots.txt of the host on first use (through the page cache if given)"""
+        host = host_of(url)
+        if self._robots_stale(host):
+            parts = urlsplit(url)
+            robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+            try:
+                if cache is not None:
+                    content = cache.get(robots_url, headers=headers, timeout=self.min_timeout).content
+                else:
+                    response = requests.get(robots_url, headers=headers, timeout=self.min_timeout)
+                    response.raise_for_status()
+                    content = response.content
+                text = content.decode("utf-8", "replace")
+            except Exception:
+                text = None
+            self._set_robots(host, text)
+        return self._can_fetch(host, url)
+
+    async def allowed_async(self, url, session, cache=None, headers=None):
+        """allowed() for an aiohttp session"""
+        host = host_of(url)
+        if self._robots_stale(host):
+            parts = urlsplit(url)
+            robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+            timeout = aiohttp.ClientTimeout(total=self.min_timeout)
+            try:
+                if cache is not None:
+                    content = (await cache.get_async(session, robots_url, headers, timeout=timeout)).content
+                else:
+                    async with session.get(robots_url, headers=headers, timeout=timeout) as response:
+                        response.raise_for_status()
+                        content = await response.read()
+                text = content.decode("utf-8", "replace")
+            except Exception:
+                text = None
+            self._set_robots(host, text)
+        return self._can_fetch(host, url)
+
+    def stats(self):
+        """host -> delay, latency, requests, failures"""
+        with self._lock:
+            return {host: {"delay": state.delay, "latency": state.latency, "requests": state.requests, "failures": state.failures} for host, state in self.hosts.items()}
+
+# one scheduler shared by every crawl thread and coroutine of the process
+host_scheduler = None
+host_scheduler_lock = threading.Lock()
+
+def get_host_scheduler():
+    global host_scheduler
+    with host_scheduler_lock:
+        if host_scheduler is None:
+            host_scheduler = HostScheduler()
+    return host_scheduler
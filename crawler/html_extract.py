@@ -0,0 +1,251 @@
+# Pluggable HTML parsing for the crawler.
+#
+# The crawler only ever needs three things from a page: the anchor links, the landing page links and the
+# visible text. Building a full BeautifulSoup tree for that is the slowest part of a fetch, so by default
+# pages are parsed in one streaming pass that collects all three without building a tree:
+#   "stream" - stdlib html.parser events (the same tokenizer bs4's html.parser builder uses)
+#   "lxml"   - libxml2 C parser driven through a parser target, also without a tree. Fastest, same links,
+#              but libxml2 closes misnested tags its own way so text grouping can differ on broken markup
+#   "bs4"    - the original BeautifulSoup code path, kept for comparison
+# Only the first max_bytes of a page are parsed.
+
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, UnicodeDammit
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+DEFAULT_BACKEND = "stream"
+MAX_BYTES = 2 * 1024 * 1024
+
+# text inside these tags is not visible (matches what bs4's get_text leaves out, including ruby readings)
+HIDDEN_TAGS = {"script", "style", "template", "rt", "rp"}
+HOME_LINK_TAGS = {"a", "img", "script", "iframe", "form"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_\-]+)""", re.IGNORECASE)
+
+class PageExtract:
+    """Everything the crawler reads from one page"""
+
+    def __init__(self, links, anchors, home_links, text):
+        # absolute http(s) links of <a href>, in page order, duplicates kept
+        self.links = links
+        # (link, anchor text, in footer) for the same anchors
+        self.anchors = anchors
+        # landing page links, same selection as extract_home_page_links
+        self.home_links = home_links
+        # visible text, same as soup.get_text(separator=' ', strip=True)
+        self.text = text
+
+def decode_html(content, max_bytes=MAX_BYTES):
+    """bytes -> str: BOM / <meta charset> / utf-8, falling back to bs4's UnicodeDammit"""
+    if isinstance(content, str):
+        return content[:max_bytes]
+    truncated = len(content) > max_bytes
+    content = content[:max_bytes]
+
+    if content.startswith(b"\xef\xbb\xbf"):
+        return content[3:].decode("utf-8", errors="ignore")
+    match = META_CHARSET_RE.search(content[:4096])
+    encodings = [match.group(1).decode("ascii").lower()] if match else []
+    encodings.append("utf-8")
+
+    for encoding in encodings:
+        # a page cut at max_bytes may end in the middle of a character
+        for cut in range(4 if truncated else 1):
+            try:
+                return content[:len(content) - cut].decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                continue
+    return UnicodeDammit(content).unicode_markup or ""
+
+class _Collector:
+    """Parser target: start/end/data/comment events in, PageExtract out. Used by both streaming backends"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.links = []
+        # [link, text parts, title, in footer] in document order, finished in close()
+        self._anchors = []
+        self.home_links = set()
+        self.strings = []
+        self._buffer = []
+        self._hidden = 0
+        # open elements as (tag, is footer, anchor or None), so text and footers are attributed like in a tree
+        self._stack = []
+        self._footer = 0
+        self._open_anchors = []
+
+    def _flush(self):
+        # one text node ends at the next tag or comment, like a NavigableString
+        if self._buffer:
+            text = "".join(self._buffer).strip()
+            if text and not self._hidden:
+                self.strings.append(text)
+                for anchor in self._open_anchors:
+                    anchor[1].append(text)
+            self._buffer = []
+
+    def start(self, tag, attrs):
+        self._flush()
+        tag = tag.lower()
+        attrs = dict(attrs)
+
+        if tag in HOME_LINK_TAGS and "href" in attrs and "src" in attrs and "action" in attrs:
+            # bs4 find_all(href=True, src=True, action=True) needs all three attributes on one tag
+            link = attrs.get("href") or attrs.get("src") or attrs.get("action")
+            if link:
+                self.home_links.add(urljoin(self.base_url, link))
+
+        anchor = None
+        if tag == "a" and "href" in attrs:
+            full_link = urljoin(self.base_url, attrs["href"] or "")
+            if full_link and full_link.startswith("http"):
+                self.links.append(full_link)
+                anchor = [full_link, [], attrs.get("title"), self._footer > 0]
+                self._anchors.append(anchor)
+                self._open_anchors.append(anchor)
+
+        if tag in VOID_TAGS:
+            return
+        if tag in HIDDEN_TAGS:
+            self._hidden += 1
+        marker = " ".join([attrs.get("id") or "", attrs.get("class") or ""]).lower()
+        is_footer = tag == "footer" or "foot" in marker
+        self._stack.append((tag, is_footer, anchor))
+        self._footer += is_footer
+
+    def end(self, tag):
+        self._flush()
+        tag = tag.lower()
+        # close the innermost matching element and anything left open inside it, stray end tags are ignored
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                for name, is_footer, anchor in self._stack[i:]:
+                    self._footer -= is_footer
+                    if name in HIDDEN_TAGS:
+                        self._hidden -= 1
+                    if anchor is not None:
+                        # by identity, two anchors can have equal contents
+                        self._open_anchors = [a for a in self._open_anchors if a is not anchor]
+                del self._stack[i:]
+                break
+
+    def data(self, data):
+        self._buffer.append(data)
+
+    def cdata(self, data):
+        # CDATA sections are separate strings in bs4
+        self._flush()
+        self._buffer.append(data)
+        self._flush()
+
+    def comment(self, text):
+        self._flush()
+
+    def close(self):
+        self._flush()
+        anchors = [(link, " ".join(filter(None, [" ".join(text), title])), in_footer) for link, text, title, in_footer in self._anchors]
+        return PageExtract(self.links, anchors, list(self.home_links), " ".join(self.strings))
+
+class _StreamParser(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+    def handle_comment(self, data):
+        self.collector.comment(data)
+
+    def handle_decl(self, decl):
+        self.collector.comment(decl)
+
+    def handle_pi(self, data):
+        self.collector.comment(data)
+
+    def unknown_decl(self, data):
+        if data.startswith("CDATA["):
+            self.collector.cdata(data[len("CDATA["):])
+        else:
+            self.collector.comment(data)
+
+def _extract_stream(html, base_url):
+    collector = _Collector(base_url)
+    parser = _StreamParser(collector)
+    parser.feed(html)
+    parser.close()
+    return collector.close()
+
+def _extract_lxml(html, base_url):
+    if etree is None:
+        return _extract_stream(html, base_url)
+    collector = _Collector(base_url)
+    parser = etree.HTMLParser(target=collector, recover=True)
+    parser.feed(html)
+    # close() returns whatever the target's close() returns
+    return parser.close() if html.strip() else collector.close()
+
+def _bs4_in_footer(tag):
+    for parent in tag.parents:
+        if parent.name == "footer":
+            return True
+        marker = " ".join([parent.get("id") or ""] + (parent.get("class") or [])).lower() if parent.name else ""
+        if "foot" in marker:
+            return True
+    return False
+
+def _extract_bs4(html, base_url):
+    soup = BeautifulSoup(html, "html.parser")
+    links = []
+    anchors = []
+    for tag in soup.find_all("a", href=True):
+        full_link = urljoin(base_url, tag.get("href"))
+        if full_link and full_link.startswith("http"):
+            links.append(full_link)
+            text = " ".join(filter(None, [tag.get_text(" ", strip=True), tag.get("title")]))
+            anchors.append((full_link, text, _bs4_in_footer(tag)))
+
+    home_links = set()
+    for tag in soup.find_all(list(HOME_LINK_TAGS), href=True, src=True, action=True):
+        link = tag.get("href") or tag.get("src") or tag.get("action")
+        if link:
+            home_links.add(urljoin(base_url, link))
+
+    return PageExtract(links, anchors, list(home_links), soup.get_text(separator=" ", strip=True))
+
+BACKENDS = {"stream": _extract_stream, "lxml": _extract_lxml, "bs4": _extract_bs4}
+
+def extract_page(content, base_url="", backend=None, max_bytes=MAX_BYTES):
+    """Links, landing page links and visible text of a page in one pass
+
+    Parameters
+    ----------
+    content : page body, bytes (decoded here) or str
+    base_url : url the page was fetched from, relative links are resolved against it
+    backend : "stream", "lxml" or "bs4", DEFAULT_BACKEND if None
+    max_bytes : only this much of the page is parsed
+    """
+    html = decode_html(content, max_bytes)
+    return BACKENDS[backend or DEFAULT_BACKEND](html, base_url)
+
+def extract_text(content, backend=None, max_bytes=MAX_BYTES):
+    return extract_page(content, "", backend, max_bytes).text
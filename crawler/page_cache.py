@@ -0,0 +1,260 @@
+# Shared on-disk page cache for every fetch path of the crawler.
+#
+# The landing page of a domain used to be downloaded by website_language_classifier, again by the crawl
+# (depth 0) and a third time by extract_home_page_links, and policy pages again by the text crawl. Pages are
+# now kept on disk keyed by normalized URL: within `ttl` seconds a page is served from disk, after that it is
+# revalidated with If-None-Match / If-Modified-Since so an unchanged page costs a 304 instead of a download.
+#
+# Layout (WARC-like: response metadata in an index, bodies content addressed so identical pages are stored once):
+#   page_cache/index.db                 url key -> final url, status, ETag, Last-Modified, sha256, timestamps
+#   page_cache/objects/ab/abcdef....gz  gzip of the body with that sha256
+#
+# Usage:
+#   cache = get_page_cache()
+#   content = cache.get(url, headers={'User-Agent': ...}, timeout=5).content
+#   cache.evict()   # drop entries not validated for max_age seconds and their unreferenced bodies
+
+import asyncio
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+from crawl_frontier import normalize_url
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url_key TEXT PRIMARY KEY,
+    final_url TEXT,
+    status INTEGER,
+    content_type TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    sha256 TEXT,
+    size INTEGER,
+    fetched_at REAL,
+    validated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_pages_validated_at ON pages(validated_at);
+CREATE INDEX IF NOT EXISTS idx_pages_sha256 ON pages(sha256);
+"""
+
+class CachedPage:
+    """A page as returned by PageCache.get, from disk or from the network"""
+
+    def __init__(self, url, final_url, status, content, content_type=None, etag=None, last_modified=None, from_cache=False, revalidated=False):
+        self.url = url
+        # url after redirects
+        self.final_url = final_url
+        self.status = status
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        # served without a full download: fresh on disk, or a 304
+        self.from_cache = from_cache
+        # the server was asked and answered 304 Not Modified
+        self.revalidated = revalidated
+
+class CacheEntry:
+    """Index row of a cached page, the body is only read by PageCache.load"""
+
+    def __init__(self, url_key, final_url, status, content_type, etag, last_modified, sha256, size, fetched_at, validated_at):
+        self.url_key = url_key
+        self.final_url = final_url
+        self.status = status
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.sha256 = sha256
+        self.size = size
+        self.fetched_at = fetched_at
+        self.validated_at = validated_at
+
+    def is_fresh(self, ttl, now=None):
+        return (now or time.time()) - self.validated_at < ttl
+
+    def conditional_headers(self):
+        """Request headers that let the server answer 304 if the page did not change"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class PageCache:
+    """Thread-safe page cache
+
+    Parameters
+    ----------
+    path : cache folder, created if missing
+    ttl : seconds a page is served from disk without asking the server
+    max_age : seconds after the last validation an entry is dropped by evict()
+    """
+
+    def __init__(self, path="page_cache", ttl=7 * 24 * 3600, max_age=30 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        self._local = threading.local()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _conn(self):
+        # sqlite connections can't be shared between threads, so every thread gets its own
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(os.path.join(self.path, "index.db"), timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _object_path(self, sha256):
+        return os.path.join(self.path, "objects", sha256[:2], f"{sha256}.gz")
+
+    #-------- index --------#
+
+    def lookup(self, url):
+        """CacheEntry of url (fresh or stale), None if it was never cached or its body is gone"""
+        row = self._conn().execute("SELECT * FROM pages WHERE url_key = ?", (normalize_url(url),)).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(*row)
+        if not os.path.exists(self._object_path(entry.sha256)):
+            return None
+        return entry
+
+    def load(self, url, entry, revalidated=False):
+        """CachedPage of an entry, body read from disk"""
+        with gzip.open(self._object_path(entry.sha256), "rb") as f:
+            content = f.read()
+        return CachedPage(url, entry.final_url, entry.status, content, entry.content_type, entry.etag, entry.last_modified, from_cache=True, revalidated=revalidated)
+
+    def store(self, url, final_url, status, headers, content):
+        """Writes a downloaded page, returns it as a CachedPage"""
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(content)
+            os.replace(tmp, path)
+
+        now = time.time()
+        etag, last_modified, content_type = headers.get("ETag"), headers.get("Last-Modified"), headers.get("Content-Type")
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), final_url, status, content_type, etag, last_modified, sha256, len(content), now, now),
+            )
+        return CachedPage(url, final_url, status, content, content_type, etag, last_modified)
+
+    def touch(self, url):
+        """Marks a cached page as just validated (after a 304)"""
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE pages SET validated_at = ? WHERE url_key = ?", (time.time(), normalize_url(url)))
+
+    #-------- fetching --------#
+
+    def get(self, url, headers=None, timeout=5, proxies=None, session=None, before_request=None):
+        """Page from disk if fresh, else a (conditional) GET with requests. Raises like requests.get + raise_for_status
+
+        before_request is called only when the network is actually used (e.g. to wait for a politeness slot)
+        """
+        entry = self.lookup(url)
+        if entry is not None and entry.is_fresh(self.ttl):
+            self.hits += 1
+            return self.load(url, entry)
+
+        if before_request is not None:
+            before_request()
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            request_headers.update(entry.conditional_headers())
+        response = (session or requests).get(url, headers=request_headers, timeout=timeout, proxies=proxies)
+
+        if response.status_code == 304 and entry is not None:
+            self.revalidations += 1
+            self.touch(url)
+            return self.load(url, entry, revalidated=True)
+
+        response.raise_for_status()
+        self.misses += 1
+        return self.store(url, response.url, response.status_code, response.headers, response.content)
+
+    async def get_async(self, session, url, headers=None, before_request=None, timeout=None):
+        """get() for an aiohttp session. before_request is awaited only when the network is actually used"""
+        entry = await asyncio.to_thread(self.lookup, url)
+        if entry is not None and entry.is_fresh(self.ttl):
+            self.hits += 1
+            return await asyncio.to_thread(self.load, url, entry)
+
+        if before_request is not None:
+            await before_request()
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            request_headers.update(entry.conditional_headers())
+        async with session.get(url, headers=request_headers, timeout=timeout or session.timeout) as response:
+            if response.status == 304 and entry is not None:
+                self.revalidations += 1
+                await asyncio.to_thread(self.touch, url)
+                return await asyncio.to_thread(self.load, url, entry, True)
+
+            response.raise_for_status()
+            content = await response.read()
+            self.misses += 1
+            return await asyncio.to_thread(self.store, url, str(response.url), response.status, dict(response.headers), content)
+
+    #-------- maintenance --------#
+
+    def evict(self, max_age=None):
+        """Drops entries not validated for max_age seconds and bodies no entry refers to. Returns (entries, files) removed"""
+        cutoff = time.time() - (self.max_age if max_age is None else max_age)
+        conn = self._conn()
+        with conn:
+            entries = conn.execute("DELETE FROM pages WHERE validated_at < ?", (cutoff,)).rowcount
+
+        referenced = {row[0] for row in conn.execute("SELECT DISTINCT sha256 FROM pages")}
+        files = 0
+        for folder, _, names in os.walk(os.path.join(self.path, "objects")):
+            for name in names:
+                if name.endswith(".gz") and name[:-3] not in referenced:
+                    os.remove(os.path.join(folder, name))
+                    files += 1
+        return entries, files
+
+    def stats(self):
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "revalidations": self.revalidations, "misses": self.misses}
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+# one cache shared by every fetch path of the process, opened on first use
+page_cache = None
+page_cache_lock = threading.Lock()
+
+def get_page_cache(path="page_cache"):
+    global page_cache
+    with page_cache_lock:
+        if page_cache is None:
+            page_cache = PageCache(path)
+    return page_cache
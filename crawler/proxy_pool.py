@@ -0,0 +1,153 @@
+# Cached, health-checked proxy pool for website_language_classifier.
+#
+# The proxy list is loaded once (static list, file with one ip:port per line, or a refresh callback such
+# as get_proxies) and only reloaded after `ttl` seconds, or earlier once every proxy is evicted. A refresh
+# that fails or returns nothing is not retried before another `ttl`, and it runs outside the pool lock, so
+# the other threads keep getting proxies from the old list meanwhile. Every request reports back whether the proxy
+# worked and how long it took; proxies that fail `max_failures` times in a row are evicted, and get()
+# hands out one of the fastest healthy proxies.
+
+import random
+import threading
+import time
+
+class ProxyStats:
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        # exponentially weighted latency in seconds, None until the first success
+        self.latency = None
+
+    def success_rate(self):
+        # smoothed so untried proxies start at 0.5 instead of 0 or 1
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+def proxy_key(proxy):
+    """'ip:port' for either a {'ip', 'port'} dict (as returned by get_proxies) or an 'ip:port' string"""
+    if isinstance(proxy, dict):
+        return f"{proxy['ip']}:{proxy['port']}"
+    return proxy.strip()
+
+def requests_proxies(key):
+    """proxies argument for requests.get"""
+    return {"http": f"http://{key}", "https": f"http://{key}"}
+
+class ProxyPool:
+    """Thread-safe proxy pool
+
+    Parameters
+    ----------
+    proxies : static list of proxies ({'ip', 'port'} dicts or 'ip:port' strings)
+    path : file with one ip:port per line
+    refresh : callable returning a fresh proxy list, called at most once per ttl
+    ttl : seconds before the list is refreshed (only with refresh)
+    max_failures : consecutive failures after which a proxy is evicted
+    choose_from : get() picks randomly among this many best proxies, to spread load
+    """
+
+    def __init__(self, proxies=None, path=None, refresh=None, ttl=600, max_failures=3, choose_from=5, latency_weight=0.3):
+        self.refresh = refresh
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.choose_from = choose_from
+        self.latency_weight = latency_weight
+        self.stats = {}
+        self.evicted = set()
+        self.loaded_at = None
+        # last refresh failed or came back empty, so an empty pool does not trigger another one before ttl
+        self.refresh_failed = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+        initial = list(proxies or [])
+        if path is not None:
+            with open(path, "r") as f:
+                initial.extend(line for line in f if line.strip() and not line.startswith("#"))
+        if initial:
+            self._load(initial)
+
+    def _load(self, proxies):
+        # keep the stats of proxies we already know, forget the ones no longer listed
+        keys = {proxy_key(proxy) for proxy in proxies}
+        self.stats = {key: self.stats.get(key, ProxyStats()) for key in keys}
+        self.evicted &= keys
+        self.loaded_at = time.monotonic()
+
+    def _refresh_due(self):
+        if self.refresh is None or self._refreshing:
+            return False
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            return True
+        # every proxy evicted: reload early, unless the last reload gave nothing
+        return len(self.evicted) >= len(self.stats) and not self.refresh_failed
+
+    def _refresh_if_stale(self):
+        """Calls refresh if due. The (network) call runs without the lock, only one thread refreshes at a time"""
+        with self._lock:
+            if not self._refresh_due():
+                return
+            self._refreshing = True
+
+        try:
+            proxies = list(self.refresh())
+        except Exception as e:
+            print(f"Error refreshing proxy list: {e}")
+            proxies = []
+
+        with self._lock:
+            self._refreshing = False
+            if proxies:
+                self._load(proxies)
+                self.refresh_failed = False
+            else:
+                # keep serving the old list, try again after another ttl
+                self.loaded_at = time.monotonic()
+                self.refresh_failed = True
+
+    def healthy(self):
+        """Healthy proxies, best first (highest success rate, then lowest latency)"""
+        with self._lock:
+            return self._ranked()
+
+    def _ranked(self):
+        candidates = [key for key in self.stats if key not in self.evicted]
+        known_latencies = [self.stats[key].latency for key in candidates if self.stats[key].latency is not None]
+        # untried proxies are ranked as if they had the median latency
+        default_latency = sorted(known_latencies)[len(known_latencies) // 2] if known_latencies else 1.0
+
+        def rank(key):
+            stats = self.stats[key]
+            latency = stats.latency if stats.latency is not None else default_latency
+            return (-round(stats.success_rate(), 2), latency)
+
+        return sorted(candidates, key=rank)
+
+    def get(self):
+        """'ip:port' of one of the fastest healthy proxies, or None if there are none"""
+        self._refresh_if_stale()
+        with self._lock:
+            ranked = self._ranked()
+            if not ranked:
+                return None
+            return random.choice(ranked[:self.choose_from])
+
+    def report(self, key, ok, latency=None):
+        """Records the outcome of a request made through key"""
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                return
+            if ok:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                if latency is not None:
+                    stats.latency = latency if stats.latency is None else (1 - self.latency_weight) * stats.latency + self.latency_weight * latency
+            else:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                if stats.consecutive_failures >= self.max_failures:
+                    self.evicted.add(key)
+
+    def __len__(self):
+        return len(self.stats) - len(self.evicted)
@@ -0,0 +1,107 @@
+# Fast script based language pre-classifier, run ahead of langdetect.
+#
+# Counts characters per Unicode script (kana, hangul, han, latin) in one vectorized pass, and settles
+# ja/ko/zh/en directly when one script clearly dominates. Only ambiguous texts go to langdetect, and then
+# only a bounded, evenly spaced sample of the text, so results stay deterministic and long pages are cheap.
+
+import re
+import numpy as np
+from langdetect import detect, DetectorFactory
+from langdetect.lang_detect_exception import LangDetectException
+
+# Ensure consistent results from langdetect
+DetectorFactory.seed = 0
+
+try:
+    import hanzidentifier
+except ImportError:
+    hanzidentifier = None
+
+SCRIPTS = ["other", "kana", "hangul", "han", "latin"]
+KANA, HANGUL, HAN, LATIN = 1, 2, 3, 4
+
+# (first code point, last code point, script)
+SCRIPT_RANGES = [
+    (0x0041, 0x005A, LATIN), (0x0061, 0x007A, LATIN), (0x00C0, 0x024F, LATIN),
+    (0x1100, 0x11FF, HANGUL),
+    (0x3040, 0x309F, KANA), (0x30A0, 0x30FF, KANA),
+    (0x3130, 0x318F, HANGUL),
+    (0x31F0, 0x31FF, KANA),
+    (0x3400, 0x4DBF, HAN), (0x4E00, 0x9FFF, HAN),
+    (0xA960, 0xA97F, HANGUL), (0xAC00, 0xD7AF, HANGUL), (0xD7B0, 0xD7FF, HANGUL),
+    (0xF900, 0xFAFF, HAN),
+    (0xFF66, 0xFF9F, KANA),
+    (0x20000, 0x2FA1F, HAN),
+]
+
+# searchsorted lookup table: boundary i starts an interval labelled _LABELS[i + 1]
+_BOUNDS = []
+_LABELS = [0]
+for first, last, script in SCRIPT_RANGES:
+    _BOUNDS.extend([first, last + 1])
+    _LABELS.extend([script, 0])
+_BOUNDS = np.array(_BOUNDS, dtype=np.uint32)
+_LABELS = np.array(_LABELS, dtype=np.int64)
+
+ENGLISH_WORDS = {"the", "and", "of", "to", "in", "for", "is", "that", "with", "we", "you", "your", "our", "or", "by", "this", "are"}
+WORD_RE = re.compile(r"[A-Za-z]+")
+
+def script_histogram(text):
+    """Number of characters of each script in SCRIPTS order"""
+    codes = np.frombuffer(text.encode("utf-32-le", errors="replace"), dtype=np.uint32)
+    labels = _LABELS[np.searchsorted(_BOUNDS, codes, side="right")]
+    return np.bincount(labels, minlength=len(SCRIPTS))
+
+def sample_text(text, max_chars=2000, windows=4):
+    """Up to max_chars of text, taken as evenly spaced windows so a long header or footer doesn't decide alone"""
+    if len(text) <= max_chars:
+        return text
+    size = max_chars // windows
+    step = (len(text) - size) // (windows - 1)
+    return " ".join(text[i * step:i * step + size] for i in range(windows))
+
+def chinese_variant(text):
+    """zh-cn / zh-tw from the characters used, None if the sample can't tell"""
+    if hanzidentifier is None:
+        return None
+    kind = hanzidentifier.identify(text)
+    if kind == hanzidentifier.SIMPLIFIED:
+        return "zh-cn"
+    if kind == hanzidentifier.TRADITIONAL:
+        return "zh-tw"
+    return None
+
+def classify_script(text, min_letters=20):
+    """Language code (same codes as langdetect) if the script histogram is conclusive, else None"""
+    counts = script_histogram(text)
+    kana, hangul, han, latin = counts[KANA], counts[HANGUL], counts[HAN], counts[LATIN]
+    letters = kana + hangul + han + latin
+    if letters < min_letters:
+        return None
+
+    cjk = kana + han
+    if hangul >= 0.5 * letters:
+        return "ko"
+    if cjk >= 0.5 * letters:
+        # japanese mixes kana with kanji, chinese has next to no kana
+        if kana >= 0.15 * cjk:
+            return "ja"
+        if kana <= 0.02 * cjk:
+            return chinese_variant(sample_text(text))
+        return None
+    if latin >= 0.95 * letters:
+        # latin script alone could be any european language, require common english function words
+        words = WORD_RE.findall(sample_text(text).lower())
+        if len(words) >= 20 and sum(word in ENGLISH_WORDS for word in words) >= 0.1 * len(words):
+            return "en"
+    return None
+
+def classify_language(text, max_sample_chars=2000):
+    """Script histogram first, langdetect on a bounded sample only for ambiguous texts. None if undetectable"""
+    language = classify_script(text)
+    if language is not None:
+        return language
+    try:
+        return detect(sample_text(text, max_sample_chars))
+    except LangDetectException:
+        return None
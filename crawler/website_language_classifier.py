@@ -7,9 +7,14 @@ import os
 import random
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from tinydb import TinyDB, Query
-from tinyrecord import transaction
 from datetime import datetime
+import time
+from crawl_store import CrawlStore
+from proxy_pool import ProxyPool, requests_proxies
+from script_classifier import classify_language
+from html_extract import extract_text
+from page_cache import get_page_cache
+from failure_ledger import get_failure_ledger
 
 # Ensure consistent results from langdetect
 DetectorFactory.seed = 0
@@ -27,10 +32,10 @@ def get_random_user_agent():
     return random.choice(USER_AGENTS)
 
 # get free proxies from online
-def get_proxies():
+def get_proxies(timeout=10):
     url = "https://free-proxy-list.net/"
     # fetch proxy list from online
-    response = requests.get(url)
+    response = requests.get(url, timeout=timeout)
     soup = BeautifulSoup(response.content, "html.parser")
 
     proxy_table = soup.find("table", attrs={"class": "table table-striped table-bordered"})
@@ -50,6 +55,10 @@ def get_proxies():
         # print(row)
     return proxies
 
+# proxy list is scraped once and refreshed every 10 minutes instead of on every fetch
+# (for offline runs use ProxyPool(path="proxies.txt") or ProxyPool(proxies=[...]))
+proxy_pool = ProxyPool(refresh=get_proxies, ttl=600)
+
 def fetch_and_convert_website(url):
     try:
         headers = {'User-Agent': get_random_user_agent()}
@@ -63,54 +72,58 @@ def fetch_and_convert_website(url):
         #     response = requests.get("http://" + url, headers=headers, timeout=10)
         #     response.raise_for_status()
 
-        # add proxy
-        proxies = get_proxies()
-        # get random proxy
-        # pick random value from list
-        proxy = random.choice(proxies)
-        response = requests.get("https://" + url, headers=headers, proxies=proxy, timeout=10)
+        # add proxy - one of the fastest healthy proxies from the cached pool, direct request if there are none
+        proxy = proxy_pool.get()
+        start = time.monotonic()
+        try:
+            # the landing page is kept in the shared page cache, so the link crawl afterwards does not download it again
+            page = get_page_cache().get("https://" + url, headers=headers, proxies=requests_proxies(proxy) if proxy else None, timeout=10)
+        except (requests.exceptions.ProxyError, requests.exceptions.ConnectTimeout):
+            if proxy:
+                proxy_pool.report(proxy, ok=False)
+            raise
+        # a page served from disk says nothing about the proxy
+        if proxy and (page.revalidated or not page.from_cache):
+            proxy_pool.report(proxy, ok=True, latency=time.monotonic() - start)
         # response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Check if the request was successful
-        
-        # Parse the website content
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Get text content and remove extra whitespace
-        text = soup.get_text(separator=' ', strip=True)
-        
+        # response.raise_for_status()  # done by the page cache, error responses are never cached
+
+        # Get text content and remove extra whitespace, in one streaming pass over the first MAX_BYTES of the page
+        text = extract_text(page.content)
+        get_failure_ledger().record_success(url, stage="classify")
+
         return text
     except requests.exceptions.RequestException as e:
         error_message = f"Error fetching the website {url}: {e}"
-        save_error(url, error_message)
+        save_error(url, error_message, e)
         print(error_message)
         return None
 
 def detect_language(text):
-    try:
-        language = detect(text)
-        return language
-    except LangDetectException as e:
-        error_message = f"Error detecting language: {e}"
-        print(error_message)
-        return None
+    # script histogram settles most ja/ko/zh/en pages, langdetect only sees a sample of the ambiguous ones
+    language = classify_language(text)
+    if language is None:
+        print("Error detecting language: no features in text")
+    return language
 
-def process_single_website(url, db):
+def process_single_website(url, store):
     text_content = fetch_and_convert_website(url)
     if text_content:
         language = detect_language(text_content)
         if language:
-            with transaction(db) as tr:
-                tr.insert({'url': url, 'language': language, 'timestamp': datetime.now().isoformat()})
+            store.add_website(url, language, datetime.now().isoformat())
             return url, language
     return url, None
 
-def process_websites(url_list, db):
+def process_websites(url_list, store):
     with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(process_single_website, url, db): url for url in url_list}
+        futures = {executor.submit(process_single_website, url, store): url for url in url_list}
         for future in tqdm(as_completed(futures), total=len(futures), desc="Processing URLs"):
             future.result()
 
-def save_error(url, error_message):
+def save_error(url, error_message, error=None):
+    # structured entry (error class, status, next retry) in the failure ledger, the text file stays for reading
+    get_failure_ledger().record_failure(url, url, None, error if error is not None else error_message, stage="classify")
     with open('error_urls.txt', 'a', encoding='utf-8') as error_file:
         error_file.write(f"{url}: {error_message}\n")
 
@@ -132,29 +145,24 @@ def create_url_list_from_file(file_path):
         url_list = file.readlines()
     return [url.strip() for url in url_list]
 
-def load_processed_urls(db):
-    processed_urls = {item['url'] for item in db.all()}
-    return processed_urls
+def load_processed_urls(store):
+    return store.processed_urls()
 
+# urls whose transient failure is due for a retry; permanent failures (404, SSL, ...) are never returned
 def read_error_urls():
-    with open('error_urls.txt', 'r', encoding='utf-8') as error_file:
-        error_urls = error_file.readlines()
-        # split the lines into URL and error message
-        error_urls = [line.split(':') for line in error_urls]
-    
-    # just keep the url in the list
-    error_urls = [url[0] for url in error_urls]
-    return error_urls
+    ledger = get_failure_ledger()
+    # one-time import of the old text log, whose "url: message" lines the ledger parses itself
+    if not ledger.has_failures("classify") and os.path.exists('error_urls.txt'):
+        ledger.import_text_log('error_urls.txt', stage="classify")
+    return ledger.due("classify")
 
 if __name__ == "__main__":
     
     # print(read_error_urls())
     error_url = read_error_urls()
 
-    # Initialize TinyDB
-    db = TinyDB('websites_by_language.json')
-    websites_table = db.table('websites')
-    Websites = Query()
+    # Initialize the sqlite store (migrate old TinyDB files once with: python crawl_store.py migrate websites_by_language.json)
+    store = CrawlStore('crawl.db')
 
     # # List of URLs to process
     url_list = [
@@ -176,13 +184,15 @@ if __name__ == "__main__":
     url_list = list(set(url_list))
     print(f"Total URLs before filtering: {len(url_list)}")
 
-    # Load already processed URLs from TinyDB
-    processed_urls = load_processed_urls(websites_table)
+    # Load already processed URLs from the store
+    processed_urls = load_processed_urls(store)
     print(f"Total processed URLs: {len(processed_urls)}")
 
-    # Remove already processed URLs from url_list
-    url_list = [url for url in url_list if url not in processed_urls]
+    # Remove already processed URLs from url_list, and failed ones that are dead or not due for a retry yet
+    waiting_urls = get_failure_ledger().waiting("classify")
+    url_list = [url for url in url_list if url not in processed_urls and url not in waiting_urls]
     print(f"Total URLs to process: {len(url_list)}")
 
-    # Process the websites and update TinyDB
-    process_websites(url_list, websites_table)
+    # Process the websites and update the store
+    process_websites(url_list, store)
+    store.close()
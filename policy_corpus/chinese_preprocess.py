@@ -0,0 +1,175 @@
+#Chinese preprocessing, moved out of the loose cells of preprocess.ipynb
+#usage from the notebook:
+#   from chinese_preprocess import mass_tokenize_chinese
+#   mass_tokenize_chinese(chinesese_policy_list, "raw_sorted_policies/chinese_raw", "corpus/chinese_processed", workers = 4)
+#in_folder can also be a policy archive (see policy_archive.py):
+#   mass_tokenize_chinese(None, "policies.pzst", "corpus/chinese_processed", workers = 4)
+
+import os
+import re
+import csv
+import glob
+import multiprocessing
+import hanzidentifier
+import jieba
+import jieba.posseg as pseg
+from tqdm import tqdm
+from zhon.hanzi import punctuation
+
+#output columns of tokenize_chinese, same as corpus/chinese_processed
+CHINESE_COLUMNS = ['surface', 'normalized', 'dictionary', 'POS']
+
+#-------- Chinese Helper Functions --------#
+
+def is_chinese(value : str):
+    return hanzidentifier.has_chinese(value)
+
+#removes chinese punctuation and collapses whitespace, the cleaning corpus/chinese_processed was built with
+def clean_chinese_text(text : str):
+    text = re.sub(f'[{punctuation}]', '', text)
+    text = re.sub(r'\s+', ' ', text)
+
+    return text
+
+def load_chinese_stopwords():
+    """Overview
+    --
+    NLTK's chinese stopword list as a set, downloads the nltk stopwords corpus if it is missing
+
+    Returns
+    --
+    set
+        chinese stopwords
+    """
+
+    import nltk
+    from nltk.corpus import stopwords
+
+    try:
+        return set(stopwords.words('chinese'))
+    except LookupError:
+        nltk.download('stopwords', quiet = True)
+        return set(stopwords.words('chinese'))
+
+def normalize_token(token : str):
+    # Here we simply convert to lowercase for normalization
+    return token.lower()
+
+def dictionary_form(token : str):
+    # Chinese words don't inflect, the token itself is its dictionary form
+    return token
+
+#-------- Chinese Tokenization Functions --------#
+
+def tokenize_chinese(text : str, stopwords : set = set()):
+    """Overview
+    --
+    Tokenizes one text with jieba's POS tagger
+
+    Parameters
+    --
+    text : cleaned text (see clean_chinese_text)
+    stopwords : set of stopwords to drop
+
+    Returns
+    --
+    generator(tuple)
+        (surface, normalized, dictionary, POS) per kept word
+    """
+
+    for word, flag in pseg.cut(text):
+        if word not in stopwords:
+            yield (word, normalize_token(word), dictionary_form(word), flag)
+
+def tokenize_chinese_file(hash : str, in_folder : str, out_folder : str, stopwords : set = set()):
+    """Overview
+    --
+    Tokenizes {in_folder}/{hash}.txt into {out_folder}/{hash}.csv
+
+    Parameters
+    --
+    hash : hash of the policy
+    in_folder : folder to look for txt files using hash as name, or a .pzst policy archive
+    out_folder : folder to write tokenized text csv files into
+    stopwords : set of stopwords to drop
+
+    Returns
+    --
+    bool
+        True if a csv was written, False if the text has no chinese characters
+    """
+
+    if in_folder.endswith(".pzst"):
+        #only archive input needs policy_archive (and zstandard)
+        from policy_archive import read_policy_text
+        text = clean_chinese_text(read_policy_text(in_folder, hash))
+    else:
+        with open(f"{in_folder}/{hash}.txt", "r", encoding = 'utf-8') as f:
+            text = clean_chinese_text(f.read())
+
+    if not is_chinese(text):
+        return False
+
+    #rows are written as they are tagged, the document is never held as a table
+    with open(f"{out_folder}/{hash}.csv", "w", encoding = 'utf-8', newline = '') as out:
+        writer = csv.writer(out, lineterminator = '\n')
+        writer.writerow(CHINESE_COLUMNS)
+        writer.writerows(tokenize_chinese(text, stopwords = stopwords))
+    return True
+
+#per process state for mass_tokenize_chinese workers, set once by _init_worker
+_worker_args = None
+
+def _init_worker(in_folder : str, out_folder : str, stopwords : set):
+    """Pool initializer - loads jieba's dictionary once per worker process"""
+
+    global _worker_args
+    jieba.setLogLevel(jieba.logging.WARNING)
+    jieba.initialize()
+    _worker_args = (in_folder, out_folder, stopwords)
+
+def _tokenize_worker(hash : str):
+    in_folder, out_folder, stopwords = _worker_args
+    return hash, tokenize_chinese_file(hash, in_folder, out_folder, stopwords = stopwords)
+
+def mass_tokenize_chinese(hash_list : list = None, in_folder : str = "raw_sorted_policies/chinese_raw", out_folder : str = "corpus/chinese_processed", stopwords : set = None, workers : int = 1):
+    """Overview
+    --
+    Tokenizes all files listed in hash list and corresponding text file
+
+    Parameters
+    --
+    hash_list : list of hashes to tokenize, None for every txt file in in_folder (every chinese policy of an archive)
+    in_folder : folder to look for txt files using hash as name, or a .pzst policy archive
+    out_folder : folder to write tokenized text csv files into
+    stopwords : set of stopword to remove from all texts, None for NLTK's chinese stopwords
+    workers : number of processes, 1 runs in this process
+
+    Returns
+    --
+    list
+        hashes that were written
+    """
+
+    #ensures out_folder exists
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    if hash_list is None:
+        if in_folder.endswith(".pzst"):
+            from policy_archive import list_policy_hashes
+            hash_list = list_policy_hashes(in_folder, "zh")
+        else:
+            hash_list = sorted(os.path.splitext(os.path.basename(file))[0] for file in glob.glob(os.path.join(in_folder, "*.txt")))
+    if stopwords is None:
+        stopwords = load_chinese_stopwords()
+    stopwords = set(stopwords) #membership tests on a list are linear
+
+    #files are read one at a time by whichever process tokenizes them
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer = _init_worker, initargs = (in_folder, out_folder, stopwords)) as pool:
+            results = list(tqdm(pool.imap(_tokenize_worker, hash_list, chunksize = 4), total = len(hash_list)))
+    else:
+        results = [(hash, tokenize_chinese_file(hash, in_folder, out_folder, stopwords = stopwords)) for hash in tqdm(hash_list)]
+
+    return [hash for hash, written in results if written]
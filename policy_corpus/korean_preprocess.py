@@ -0,0 +1,323 @@
+#Korean preprocessing, moved out of preprocess.ipynb so it can run in worker processes
+#usage from the notebook:
+#   from korean_preprocess import mass_tokenize_korean
+#   mass_tokenize_korean(ko_policy_list, "policies", "corpus/korean_preprocessed", stopwords = stopwords, workers = 4)
+
+import os
+import re
+import regex
+import multiprocessing
+import pandas as pd
+from tqdm import tqdm
+
+from konlpy.tag import Okt
+
+#output columns of tokenize_korean
+KOREAN_COLUMNS = ['surface', 'normalized', 'dictionary', 'pos']
+
+#-------- Korean Helper Functions --------#
+
+#simple language check if text contains hangul character
+def is_hangul(text : str):
+    return bool(regex.search(r'\p{IsHangul}', text))
+
+#simple text cleaner to normalize text input
+def clean_korean_text(text : str):
+    text = text.strip()
+    text = re.sub(r'[\n\r\s]+',' ',text) #new lines arent use for splitting so simply converted to whitespace
+    text = re.sub(r'，|、', ',', text) #normalize commas
+    text = re.sub(r'。', '.', text) #normalize periods
+
+    return text
+
+#readablity
+def korean_readability_index(tokens : pd.DataFrame, scale : int = 1): #modified to take already tokenized text
+    """Overview
+    --
+    Calculates readabilty for korean texts with formula:
+      (total_words + total_syllables) / sentences
+
+    Parameters
+    --
+    tokens : pandas DataFrame containing text as tokenized by the function "tokenize_korean"
+    scale : scale factor to multipy readability score, used for standardizing score between langagues
+
+    Returns
+    --
+    int
+        kri score, if failed returns as -1
+    """
+
+    # counts number of periods to get # of sentences (rough approximation)
+    sentences = (tokens['normalized'] == ".").sum()
+    if sentences == 0:
+        return(-1) # if contains no periods, readability score is junk, return -1
+
+    #remove periods and commas from word count (should be only remaining punctuation)
+    mask = (tokens["normalized"] == '.') | (tokens["normalized"] == ',')
+    words = tokens.loc[~mask, 'normalized']
+
+    total_words = len(words) #not perfect but morphs ~approx words
+    total_syllables = int(words.str.len().sum())
+
+    # Calculate the KRI score
+    kri_score = (total_words + total_syllables) / sentences
+
+    return kri_score * scale
+
+def remove_stop_word_korean(tokens : pd.DataFrame, stopwords : set): #takes already tokenized text
+    """Overview
+    --
+    Removes stopwords passed to function from tokenized text
+
+    Parameters
+    --
+    tokens : pandas DataFrame containing text as tokenized by the function "tokenize_korean"
+    stopwords : set of stopwords as string
+
+    Returns
+    --
+    void
+        deletes stopwords inplace on tokens
+    """
+
+    mask = tokens["normalized"].isin(stopwords)
+    tokens.drop(tokens[mask].index, inplace = True)#drop is performed in place, not returned
+
+def remove_punc_korean(tokens : pd.DataFrame, keep_periods = True, keep_commas = True): #takes already tokenized text
+    """Overview
+    --
+    Removes punctuation from tokenized text
+
+    Parameters
+    --
+    tokens : pandas DataFrame containing text as tokenized by the function "tokenize_korean"
+    keep_periods : if true, periods aren't removed
+    keep_commas : if true, commas aren't removed
+
+    Returns
+    --
+    void
+        deletes punctuation inplace on tokens
+    """
+
+    unrecognized_punc = {"‘","・","“"} #some puncutuation is not marked as punctuation
+    mask = (tokens["pos"] == 'Punctuation')
+
+    #used to keep periods and commas
+    if keep_periods:
+        mask = mask & (tokens["normalized"] != '.')
+    if keep_commas:
+        mask = mask & (tokens["normalized"] != ',')
+
+    #removes unrecognized punc
+    mask = mask | (tokens["normalized"].isin(unrecognized_punc))
+
+    tokens.drop(tokens[mask].index, inplace = True)#drop is performed in place, not returned
+
+#-------- Okt output alignment --------#
+
+def _resync(surf : list, norm : list, i : int, j : int, window : int):
+    """Closest pair (i2, j2) with surf[i2] == norm[j2] within window tokens of (i, j), by i2 - i + j2 - j"""
+
+    #first position of every normalized token in the window
+    first = {}
+    for dj, token in enumerate(norm[j:j + window]):
+        first.setdefault(token, dj)
+
+    best = None
+    for di, token in enumerate(surf[i:i + window]):
+        dj = first.get(token)
+        if dj is not None and (best is None or di + dj < best[0] + best[1]):
+            best = (di, dj)
+
+    if best is None:
+        #nothing in common nearby, treat both windows as one gap
+        return min(i + window, len(surf)), min(j + window, len(norm))
+    return i + best[0], j + best[1]
+
+#preps okt output for csv
+def formatter_korean(surf : list, norm : list, stem : list, pos : list, window : int = 32):
+    """Overview
+    --
+    Aligns the surface tokens (morphs) with the normalized tokens (pos with norm=True) in one forward pass
+
+    Normalization only changes a few tokens here and there, so equal tokens are paired directly and after a
+    difference the lists are resynced at the nearest equal token pair within window tokens. Inside a gap:
+      - surface with no normalized tokens: one row per surface token, normalized/dictionary/pos as na (*)
+      - normalized with no surface tokens: one row per normalized token, surface as na (*)
+      - both: one row per normalized token, each with the whole gap's surface concatenated
+    Rows are only appended, so the cost is linear in the number of tokens
+
+    Parameters
+    --
+    surf : list of surface tokens as returned by morphs, must NOT be normalized or stemmed
+    norm : list of normalized tokens as returned by pos, MUST be normalized but NOT stemmed
+    stem : list of tokens as returned by morphs, MUST be normalized and stemmed (same length as norm)
+    pos : list of pos tags as returned by pos, MUST be normalized but NOT stemmed (same length as norm)
+    window : how many tokens ahead to look for the next equal pair
+
+    Returns
+    --
+    list(tuple)
+        (surface, normalized, dictionary, pos) rows in the format for creating a pandas DataFrame
+    """
+
+    rows = []
+    i = j = 0
+    while i < len(surf) or j < len(norm):
+        if i < len(surf) and j < len(norm) and surf[i] == norm[j]:
+            rows.append((surf[i], norm[j], stem[j], pos[j]))
+            i += 1
+            j += 1
+            continue
+
+        i2, j2 = _resync(surf, norm, i, j, window)
+
+        #if surface with no norm, norm as na (*)
+        if j2 == j:
+            for k in range(i, i2):
+                rows.append((surf[k], "*", "*", "*"))
+        else:
+            #if norm with no surface, surface as na (*), otherwise the whole surface for each norm
+            concat_surf = "".join(surf[i:i2]) if i2 > i else "*"
+            for k in range(j, j2):
+                rows.append((concat_surf, norm[k], stem[k], pos[k]))
+
+        i, j = i2, j2
+
+    return rows
+
+#-------- Korean Tokenization Functions --------#
+
+def tokenize_korean(text : str, tokenizer : Okt): #tokenizer should be passed as argument so we only need to initiallize it once for all doucments
+    """Overview
+    --
+    Tokenizes one text file
+
+    Parameters
+    --
+    text : raw text, should be cleaned for best result
+    tokenizer : tokenizer used for tokenization (in this case OKT)
+
+    Returns
+    --
+    pd.Dataframe
+        returns DataFrame object with tokenized text
+    """
+
+    tagged = tokenizer.pos(text, norm=True)
+    norm = [token for token, _ in tagged]
+    pos = [tag for _, tag in tagged]
+    surf = tokenizer.morphs(text)
+    stem = tokenizer.morphs(text, norm=True, stem=True)
+
+    data = formatter_korean(surf, norm, stem, pos)
+
+    #put data into dataframe and return
+    return pd.DataFrame(data, columns=KOREAN_COLUMNS)
+
+def tokenize_korean_file(hash : str, in_folder : str, out_folder : str, tokenizer : Okt, stopwords : set = {}, readability : bool = True):
+    """Overview
+    --
+    Tokenizes one policy and writes {out_folder}/{hash}.csv
+
+    Parameters
+    --
+    hash : hash of the policy, {in_folder}/{hash}.txt is read
+    in_folder : folder to look for txt files using hash as name, or a .pzst policy archive
+    out_folder : folder to write tokenized text csv files into
+    tokenizer : Okt instance
+    stopwords : set of stopword to remove
+    readability : if true, also calculates the readability score
+
+    Returns
+    --
+    tuple
+        (hash, readability score or None, True if a csv was written)
+    """
+
+    #open and clean text
+    if in_folder.endswith(".pzst"):
+        #only archive input needs policy_archive (and zstandard)
+        from policy_archive import read_policy_text
+        text = clean_korean_text(read_policy_text(in_folder, hash))
+    else:
+        with open(f"{in_folder}/{hash}.txt", "r", encoding='utf-8') as f:
+            text = clean_korean_text(f.read())
+
+    #hangul check
+    if not is_hangul(text):
+        return hash, None, False
+
+    tokens = tokenize_korean(text, tokenizer) #tokenization
+    remove_punc_korean(tokens) #first rount of stopwording, remove superflous puncuation
+
+    #caluclate readabilty
+    readability_score = korean_readability_index(tokens) if readability else None
+
+    #first rount of stopwording, remove actual stopwords
+    remove_stop_word_korean(tokens, stopwords = stopwords)
+
+    tokens.to_csv(f"{out_folder}/{hash}.csv", index=False)
+    return hash, readability_score, True
+
+#per process state for mass_tokenize_korean workers, set once by _init_worker
+_worker_okt = None
+_worker_args = None
+
+def _init_worker(in_folder : str, out_folder : str, stopwords : set, readability : bool):
+    """Pool initializer - starts one JVM and Okt per worker process"""
+
+    global _worker_okt, _worker_args
+    _worker_okt = Okt()
+    _worker_args = (in_folder, out_folder, stopwords, readability)
+
+def _tokenize_worker(hash : str):
+    in_folder, out_folder, stopwords, readability = _worker_args
+    return tokenize_korean_file(hash, in_folder, out_folder, _worker_okt, stopwords = stopwords, readability = readability)
+
+def mass_tokenize_korean(hash_list : list, in_folder : str, out_folder : str, stopwords : set = {}, readability : bool = True, workers : int = 1):
+    """Overview
+    --
+    Tokenizes all files listed in hash list and corresponding text file
+
+    Parameters
+    --
+    hash_list : list of hashes to tokenize
+    in_folder : folder to look for txt files using hash as name, or a .pzst policy archive
+    out_folder : folder to write tokenized text csv files into
+    stopwords : set of stopword to remove from all texts
+    readability : if true, also writes csv with each files readability score as calculated by "korean_readability_index"
+    workers : number of processes, each with its own Okt (JVM) instance, 1 runs in this process
+
+    Returns
+    --
+    void
+        writes CSV files to out_folder
+    """
+
+    #ensures out_folder exists
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    if workers > 1:
+        #spawn so every worker starts its own JVM instead of inheriting a forked one
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer = _init_worker, initargs = (in_folder, out_folder, stopwords, readability)) as pool:
+            results = list(tqdm(pool.imap(_tokenize_worker, hash_list, chunksize = 4), total = len(hash_list)))
+    else:
+        #initialize tokenizer only once
+        okt = Okt()
+        results = [tokenize_korean_file(hash, in_folder, out_folder, okt, stopwords = stopwords, readability = readability) for hash in tqdm(hash_list)]
+
+    #write readability with coresponding hash, only for files that were tokenized
+    if readability:
+        r_scores = [(hash, score) for hash, score, written in results if written]
+        for hash, score in r_scores:
+            #if caluclating readabilty fails and return as -1, print hash
+            if score == -1:
+                print(hash)
+
+        r_scores_df = pd.DataFrame(r_scores, columns = ["hash","readability"])
+        r_scores_df.to_csv(f"{out_folder}/readability.csv", index=False)
@@ -0,0 +1,434 @@
+#Compressed, randomly accessible archive of raw policy texts
+#
+#The raw texts are thousands of loose {hash}.txt files spread over raw_sorted_policies/*, policies_manual_add and
+#policies, most of them sharing the same boilerplate. The archive packs them into one file: every text is its own
+#zstd frame, compressed with a dictionary trained on the corpus (so the shared boilerplate is stored once in the
+#dictionary instead of once per frame), and a sorted hash -> frame index is read straight from the memory mapped
+#file. Reading one policy by hash is a fanout table lookup plus one frame decompression, and texts of a language
+#are stored next to each other so iterating over a language reads the file front to back.
+#
+#usage:
+#   python policy_archive.py build policies.pzst                   #default sources, languages from the link tables
+#   python policy_archive.py stats policies.pzst
+#from python:
+#   archive = PolicyArchive("policies.pzst")
+#   text = archive.read(hash)
+#   for hash, text in archive.iter_texts("ja"): ...
+#tokenizers take the archive wherever they take a folder of txt files:
+#   mass_tokenize_chinese(None, "policies.pzst", "corpus/chinese_processed", workers = 4)
+#
+#file layout (little endian):
+#   header      magic, dictionary/meta/index offsets and sizes, document count, fanout bits
+#   frames      one zstd frame per distinct text, grouped by language
+#   dictionary  zstd dictionary the frames were compressed with
+#   meta        json: languages, sources, compression level, sizes
+#   index       INDEX_DTYPE records sorted by hash
+#   fanout      uint64 start position in the index of every hash prefix of fanout_bits bits, plus the count
+
+import os
+import glob
+import json
+import mmap
+import random
+import struct
+import threading
+import numpy as np
+import pandas as pd
+import zstandard as zstd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+ARCHIVE_SUFFIX = ".pzst"
+MAGIC = b"PZSTARC1"
+HEADER = struct.Struct("<8sQQQQQQI")
+
+#hash is the 32 raw bytes of the sha256 hex file name
+INDEX_DTYPE = np.dtype([("hash", "S32"), ("offset", "<u8"), ("length", "<u4"), ("size", "<u4"), ("language", "<u2")])
+
+#raw text folders relative to policy_corpus and their language, used when the link tables don't know a hash
+DEFAULT_SOURCES = [("raw_sorted_policies/japanese_raw", "ja"), ("raw_sorted_policies/chinese_raw", "zh-cn"), ("policies_manual_add", None), ("policies", None)]
+
+#link tables with a valid_language column, earlier tables win
+DEFAULT_LINK_TABLES = ["privacy_links_df_updated_v2.csv", "privacy_links_df_updated.csv", "privacy_links_df.csv"]
+
+#-------- writing --------#
+
+def train_dictionary(texts : list, dict_size : int = 256 << 10, max_samples : int = 4000, sample_bytes : int = 128 << 10, seed : int = 1):
+    """Overview
+    --
+    Trains a zstd dictionary on (a sample of) the texts. Fixed cover parameters instead of zstd's parameter
+    search keep training under a second on the whole corpus for nearly the same ratio.
+
+    Parameters
+    --
+    texts : list of bytes
+    dict_size : maximum dictionary size in bytes, capped at a tenth of the sampled bytes
+    max_samples : number of texts sampled for training
+    sample_bytes : only the head of each sampled text is used
+
+    Returns
+    --
+    zstd.ZstdCompressionDict or None
+        None when there are too few texts to train on
+    """
+
+    samples = texts if len(texts) <= max_samples else random.Random(seed).sample(texts, max_samples)
+    samples = [text[:sample_bytes] for text in samples if text]
+    total = sum(len(sample) for sample in samples)
+    if len(samples) < 8 or total < 8 * 1024:
+        return None
+    try:
+        return zstd.train_dictionary(min(dict_size, total // 10), samples, k = 1024, d = 8, threads = -1)
+    except zstd.ZstdError:
+        #zstd refuses inputs it can't learn anything from
+        return None
+
+def _hash_bytes(hash : str):
+    try:
+        key = bytes.fromhex(hash)
+    except ValueError:
+        key = b""
+    if len(key) != 32:
+        raise ValueError(f"archive keys are sha256 hex hashes, got {hash!r}")
+    return key
+
+def _hash_hex(key : bytes):
+    #numpy strips trailing zero bytes of S32 values
+    return bytes(key).ljust(32, b"\0").hex()
+
+def _fanout_bits(count : int):
+    #about one document per bucket, so a lookup scans a handful of keys whatever the corpus size
+    return int(min(24, max(8, np.ceil(np.log2(max(count, 1))))))
+
+def _fanout(keys : np.ndarray, bits : int):
+    prefixes = np.frombuffer(keys.tobytes(), dtype = ">u4").reshape(len(keys), 8)[:, 0] >> np.uint32(32 - bits) if len(keys) else np.zeros(0, dtype = np.uint32)
+    return np.searchsorted(prefixes, np.arange(2 ** bits + 1, dtype = np.uint64)).astype("<u8")
+
+def collect_sources(sources : list = DEFAULT_SOURCES, base_folder : str = "."):
+    """Overview
+    --
+    Lists the txt files of the source folders (one directory listing per folder)
+
+    Parameters
+    --
+    sources : list of (folder, language or None), a hash found in several folders is taken from the first
+    base_folder : folders are relative to this
+
+    Returns
+    --
+    tuple
+        (dict hash -> (path, source language), number of duplicate files skipped)
+    """
+
+    files = {}
+    duplicates = 0
+    for folder, language in sources:
+        for path in sorted(glob.glob(os.path.join(base_folder, folder, "*.txt"))):
+            hash = os.path.splitext(os.path.basename(path))[0]
+            if hash in files:
+                duplicates += 1
+                continue
+            files[hash] = (path, language)
+    return files, duplicates
+
+def load_languages(link_tables : list = DEFAULT_LINK_TABLES, base_folder : str = "."):
+    """hash -> valid_language from the privacy link tables, the first table with a language for a hash wins"""
+
+    languages = {}
+    for table in link_tables:
+        path = os.path.join(base_folder, table)
+        if not os.path.exists(path):
+            continue
+        links = pd.read_csv(path, dtype = str, keep_default_na = False, usecols = ["hash", "valid_language"])
+        for hash, language in zip(links["hash"], links["valid_language"]):
+            if language and hash not in languages:
+                languages[hash] = language
+    return languages
+
+def build_archive(path : str, sources : list = DEFAULT_SOURCES, languages : dict = None, base_folder : str = ".", level : int = 19, dict_size : int = 256 << 10, workers : int = None):
+    """Overview
+    --
+    Packs the raw policy texts of the source folders into one archive (written atomically)
+
+    Parameters
+    --
+    path : archive file to write, by convention ending in .pzst
+    sources : list of (folder, language or None), see collect_sources
+    languages : hash -> language, takes precedence over the language of the source folder ("und" if neither has one)
+    base_folder : source folders are relative to this
+    level : zstd compression level
+    dict_size : maximum size of the trained dictionary
+    workers : compression threads, None for one per cpu
+
+    Returns
+    --
+    dict
+        documents, frames, duplicate_files, raw_bytes, archive_bytes
+    """
+
+    files, duplicate_files = collect_sources(sources, base_folder)
+    languages = languages or {}
+
+    records = []
+    for hash, (file, source_language) in files.items():
+        with open(file, "rb") as f:
+            records.append((hash, languages.get(hash) or source_language or "und", f.read()))
+    #grouped by language so iter_texts(language) is one sequential pass
+    records.sort(key = lambda record: (record[1], record[0]))
+
+    #identical texts under different hashes share one frame
+    frame_of = {}
+    bodies = []
+    for _, _, body in records:
+        if body not in frame_of:
+            frame_of[body] = len(bodies)
+            bodies.append(body)
+
+    dictionary = train_dictionary(bodies, dict_size)
+    local = threading.local()
+
+    def compress(body):
+        #compressors are not thread safe, one per thread
+        compressor = getattr(local, "compressor", None)
+        if compressor is None:
+            compressor = local.compressor = zstd.ZstdCompressor(level = level, dict_data = dictionary, write_content_size = True, write_dict_id = dictionary is not None)
+        return compressor.compress(body)
+
+    with ThreadPoolExecutor(max_workers = workers or os.cpu_count()) as executor:
+        frames = list(executor.map(compress, bodies))
+
+    language_names = sorted({language for _, language, _ in records})
+    language_ids = {language: i for i, language in enumerate(language_names)}
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        frame_offsets = []
+        for frame in frames:
+            frame_offsets.append(f.tell())
+            f.write(frame)
+
+        dict_bytes = dictionary.as_bytes() if dictionary is not None else b""
+        dict_offset = f.tell()
+        f.write(dict_bytes)
+
+        meta = {
+            "version": 1,
+            "created": datetime.now().isoformat(timespec = "seconds"),
+            "languages": language_names,
+            "sources": [[folder, language] for folder, language in sources],
+            "level": level,
+            "documents": len(records),
+            "frames": len(frames),
+            "raw_bytes": sum(len(body) for _, _, body in records),
+        }
+        meta_bytes = json.dumps(meta).encode("utf-8")
+        meta_offset = f.tell()
+        f.write(meta_bytes)
+
+        index = np.zeros(len(records), dtype = INDEX_DTYPE)
+        for i, (hash, language, body) in enumerate(records):
+            frame = frame_of[body]
+            index[i] = (_hash_bytes(hash), frame_offsets[frame], len(frames[frame]), len(body), language_ids[language])
+        order = np.argsort(index["hash"], kind = "stable")
+        index = index[order]
+        bits = _fanout_bits(len(index))
+
+        #index and fanout are 8 byte aligned so they can be viewed in place
+        f.write(b"\0" * (-f.tell() % 8))
+        index_offset = f.tell()
+        f.write(index.tobytes())
+        f.write(b"\0" * (-f.tell() % 8))
+        f.write(_fanout(index["hash"], bits).tobytes())
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, dict_offset, len(dict_bytes), meta_offset, len(meta_bytes), index_offset, len(index), bits))
+    os.replace(tmp, path)
+
+    return {"documents": len(records), "frames": len(frames), "duplicate_files": duplicate_files, "raw_bytes": meta["raw_bytes"], "archive_bytes": os.path.getsize(path)}
+
+#-------- reading --------#
+
+class PolicyArchive:
+    """Read only view of a policy archive, safe to share between threads
+
+    Parameters
+    ----------
+    path : archive file written by build_archive
+    """
+
+    def __init__(self, path : str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, dict_offset, dict_size, meta_offset, meta_size, index_offset, count, bits = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a policy archive")
+        self.meta = json.loads(self._map[meta_offset:meta_offset + meta_size])
+        self.languages = self.meta["languages"]
+        self.fanout_bits = bits
+
+        #views into the mapped file, nothing is copied or parsed up front. They never leave the class, a view
+        #held elsewhere would keep close() from unmapping the file
+        self._index = np.frombuffer(self._map, dtype = INDEX_DTYPE, count = count, offset = index_offset)
+        fanout_offset = index_offset + count * INDEX_DTYPE.itemsize
+        fanout_offset += -fanout_offset % 8
+        self._fanout = np.frombuffer(self._map, dtype = "<u8", count = 2 ** bits + 1, offset = fanout_offset)
+
+        self._dictionary = zstd.ZstdCompressionDict(self._map[dict_offset:dict_offset + dict_size]) if dict_size else None
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        #the numpy views hold the map, drop them first
+        self._index = self._fanout = None
+        try:
+            self._map.close()
+        except BufferError:
+            #something still references the mapped memory, the map is released with the last reference
+            pass
+        self._file.close()
+        if _open_archives.get(self.path) is self:
+            del _open_archives[self.path]
+
+    @property
+    def index(self):
+        """Copy of the INDEX_DTYPE records, sorted by hash"""
+
+        return self._index.copy()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, hash : str):
+        return self._find(hash) is not None
+
+    def _decompressor(self):
+        #decompressors are not thread safe, one per thread
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstd.ZstdDecompressor(dict_data = self._dictionary)
+        return decompressor
+
+    def _find(self, hash : str):
+        """Row of hash in the index, None if missing"""
+
+        try:
+            key = _hash_bytes(hash)
+        except ValueError:
+            return None
+        bucket = int.from_bytes(key[:4], "big") >> (32 - self.fanout_bits)
+        start, end = int(self._fanout[bucket]), int(self._fanout[bucket + 1])
+        #compared as an array, single S32 values lose trailing zero bytes
+        rows = np.flatnonzero(self._index["hash"][start:end] == key)
+        return start + int(rows[0]) if len(rows) else None
+
+    def _read_row(self, row : int):
+        record = self._index[row]
+        offset, length = int(record["offset"]), int(record["length"])
+        return self._decompressor().decompress(self._map[offset:offset + length])
+
+    def read_bytes(self, hash : str):
+        """Raw bytes of a policy. Raises KeyError if the archive doesn't have it"""
+
+        row = self._find(hash)
+        if row is None:
+            raise KeyError(hash)
+        return self._read_row(row)
+
+    def read(self, hash : str):
+        """Text of a policy, the same string as reading its {hash}.txt. Raises KeyError if the archive doesn't have it"""
+
+        return self.read_bytes(hash).decode("utf-8")
+
+    def language(self, hash : str):
+        row = self._find(hash)
+        return None if row is None else self.languages[int(self._index[row]["language"])]
+
+    def _language_rows(self, language : str = None):
+        """Index rows of a language in file order, "zh" also matches "zh-cn" and "zh-tw" """
+
+        if language is None:
+            rows = np.arange(len(self._index))
+        else:
+            ids = [i for i, name in enumerate(self.languages) if name == language or name.startswith(f"{language}-")]
+            rows = np.flatnonzero(np.isin(self._index["language"], ids))
+        return rows[np.argsort(self._index["offset"][rows], kind = "stable")]
+
+    def hashes(self, language : str = None):
+        """Hashes in the archive (of one language), sorted"""
+
+        return sorted(_hash_hex(key) for key in self._index["hash"][self._language_rows(language)])
+
+    def iter_texts(self, language : str = None):
+        """Yields (hash, text) of every policy (of one language), reading the file front to back"""
+
+        for row in self._language_rows(language):
+            yield _hash_hex(self._index[row]["hash"]), self._read_row(row).decode("utf-8")
+
+    def stats(self):
+        """documents, frames, raw_bytes, archive_bytes and documents per language"""
+
+        counts = np.bincount(self._index["language"], minlength = len(self.languages))
+        return {
+            "documents": len(self._index),
+            "frames": self.meta["frames"],
+            "raw_bytes": self.meta["raw_bytes"],
+            "archive_bytes": os.path.getsize(self.path),
+            "dictionary_bytes": len(self._dictionary.as_bytes()) if self._dictionary is not None else 0,
+            "languages": {name: int(count) for name, count in zip(self.languages, counts)},
+        }
+
+#-------- folder or archive --------#
+
+#archives opened by this process, so pool workers map each archive once
+_open_archives = {}
+
+def is_archive(source : str):
+    return source.endswith(ARCHIVE_SUFFIX) and os.path.isfile(source)
+
+def open_archive(path : str):
+    archive = _open_archives.get(path)
+    if archive is None:
+        archive = _open_archives[path] = PolicyArchive(path)
+    return archive
+
+def read_policy_text(source : str, hash : str):
+    """Text of a policy from a folder of {hash}.txt files or from a policy archive"""
+
+    if is_archive(source):
+        return open_archive(source).read(hash)
+    with open(os.path.join(source, f"{hash}.txt"), "r", encoding = 'utf-8') as f:
+        return f.read()
+
+def list_policy_hashes(source : str, language : str = None):
+    """Sorted hashes of a folder of {hash}.txt files, or of a policy archive (optionally of one language)"""
+
+    if is_archive(source):
+        return open_archive(source).hashes(language)
+    return sorted(os.path.splitext(os.path.basename(file))[0] for file in glob.glob(os.path.join(source, "*.txt")))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Compressed, randomly accessible archive of raw policy texts")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    build = commands.add_parser("build", help = "pack the raw text folders of policy_corpus into an archive")
+    build.add_argument("archive")
+    build.add_argument("--base", default = ".", help = "policy_corpus folder")
+    build.add_argument("--level", type = int, default = 19)
+    stats = commands.add_parser("stats", help = "documents, sizes and languages of an archive")
+    stats.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(build_archive(args.archive, languages = load_languages(base_folder = args.base), base_folder = args.base, level = args.level))
+    else:
+        with PolicyArchive(args.archive) as archive:
+            print(json.dumps(archive.stats(), indent = 2))
@@ -0,0 +1,288 @@
+#Policy text download job, moved out of the "Extracting Policy" cells of policy_text_crawl.ipynb
+#
+#The notebook loop downloaded one link at a time, listed ./policies/ and scanned the whole link table for every
+#link, and only kept valid_language if the to_csv cell was run afterwards. Here the link tables are loaded once
+#into a sqlite checkpoint (download_state.db), links are downloaded by a bounded thread pool, every {hash}.txt is
+#written atomically and the status of each link (downloaded / error, language, error message) is committed as
+#soon as it finishes. Pages are fetched through the crawler's shared page cache (crawler/page_cache), so a policy
+#page the crawl already downloaded is served from disk or revalidated instead of downloaded again. A crashed or interrupted run resumes from the checkpoint: finished links are never fetched
+#again and the policies folder is never listed again.
+#
+#usage:
+#   python policy_downloader.py privacy_links_df_updated.csv --out policies --workers 16 --export privacy_links_df_updated.csv
+#or from the notebook:
+#   from policy_downloader import DownloadState, download_policies
+#   state = DownloadState("download_state.db")
+#   state.add_links(["privacy_links_df_updated.csv"], "policies")
+#   download_policies(state, "policies", workers = 16)
+#   state.export_csv("privacy_links_df_updated.csv", "privacy_links_df_updated.csv")
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+import requests
+from langdetect import detect, DetectorFactory
+from langdetect.lang_detect_exception import LangDetectException
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from tqdm import tqdm
+
+#page cache, text extraction and user agents are shared with the crawler
+CRAWLER_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "crawler")
+sys.path.insert(0, CRAWLER_FOLDER)
+from page_cache import get_page_cache
+from html_extract import extract_text
+from PolicyLinkExtractor import get_random_user_agent
+
+#same detection result on every run
+DetectorFactory.seed = 0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    privacy_link TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    domain TEXT,
+    init_language TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    valid_language TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_links_status ON links(status);
+CREATE INDEX IF NOT EXISTS idx_links_hash ON links(hash);
+"""
+
+#status values of a link
+PENDING, DOWNLOADED, ERROR = "pending", "downloaded", "error"
+
+#the crawl's page cache, so pages it fetched are not downloaded again
+DEFAULT_CACHE = os.path.join(CRAWLER_FOLDER, "page_cache")
+
+#-------- checkpoint --------#
+
+class DownloadState:
+    """Per link download status in sqlite, written only by the thread that owns the object"""
+
+    def __init__(self, path : str = "download_state.db"):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout = 30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add_links(self, csv_files : list, policy_folder : str = None):
+        """Overview
+        --
+        Adds the links of privacy link tables that are not in the checkpoint yet, known links keep their status.
+        A row already marked policy_downloaded (or, if policy_folder is given, whose {hash}.txt exists) starts as
+        downloaded. The folder is only listed when new links were found, never on a plain resume.
+
+        Parameters
+        --
+        csv_files : privacy link csvs (domain, privacy_link, hash, init_language, valid_language, policy_downloaded),
+                    the first file wins for links found in several
+        policy_folder : folder of already downloaded {hash}.txt files
+
+        Returns
+        --
+        int
+            number of links added
+        """
+
+        tables = [pd.read_csv(file, dtype = str, keep_default_na = False) for file in csv_files]
+        links = pd.concat(tables, ignore_index = True).drop_duplicates(subset = "privacy_link")
+        links = links[(links["privacy_link"] != "") & (links["hash"] != "")]
+
+        known = {row[0] for row in self.conn.execute("SELECT privacy_link FROM links")}
+        new = links[~links["privacy_link"].isin(known)]
+        if new.empty:
+            return 0
+
+        existing = set(os.listdir(policy_folder)) if policy_folder and os.path.isdir(policy_folder) else set()
+        now = time.time()
+        rows = []
+        empty = [""] * len(new)
+        columns = [new[name].tolist() if name in new.columns else empty for name in ("domain", "init_language", "valid_language", "policy_downloaded")]
+        for link, hash, domain, init_language, valid_language, downloaded in zip(new["privacy_link"], new["hash"], *columns):
+            done = downloaded.upper() == "TRUE" or f"{hash}.txt" in existing
+            rows.append((link, hash, domain or None, init_language or None, DOWNLOADED if done else PENDING, valid_language or None, now))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO links (privacy_link, hash, domain, init_language, status, valid_language, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows)
+        return len(rows)
+
+    def pending(self, max_attempts : int = 3):
+        """(privacy_link, hash) still to download: pending links and failed links with attempts left, one link per hash"""
+
+        rows = self.conn.execute(
+            """SELECT privacy_link, hash FROM links
+               WHERE (status = ? OR (status = ? AND attempts < ?))
+                 AND hash NOT IN (SELECT hash FROM links WHERE status = ?)
+               ORDER BY attempts, rowid""",
+            (PENDING, ERROR, max_attempts, DOWNLOADED)).fetchall()
+        seen = set()
+        return [(link, hash) for link, hash in rows if not (hash in seen or seen.add(hash))]
+
+    def record(self, link : str, status : str, language : str = None, error : str = None):
+        """Commits the result of one download"""
+
+        with self.conn:
+            self.conn.execute(
+                "UPDATE links SET status = ?, valid_language = COALESCE(?, valid_language), error = ?, attempts = attempts + 1, updated_at = ? WHERE privacy_link = ?",
+                (status, language, error, time.time(), link))
+
+    def counts(self):
+        """status -> number of links"""
+
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM links GROUP BY status").fetchall())
+
+    def export_csv(self, csv_file : str, out_file : str = None):
+        """Overview
+        --
+        Writes valid_language and policy_downloaded from the checkpoint back into a privacy link table, so the
+        table is up to date without running a separate to_csv cell. Links not in the checkpoint keep their values.
+
+        Parameters
+        --
+        csv_file : privacy link table to update
+        out_file : where to write it, default overwrite csv_file (atomically)
+        """
+
+        table = pd.read_csv(csv_file, dtype = str, keep_default_na = False)
+        languages = dict(self.conn.execute("SELECT privacy_link, valid_language FROM links"))
+        #a link counts as downloaded when its {hash}.txt exists, whichever link with that hash fetched it
+        downloaded = {row[0] for row in self.conn.execute("SELECT DISTINCT hash FROM links WHERE status = ?", (DOWNLOADED,))}
+
+        found = table["privacy_link"].isin(languages)
+        table.loc[found, "valid_language"] = [languages[link] or "" for link in table.loc[found, "privacy_link"]]
+        table.loc[found, "policy_downloaded"] = ["TRUE" if hash in downloaded else "FALSE" for hash in table.loc[found, "hash"]]
+
+        _write_atomic(out_file or csv_file, table.to_csv(index = False))
+
+#-------- downloading --------#
+
+def _write_atomic(path : str, text : str):
+    #write next to the target and rename, a crash never leaves a half written file under the final name
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding = 'utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def fetch_and_convert_website(url : str, timeout : int = 20):
+    """Visible text of a policy page, fetched through the shared page cache. Raises like PageCache.get"""
+
+    page = get_page_cache(DEFAULT_CACHE).get(url, headers = {'User-Agent': get_random_user_agent()}, timeout = timeout)
+    return extract_text(page.content)
+
+def detect_language(text : str):
+    try:
+        return detect(text)
+    except LangDetectException:
+        return None
+
+def download_policy(link : str, hash : str, out_folder : str, timeout : int = 20):
+    """Downloads one link into {hash}.txt, returns (status, language, error). Runs in the worker threads"""
+
+    #malformed links raise urllib3's LocationParseError or UnicodeError (both ValueErrors) instead of a RequestException
+    try:
+        text = fetch_and_convert_website(link, timeout)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return ERROR, None, f"{type(e).__name__}: {e}"
+    if not text:
+        return ERROR, None, "empty page"
+
+    language = detect_language(text)
+    try:
+        _write_atomic(os.path.join(out_folder, f"{hash}.txt"), text)
+    except OSError as e:
+        return ERROR, language, f"{type(e).__name__}: {e}"
+    return DOWNLOADED, language, None
+
+def download_policies(state : DownloadState, out_folder : str = "policies", workers : int = 16, max_attempts : int = 3, timeout : int = 20):
+    """Overview
+    --
+    Downloads every pending link of the checkpoint with at most `workers` requests in flight. Results are
+    committed one by one from the calling thread, so stopping the job at any point loses at most the
+    downloads that were in flight.
+
+    Parameters
+    --
+    state : DownloadState to work from
+    out_folder : folder the {hash}.txt files are written to
+    workers : number of concurrent downloads
+    max_attempts : failed links are retried by later runs until they failed this often
+    timeout : request timeout in seconds
+
+    Returns
+    --
+    dict
+        status -> number of links finished with that status in this run
+    """
+
+    os.makedirs(out_folder, exist_ok = True)
+    pending = state.pending(max_attempts)
+    todo = iter(pending)
+    finished = {DOWNLOADED: 0, ERROR: 0}
+
+    with ThreadPoolExecutor(max_workers = workers) as executor, tqdm(total = len(pending)) as progress:
+        in_flight = {}
+
+        def submit_next():
+            for link, hash in todo:
+                in_flight[executor.submit(download_policy, link, hash, out_folder, timeout)] = link
+                return
+
+        #only `workers` futures at a time, the remaining links stay in the iterator
+        for _ in range(workers):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when = FIRST_COMPLETED)
+            for future in done:
+                link = in_flight.pop(future)
+                status, language, error = future.result()
+                state.record(link, status, language, error)
+                finished[status] += 1
+                progress.update(1)
+                submit_next()
+
+    return finished
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Resumable download of policy texts from privacy link tables")
+    parser.add_argument("csv_files", nargs = "+", help = "privacy link csvs, earlier files win for duplicate links")
+    parser.add_argument("--out", default = "policies", help = "folder for the {hash}.txt files")
+    parser.add_argument("--state", default = "download_state.db", help = "sqlite checkpoint")
+    parser.add_argument("--workers", type = int, default = 16)
+    parser.add_argument("--max-attempts", type = int, default = 3)
+    parser.add_argument("--timeout", type = int, default = 20)
+    parser.add_argument("--cache", default = DEFAULT_CACHE, help = "page cache folder, shared with the crawler")
+    parser.add_argument("--export", help = "privacy link csv to write valid_language/policy_downloaded back into")
+    args = parser.parse_args()
+
+    get_page_cache(args.cache)
+    with DownloadState(args.state) as state:
+        print(f"added {state.add_links(args.csv_files, args.out)} new links")
+        try:
+            print(download_policies(state, args.out, args.workers, args.max_attempts, args.timeout))
+        except KeyboardInterrupt:
+            print("interrupted, finished links are checkpointed", file = sys.stderr)
+        finally:
+            if args.export:
+                state.export_csv(args.export)
+        print(state.counts())
@@ -2,7 +2,13 @@ import pandas as pd
 import re
 import os
 import glob
+import heapq
+import multiprocessing
 import sudachipy
+import tokenize_manifest
+import link_registry
+import morpheme_cache
+import text_chunker
 import cProfile
 import pstats
 from pstats import SortKey
@@ -34,54 +40,69 @@ def simple_japanese_test(text :str ,threshold = 1):
     check = text_set.intersection(kana)
     return len(check) >= threshold
 
+#distinct URLs of a hash, the same rule for a table and a registry
+#counts distinct URLs, not rows: a hash listed twice with the same URL has a count of 1
+#(the table rows used to be counted, so such a hash was reported as having too many URL's)
+def _url_count(url_table : pd.DataFrame | link_registry.LinkRegistry, hash : str):
+    if isinstance(url_table, link_registry.LinkRegistry):
+        return url_table.url_count(hash)
+    return url_table.loc[url_table['hash'] == hash, "url"].nunique()
+
 #Function using table of URL <-> Hash for mapping file names to correct website
-def file_matcher_str(url_table : pd.DataFrame, hash : str):
+def file_matcher_str(url_table : pd.DataFrame | link_registry.LinkRegistry, hash : str):
     """uses table to match websites to their hash
 
     Parameters
     ----------
-    url_table :dataframe with 2 rows, 'url' and 'hash'
+    url_table :dataframe with 2 rows, 'url' and 'hash', or a LinkRegistry (constant time lookup, use it when matching many hashes)
     hash: the coresponidng url hash
 
     Returns
     -------
     str
-        If found: URL
+        If found with one distinct URL: URL
         If not found: "{hash} has no associated URL"
-        If found more than once: "{hash} has too many associated URL's"
+        If found with more than one distinct URL: "{hash} has too many associated URL's"
+
+    Notes
+    -----
+    Distinct URLs are counted, not table rows. A hash listed twice with the same URL returns that URL;
+    before, it returned "{hash} has too many associated URL's".
     """
-    index = url_table[url_table['hash'] == hash].index.to_list()
+    count = _url_count(url_table, hash)
 
     #check if text has an associated URL
-    if(len(index) < 1):
+    if(count < 1):
         return f"{hash} has no associated URL"
-    if(len(index) > 1):
+    if(count > 1):
         return f"{hash} has too many associated URL's"
-    
-    return url_table[index,"url"]
+
+    if isinstance(url_table, link_registry.LinkRegistry):
+        return url_table.url(hash)
+    return url_table.loc[url_table['hash'] == hash, "url"].iloc[0]
 
 #Function using table of URL <-> Hash to confirm hash has valid url
-def file_matcher_bool(url_table : pd.DataFrame, hash : str):
+def file_matcher_bool(url_table : pd.DataFrame | link_registry.LinkRegistry, hash : str):
     """uses table to check for url
 
     Parameters
     ----------
-    url_table :dataframe with 2 rows, 'url' and 'hash'
+    url_table :dataframe with 2 rows, 'url' and 'hash', or a LinkRegistry (constant time lookup, use it when matching many hashes)
     hash: the coresponidng url hash
 
     Returns
     -------
     bool
-        If in table exactly once: True
+        If in table with exactly one distinct URL: True
         Else: False
-    """
-    index = url_table[url_table['hash'] == hash].index.to_list()
 
+    Notes
+    -----
+    Distinct URLs are counted, not table rows. A hash listed twice with the same URL is True;
+    before, it was False.
+    """
     #check if text has an associated URL
-    if(len(index) == 1):
-        return True
-    
-    return False
+    return _url_count(url_table, hash) == 1
 
 #helper function to collect POS tags for POS translation 
 #only needs to be used once
@@ -108,33 +129,72 @@ def get_pos_tags(text : str, tokenizer : sudachipy.Tokenizer):
     
     #tokenize section by section to avoid SudachiPy input size limit
     for sec in sections:
-        tokens = tokenizer.tokenize(sec)
+        for chunk in text_chunker.iter_chunks(sec):
+            tokens = tokenizer.tokenize(chunk)
 
-        #loops over tokens - each token is a new row
-        for token in tokens:
-            pos = token.part_of_speech()
-            for p in pos:
-                to_return.add(p)
+            #loops over tokens - each token is a new row
+            for token in tokens:
+                pos = token.part_of_speech()
+                for p in pos:
+                    to_return.add(p)
 
     return to_return
 
 #-------- tokenization helper functions: ---------#
 
+#column order of the tokenized output, shared by the csv and parquet writers
+TOKEN_COLUMNS = ["Surface","Normalized","Reading","Dictionary","POS1","POS2","POS3","POS4","Conj_Type","Conj","OOV","B_Split","A_Split","Section"]
+
+#split column value of one token, "-" joined surfaces or "*" when the token is not split further
+def _split_str(sub_tokens : sudachipy.MorphemeList):
+    if len(sub_tokens) == 0:
+        return "*" #matches SudachiPy na value
+    return "-".join([sub_token.surface() for sub_token in sub_tokens])
+
+#B_Split/A_Split columns of a whole section in one pass over its tokens
+def section_splits(tokens : list, out_b : sudachipy.MorphemeList, out_a : sudachipy.MorphemeList):
+    """Splits every token of a section into B and A units, returning both columns as lists
+
+    B units lie between A and C units, so a token that has no A split has no B split either and
+    the B split is only computed for tokens that split in A mode. The split results are written into
+    out_b/out_a instead of allocating two new MorphemeLists per token
+
+    Parameters
+    ----------
+    tokens : C mode tokens of a section (the kept ones)
+    out_b : MorphemeList reused for the B mode splits
+    out_a : MorphemeList reused for the A mode splits
+
+    Returns
+    -------
+    tuple(list, list)
+        B_Split and A_Split value of every token, in token order
+    """
+
+    b_splits = []
+    a_splits = []
+    for token in tokens:
+        a_split = _split_str(token.split(sudachipy.SplitMode.A, out = out_a, add_single = False))
+        a_splits.append(a_split)
+        b_splits.append("*" if a_split == "*" else _split_str(token.split(sudachipy.SplitMode.B, out = out_b, add_single = False)))
+    return b_splits, a_splits
+
 #tokenization helper function
-def tokenize(f_name : str, text : str, tokenizer : sudachipy.Tokenizer, stopwords : set = {}):
-    """Tokenization helper function
+def tokenize_rows(text : str, tokenizer : sudachipy.Tokenizer, stopwords : set = {}, single_pass : bool = True, cache : morpheme_cache.MorphemeCache = None):
+    """Tokenizes text and yields one row per kept token
 
     Parameters
     ----------
-    f_name : Name of output file relative to current directory, in this case often a hash
     text : The text to tokenize
     tokenizer : The SudachiPy tokenizer to use
     stopwords : Set of stopwords to remove (Usu. stopwords-ja.txt)
+    single_pass : if true, the kept tokens of each section are split together by section_splits (same output as calling token.split per token)
+    cache : MorphemeCache to look up features and splits of repeated words in, None to always ask SudachiPy
 
     Returns
     -------
-    void
-        Creates file at the file location specified
+    generator(tuple)
+        One tuple per token, in the order of TOKEN_COLUMNS
     """
 
     #clean and split text by "section"
@@ -142,49 +202,203 @@ def tokenize(f_name : str, text : str, tokenizer : sudachipy.Tokenizer, stopword
     text = re.sub('[\n\r]+','\n',text)
     text = re.sub(',|，','、',text)#replace our seperator value with japanese equvalent
     sections = text.split("\n")
-    
-    with open(f"{f_name}.csv", "w+") as out:
-        #headers
-        out.write(f"Surface,Normalized,Reading,Dictionary,POS1,POS2,POS3,POS4,Conj_Type,Conj,OOV,B_Split,A_Split,Section\n")
 
-        #tokenize section by section to avoid SudachiPy input size limit
-        for idx, sec in enumerate(sections):
-            tokens = tokenizer.tokenize(sec)
+    if single_pass:
+        #empty lists the splits are written into, reused for every token
+        out_b = tokenizer.tokenize("")
+        out_a = tokenizer.tokenize("")
 
-            #loops over tokens - each token is a new row
-            for token in tokens:
+    #tokenize section by section to avoid SudachiPy input size limit
+    #sections over the limit are cut at sentence boundaries first, their chunks keep the section number
+    chunks = ((idx, chunk) for idx, sec in enumerate(sections) for chunk in text_chunker.iter_chunks(sec))
+    for idx, sec in chunks:
+        tokens = tokenizer.tokenize(sec)
 
-                if(token.normalized_form() in stopwords):
-                    continue
+        #loops over tokens - each kept token is a new row
+        kept = []
+        for token in tokens:
 
-                #split POS tuple - always 6 elements
+            if cache is not None:
+                word_id, normalized, reading, dictionary, pos = cache.features(token)
+            else:
+                word_id = None
+                normalized = token.normalized_form()
+
+            if(normalized in stopwords):
+                continue
+
+            #split POS tuple - always 6 elements
+            if cache is None:
                 pos = token.part_of_speech()
 
-                if(pos[0] == "空白"):
+            if(pos[0] == "空白"):
+                continue
+            if(pos[0] == "補助記号"):
+                if(pos[1] != "句点" and pos[1] != "読点" ):
                     continue
-                if(pos[0] == "補助記号"):
-                    if(pos[1] != "句点" and pos[1] != "読点" ):
-                        continue
-                
-                #spliting on splitmode A
-                a_split = [sub_token.surface() for sub_token in token.split(sudachipy.SplitMode.A, add_single = False)] #split tuple of morphemes into list of strings
-                if len(a_split) == 0:
-                    a_split = "*" #matches SudachiPy na value
-                else:
-                    a_split = "-".join(a_split)
-
-                #spliting on splitmode B
-                b_split = [sub_token.surface() for sub_token in token.split(sudachipy.SplitMode.B, add_single = False)] #split tuple of morphemes into list of strings
-                if len(b_split) == 0:
-                    b_split = "*" #matches SudachiPy na value
-                else:
-                    b_split = "-".join(b_split) 
-
-                #write tokens to f_name.csv
-                out.write(f"{token.surface()},{token.normalized_form()},{token.reading_form()},{token.dictionary_form()},{",".join(pos)},{token.is_oov()},{b_split},{a_split},{idx+1}\n")
+
+            if cache is None:
+                reading = token.reading_form()
+                dictionary = token.dictionary_form()
+                is_oov = token.is_oov()
+            else:
+                is_oov = word_id is None #only OOV morphemes have no cached word id
+            kept.append((token, token.surface(), word_id, normalized, reading, dictionary, pos, is_oov))
+
+        #(b split, a split) per kept token, only words not seen before with the same surface are split
+        splits = [None] * len(kept)
+        misses = []
+        for i, (_, surface, word_id, *_) in enumerate(kept):
+            if word_id is not None:
+                splits[i] = cache.get_splits(word_id, surface)
+            if splits[i] is None:
+                misses.append(i)
+
+        if single_pass:
+            b_splits, a_splits = section_splits([kept[i][0] for i in misses], out_b, out_a)
+        else:
+            #spliting on splitmode A and B
+            a_splits = [_split_str(kept[i][0].split(sudachipy.SplitMode.A, add_single = False)) for i in misses]
+            b_splits = [_split_str(kept[i][0].split(sudachipy.SplitMode.B, add_single = False)) for i in misses]
+
+        for j, i in enumerate(misses):
+            splits[i] = (b_splits[j], a_splits[j])
+            word_id = kept[i][2]
+            if word_id is not None:
+                cache.put_splits(word_id, kept[i][1], splits[i])
+
+        for (token, surface, word_id, normalized, reading, dictionary, pos, is_oov), (b_split, a_split) in zip(kept, splits):
+            yield (surface, normalized, reading, dictionary, *pos, is_oov, b_split, a_split, idx+1)
+
+def tokenize(f_name : str, text : str, tokenizer : sudachipy.Tokenizer, stopwords : set = {}, single_pass : bool = True, cache : morpheme_cache.MorphemeCache = None):
+    """Tokenization helper function
+
+    Parameters
+    ----------
+    f_name : Name of output file relative to current directory, in this case often a hash
+    text : The text to tokenize
+    tokenizer : The SudachiPy tokenizer to use
+    stopwords : Set of stopwords to remove (Usu. stopwords-ja.txt)
+    single_pass : compute the split columns per section, see tokenize_rows
+    cache : MorphemeCache for repeated words, see tokenize_rows
+
+    Returns
+    -------
+    void
+        Creates file at the file location specified
+    """
+
+    with open(f"{f_name}.csv", "w+") as out:
+        #headers
+        out.write(",".join(TOKEN_COLUMNS) + "\n")
+
+        #write tokens to f_name.csv
+        for row in tokenize_rows(text, tokenizer, stopwords = stopwords, single_pass = single_pass, cache = cache):
+            out.write(",".join(map(str, row)) + "\n")
+
+#tokenizes a single text file into out_folder, shared by the serial and multi-process paths
+def tokenize_file(file : str, out_folder : str, tokenizer : sudachipy.Tokenizer, stopwords : set = {}, writer = None, single_pass : bool = True, cache : morpheme_cache.MorphemeCache = None):
+    """Reads one text file and writes its tokenized csv if it passes the japanese test
+
+    Parameters
+    ----------
+    file : path to the text file, file name (without extension) is used as output name
+    out_folder : relative path to out put folder
+    tokenizer : The SudachiPy tokenizer to use
+    stopwords : Set of stopwords to remove (Usu. stopwords-ja.txt)
+    writer : token_store.TokenStoreWriter to add the tokens to instead of writing a csv
+    single_pass : compute the split columns per section, see tokenize_rows
+    cache : MorphemeCache for repeated words, see tokenize_rows
+
+    Returns
+    -------
+    bool
+        True if the tokens were written, False if the text was skipped
+    """
+
+    filename = os.path.splitext(os.path.basename(file))[0]
+
+    with open(file, 'r') as f:
+        text = f.read()
+
+    if(simple_japanese_test(text)):
+        if writer is not None:
+            writer.add(filename, tokenize_rows(text, tokenizer, stopwords = stopwords, single_pass = single_pass, cache = cache))
+        else:
+            tokenize(f'{out_folder}/{filename}', text, tokenizer, stopwords = stopwords, single_pass = single_pass, cache = cache) #creates and writes tokenized csv of the given text file
+        return True
+
+    return False
+
+#splits files into chunks with roughly equal total size so no worker is left with all the long policies
+def size_balanced_chunks(files : list, n_chunks : int):
+    """Greedy size balancing - biggest file goes into the currently lightest chunk
+
+    Parameters
+    ----------
+    files : list of file paths
+    n_chunks : number of chunks to create
+
+    Returns
+    -------
+    list(list)
+        Non-empty chunks of file paths, heaviest chunk first
+    """
+
+    n_chunks = max(1, min(n_chunks, len(files)))
+    chunks = [[] for _ in range(n_chunks)]
+    heap = [(0, i) for i in range(n_chunks)] #(total bytes, chunk index)
+
+    for file in sorted(files, key = os.path.getsize, reverse = True):
+        total, i = heapq.heappop(heap)
+        chunks[i].append(file)
+        heapq.heappush(heap, (total + os.path.getsize(file), i))
+
+    chunks.sort(key = lambda chunk: sum(os.path.getsize(file) for file in chunk), reverse = True)
+    return [chunk for chunk in chunks if chunk]
+
+#per process state for mass_tokenizer workers, set once by _init_worker
+_worker_dict = None
+_worker_tokenizer = None
+_worker_stopwords = {}
+_worker_single_pass = True
+_worker_cache = None
+
+def _init_worker(stopwords : set, single_pass : bool = True, cache_size : int = 0):
+    """Pool initializer - loads the full dictionary once per worker process"""
+
+    global _worker_dict, _worker_tokenizer, _worker_stopwords, _worker_single_pass, _worker_cache
+    _worker_dict = sudachipy.Dictionary(dict = "full")
+    _worker_tokenizer = _worker_dict.create(mode = sudachipy.SplitMode.C)
+    _worker_stopwords = stopwords
+    _worker_single_pass = single_pass
+    _worker_cache = morpheme_cache.MorphemeCache(cache_size) if cache_size > 0 else None #one cache per worker, lives as long as the pool
+
+def _tokenize_chunk(chunk : list, out_folder : str, output : str = "csv", part : int = 0):
+    """Pool task - tokenizes every file of one chunk with the worker's tokenizer, returns [(file, written)]"""
+
+    written = []
+    writer = None
+    if output == "parquet":
+        import token_store
+        writer = token_store.TokenStoreWriter(out_folder, "ja", basename = f"part-{part}") #one parquet file per chunk
+
+    for file in chunk:
+        written.append((file, tokenize_file(file, out_folder, _worker_tokenizer, stopwords = _worker_stopwords, writer = writer, single_pass = _worker_single_pass, cache = _worker_cache)))
+
+    if writer is not None:
+        writer.close()
+    return written
+
+def _tokenize_chunk_args(args : tuple):
+    return _tokenize_chunk(*args)
+
+#name of the csv tokenize_file writes for a given input file
+def _csv_name(file : str):
+    return os.path.splitext(os.path.basename(file))[0] + ".csv"
 
 #tokenizes all files in given folder
-def mass_tokenizer(in_folder : str, out_folder : str, stopwords : set = {}):
+def mass_tokenizer(in_folder : str, out_folder : str, stopwords : set = {}, workers : int = 1, output : str = "csv", incremental : bool = False, single_pass : bool = True, cache : morpheme_cache.MorphemeCache = None):
     """Takes all text files from imput folder and tokenized them as csv files in output foulder 
 
     Parameters
@@ -192,59 +406,102 @@ def mass_tokenizer(in_folder : str, out_folder : str, stopwords : set = {}):
     in_folder : relative path to input folder
     out_folder : relative path to out put folder
     stopwords : Set of stopwords to remove (Usu. stopwords-ja.txt)
+    workers : number of processes to tokenize with, 1 runs serially in this process
+    output : "csv" for one csv per file, "parquet" to (re)write the ja partition of the token store rooted at out_folder
+    incremental : if true, skips files whose input, dictionary, stopwords and settings match out_folder/manifest.json (csv output only)
+    single_pass : compute the split columns per section instead of per token (same output), see tokenize_rows
+    cache : MorphemeCache used by a serial run, a new one is created if None. Worker processes each build their own
+        of the same max_size, so its counters only cover serial runs
 
     Returns
     -------
     void
         Creates tokenized csv files in out_folder
     """
-    
+
+    files = glob.glob(os.path.join(in_folder, '*.txt'))
+
+    if output == "parquet":
+        if incremental:
+            raise ValueError("incremental runs are only supported for csv output, the parquet partition is rewritten as a whole")
+        import token_store
+        token_store.clear_partition(out_folder, "ja")
+
+    #only re-tokenize files that are new or whose inputs changed since the last run
+    manifest = None
+    if incremental:
+        manifest = tokenize_manifest.TokenizeManifest(out_folder, tokenize_manifest.dictionary_version("full"), stopwords, {"dict": "full", "mode": "C", "output": output})
+        files = [file for file in files if not manifest.is_current(file)]
+        if not files:
+            return
+
+    #every file is written independently, so the csv output is the same as the serial run
+    if workers > 1 and len(files) > 1:
+        chunks = size_balanced_chunks(files, workers * 4) #a few chunks per worker to even out the tail
+        cache_size = cache.max_size if cache is not None else morpheme_cache.MorphemeCache().max_size
+        with multiprocessing.Pool(workers, initializer = _init_worker, initargs = (stopwords, single_pass, cache_size)) as pool:
+            try:
+                #results are recorded as chunks finish, so an interrupted run keeps what was already written
+                for results in pool.imap_unordered(_tokenize_chunk_args, [(chunk, out_folder, output, i) for i, chunk in enumerate(chunks)]):
+                    if manifest is not None:
+                        for file, written in results:
+                            manifest.record(file, _csv_name(file) if written else None)
+            finally:
+                if manifest is not None:
+                    manifest.save()
+        return
+
     #create dictionary - Using full for best performance
     full_dict = sudachipy.Dictionary(dict = "full")
     #create tokenizer - Spliting on highest level for NER
     tokenizer_C = full_dict.create(mode = sudachipy.SplitMode.C)
+    if cache is None:
+        cache = morpheme_cache.MorphemeCache()
 
-    # unique_pos = set()
-
-    for file in glob.glob(os.path.join(in_folder, '*.txt')):
-        filename = os.path.splitext(os.path.basename(file))[0]
-        
-        with open(file, 'r') as f:
-            text = f.read()
+    writer = None
+    if output == "parquet":
+        writer = token_store.TokenStoreWriter(out_folder, "ja")
 
-            if(simple_japanese_test(text)):
-                tokenize(f'{out_folder}/{filename}', text, tokenizer_C, stopwords = stopwords) #creates and writes tokenized csv of the given text file
-                #unique_pos = unique_pos.union(get_pos_tags(text, tokenizer_C))
+    # unique_pos = set()
 
-                # print(filename)
-                # print(simple_japanese_test(text))
-                # test = pd.read_csv(f"{out_folder}/{filename}.csv", sep = ",")
-                # print(oov_japanese_test(test))
-                # print("-------------------------")
+    try:
+        for file in files:
+            written = tokenize_file(file, out_folder, tokenizer_C, stopwords = stopwords, writer = writer, single_pass = single_pass, cache = cache)
+            if manifest is not None:
+                manifest.record(file, _csv_name(file) if written else None)
+            #unique_pos = unique_pos.union(get_pos_tags(text, tokenizer_C))
+    finally:
+        if manifest is not None:
+            manifest.save()
 
     # with open("misc/POS_set", "w+") as file2: 
     #     file2.write(",\n".join(unique_pos))
 
+    if writer is not None:
+        writer.close()
     full_dict.close()
 
 
 #-------- Running our tokenizer --------#
 
-#test speed/see what is slowest
-pr = cProfile.Profile()
-pr.enable()
+if __name__ == "__main__":
+    #test speed/see what is slowest
+    pr = cProfile.Profile()
+    pr.enable()
 
-#get stopwords from stopwords-ja.txt
-with open("misc/stopwords-ja.txt", "r") as f:
-    stopwords = set(f.read().split("\n"))
-print(len(stopwords))
+    #get stopwords from stopwords-ja.txt
+    with open("misc/stopwords-ja.txt", "r") as f:
+        stopwords = set(f.read().split("\n"))
+    print(len(stopwords))
 
-mass_tokenizer("Raw_Text(Sample)","Processed_Text(Sample)", stopwords = stopwords)
+    cache = morpheme_cache.MorphemeCache()
+    mass_tokenizer("Raw_Text(Sample)","Processed_Text(Sample)", stopwords = stopwords, cache = cache)
+    print(cache.stats())
 
-pr.disable()
-pr.dump_stats('misc/stats')
-p = pstats.Stats('misc/stats')
-p.strip_dirs().sort_stats(SortKey.TIME).print_stats(20)
+    pr.disable()
+    pr.dump_stats('misc/stats')
+    p = pstats.Stats('misc/stats')
+    p.strip_dirs().sort_stats(SortKey.TIME).print_stats(20)
 
 #-------- Main pre-analysis: --------#
 # - Verifying the language of policy(maybe language translation?)
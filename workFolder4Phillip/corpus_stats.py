@@ -0,0 +1,203 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.compute as pc
+from concurrent.futures import ThreadPoolExecutor
+import token_store
+
+#-------- batch corpus statistics: ---------#
+# Readability, sentence/token/type counts and part of speech distributions for every document of a language
+# at once. The whole tokenized corpus is one Arrow table with a dictionary encoded hash column, every statistic
+# is a np.bincount over the hash codes - there is no per document DataFrame, value_counts() or drop().
+#   stats = corpus_stats(token_store.load_tokens("token_store", languages = ["ja"]), "ja")
+#   stats = csv_folder_stats("../policy_corpus/corpus/korean_preprocessed", "ko")
+
+#per language rules, column names are the token store ones (see token_store.LOWERCASE_COLUMNS)
+#   sentence : (column, values) a token that ends a sentence
+#   punctuation : (column, values) tokens left out of the word and syllable counts
+#   word : column whose length is counted as syllables
+#   pos : column the part of speech distribution is taken over
+LANGUAGE_RULES = {
+    "ja": {"sentence": ("POS2", ["句点"]), "punctuation": ("POS2", ["句点", "読点"]), "word": "Reading", "pos": "POS1"},
+    "ko": {"sentence": ("Normalized", ["."]), "punctuation": ("Normalized", [".", ","]), "word": "Normalized", "pos": "POS1"},
+    #chinese full width punctuation is removed before tokenization, only western periods are left to count
+    "zh": {"sentence": ("Normalized", ["."]), "punctuation": ("Normalized", [".", ","]), "word": "Normalized", "pos": "POS1"},
+}
+
+#columns of the per hash table before the pos_* columns
+STATS_COLUMNS = ["hash", "language", "tokens", "types", "sentences", "words", "syllables", "readability"]
+
+def _codes(column : pa.ChunkedArray):
+    """Dictionary codes of a column as an int64 numpy array and the dictionary values, nulls get code len(values)"""
+
+    array = column.combine_chunks()
+    if not pa.types.is_dictionary(array.type):
+        array = pc.dictionary_encode(array)
+    values = array.dictionary.to_pylist()
+    codes = pc.fill_null(array.indices, len(values)).to_numpy(zero_copy_only = False).astype(np.int64)
+    return codes, values
+
+def _mask(column : pa.ChunkedArray, values : list):
+    """Boolean numpy mask of the rows whose value is one of values"""
+
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    return pc.fill_null(pc.is_in(column, value_set = pa.array(values)), False).to_numpy(zero_copy_only = False)
+
+def corpus_stats(tokens : pa.Table, language : str, scale : float = 1):
+    """Per document statistics of a tokenized corpus
+
+    Parameters
+    ----------
+    tokens : token table with a hash column and token store column names, e.g. from token_store.load_tokens
+    language : key of LANGUAGE_RULES
+    scale : factor the readability scores are multiplied by, as in korean_readability_index
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per hash: STATS_COLUMNS, then pos_{tag} columns with the share of tokens per part of speech
+        Readability is (words + syllables) / sentences as in japanese/korean_readability_index, -1 without sentences
+
+    Notes
+    -----
+    Statistics are taken over the tokens as stored. The readability.csv written by mass_tokenize_korean is
+    computed before stopword removal, so it differs from the score here for documents that had stopwords
+    """
+
+    rules = LANGUAGE_RULES[language]
+    tokens = tokens.unify_dictionaries()
+
+    doc, hashes = _codes(tokens.column("hash"))
+    n_docs = len(hashes)
+
+    #token, sentence, word and syllable counts
+    token_count = np.bincount(doc, minlength = n_docs)
+    sentence_count = np.bincount(doc, weights = _mask(tokens.column(rules["sentence"][0]), rules["sentence"][1]), minlength = n_docs).astype(np.int64)
+
+    is_word = ~_mask(tokens.column(rules["punctuation"][0]), rules["punctuation"][1])
+    word_doc = doc[is_word]
+    word_count = np.bincount(word_doc, minlength = n_docs)
+    lengths = pc.fill_null(pc.utf8_length(tokens.column(rules["word"]).cast(pa.string())), 0).to_numpy(zero_copy_only = False)
+    syllable_count = np.bincount(word_doc, weights = lengths[is_word], minlength = n_docs).astype(np.int64)
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        readability = np.where(sentence_count > 0, (word_count + syllable_count) / sentence_count * scale, -1)
+
+    #distinct normalized forms per document, from the distinct (document, form) pairs
+    norm, forms = _codes(tokens.column("Normalized"))
+    n_norm = len(forms) + 1
+    type_count = np.bincount(np.unique(doc * n_norm + norm) // n_norm, minlength = n_docs)
+
+    stats = pd.DataFrame({
+        "hash": hashes,
+        "language": language,
+        "tokens": token_count,
+        "types": type_count,
+        "sentences": sentence_count,
+        "words": word_count,
+        "syllables": syllable_count,
+        "readability": readability,
+    })
+
+    #part of speech counts as one (documents x tags) matrix
+    pos, tags = _codes(tokens.column(rules["pos"]))
+    n_pos = len(tags) + 1
+    pos_counts = np.bincount(doc * n_pos + pos, minlength = n_docs * n_pos).reshape(n_docs, n_pos)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        shares = pos_counts[:, :len(tags)] / token_count[:, None]
+    used = pos_counts[:, :len(tags)].sum(axis = 0) > 0
+    pos_table = pd.DataFrame(shares[:, used], columns = [f"pos_{tag}" for tag, keep in zip(tags, used) if keep])
+
+    stats = pd.concat([stats, pos_table], axis = 1)
+    #hashes that only exist in the dictionary (filtered out rows) have no tokens
+    return stats[stats["tokens"] > 0].reset_index(drop = True)
+
+#-------- reading csv folders: ---------#
+
+def _read_csv(file : str, columns : list):
+    """Reads the requested columns of one tokenized csv as strings (quoted or not, see token_store.sniff_csv), missing ones as nulls"""
+
+    header, quoted = token_store.sniff_csv(file)
+
+    names = {name: token_store.LOWERCASE_COLUMNS.get(name, name) for name in header}
+    include = [name for name in header if names[name] in columns]
+    table = pv.read_csv(
+        file,
+        read_options = pv.ReadOptions(use_threads = False),
+        parse_options = pv.ParseOptions(quote_char = '"' if quoted else False),
+        convert_options = pv.ConvertOptions(column_types = {name: pa.string() for name in header}, include_columns = include, strings_can_be_null = False),
+    )
+    table = table.rename_columns([names[name] for name in table.column_names])
+    for name in sorted(set(columns) - set(table.column_names)):
+        table = table.append_column(name, pa.nulls(table.num_rows, pa.string()))
+    return table.select(sorted(columns))
+
+def read_csv_files(files : list, columns : list, workers : int = 8):
+    """Reads the given columns of many per document csvs into one token table
+
+    Parameters
+    ----------
+    files : paths of {hash}.csv files
+    columns : token store column names to read, columns a file does not have are null
+    workers : number of threads reading files (pyarrow releases the GIL while parsing)
+
+    Returns
+    -------
+    pa.Table
+        Token table with a dictionary encoded hash column, rows of a document are contiguous and in file order
+    """
+
+    hashes = [os.path.splitext(os.path.basename(file))[0] for file in files]
+    with ThreadPoolExecutor(workers) as pool:
+        tables = list(pool.map(lambda file: _read_csv(file, columns), files))
+
+    sizes = np.array([table.num_rows for table in tables], dtype = np.int64)
+    doc = pa.DictionaryArray.from_arrays(pa.array(np.repeat(np.arange(len(files), dtype = np.int32), sizes)), pa.array(hashes, pa.string()))
+
+    if not tables:
+        return pa.table({name: pa.array([], pa.string()) for name in sorted(columns)}).append_column("hash", doc)
+    tokens = pa.concat_tables(tables).combine_chunks()
+    return tokens.append_column("hash", doc)
+
+def read_csv_folder(in_folder : str, language : str, workers : int = 8):
+    """Reads a folder of per document csvs (e.g. corpus/japanese_preprocessed) into one token table
+
+    Parameters
+    ----------
+    in_folder : folder of {hash}.csv files
+    language : key of LANGUAGE_RULES, decides which columns are read
+    workers : number of threads reading files (pyarrow releases the GIL while parsing)
+
+    Returns
+    -------
+    pa.Table
+        Token table with a dictionary encoded hash column and token store column names
+    """
+
+    rules = LANGUAGE_RULES[language]
+    columns = {"Normalized", rules["sentence"][0], rules["punctuation"][0], rules["word"], rules["pos"]}
+
+    files = sorted(file for file in glob.glob(os.path.join(in_folder, "*.csv")) if os.path.basename(file) != "readability.csv")
+    return read_csv_files(files, columns, workers = workers)
+
+def csv_folder_stats(in_folder : str, language : str, scale : float = 1, workers : int = 8):
+    """corpus_stats over a folder of per document csvs, see read_csv_folder"""
+
+    return corpus_stats(read_csv_folder(in_folder, language, workers = workers), language, scale = scale)
+
+def store_stats(root : str, languages : list = ("ja", "ko", "zh"), scale : float = 1):
+    """corpus_stats for every language partition of the token store, as one per hash table"""
+
+    frames = []
+    for language in languages:
+        rules = LANGUAGE_RULES[language]
+        columns = sorted({"hash", "Normalized", rules["sentence"][0], rules["punctuation"][0], rules["word"], rules["pos"]})
+        tokens = token_store.load_tokens(root, columns = columns, languages = [language])
+        if tokens.num_rows:
+            frames.append(corpus_stats(tokens, language, scale = scale))
+
+    return pd.concat(frames, ignore_index = True).fillna({column: 0.0 for frame in frames for column in frame.columns if column.startswith("pos_")})
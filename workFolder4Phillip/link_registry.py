@@ -0,0 +1,222 @@
+import os
+import glob
+import collections
+import pandas as pd
+
+#-------- link registry: ---------#
+# hash <-> url lookups over every privacy link table, built once. Replaces url_table[url_table['hash'] == hash]
+# and privacy_links_df[privacy_links_df['privacy_link'] == link] scans inside loops with dict lookups.
+#   registry = LinkRegistry.from_corpus("../policy_corpus")
+#   registry.url(hash), registry.hash_for(url), registry.join(hash_list)
+
+#link tables relative to the policy_corpus folder, files matched by earlier patterns take precedence
+DEFAULT_PATTERNS = ["privacy_links_df*.csv", "language_policy_links/*.csv"]
+
+#column names used by the different tables -> registry field
+COLUMN_ALIASES = {"privacy_link": "url", "url": "url", "hash": "hash", "domain": "domain", "valid_language": "language", "init_language": "init_language"}
+
+class LinkEntry:
+    """Everything known about one policy hash"""
+
+    __slots__ = ("hash", "url", "domain", "language", "init_language", "sources")
+
+    def __init__(self, hash, url, domain, language, init_language, source):
+        self.hash = hash
+        self.url = url
+        self.domain = domain
+        # validated language code (langdetect), None if no table has one
+        self.language = language
+        # language of the ranking list the site came from (Japan, Korean, China)
+        self.init_language = init_language
+        # tables the hash was found in, in precedence order
+        self.sources = [source]
+
+    def as_dict(self):
+        return {"hash": self.hash, "url": self.url, "domain": self.domain, "language": self.language, "init_language": self.init_language}
+
+class LinkRegistry:
+    """hash -> url/domain/language and url -> hash indexes over one or more link tables
+
+    Tables are added in precedence order: a field keeps the first non empty value seen for a hash, later
+    disagreeing values are recorded in conflicts instead of overwriting it.
+    """
+
+    def __init__(self):
+        self.entries = {} #hash -> LinkEntry
+        self.by_url = {} #url -> hash
+        self.duplicate_rows = collections.Counter() #source -> rows repeating a hash already in that source
+        self.conflicts = collections.defaultdict(dict) #hash -> field -> set of disagreeing values
+        self.url_conflicts = collections.defaultdict(set) #url -> every hash found for it
+        self.sources = []
+
+    @classmethod
+    def from_corpus(cls, corpus_folder : str = "../policy_corpus", patterns : list = DEFAULT_PATTERNS):
+        """Registry over every link table of the policy corpus
+
+        Parameters
+        ----------
+        corpus_folder : path to the policy_corpus folder
+        patterns : glob patterns relative to corpus_folder, within a pattern newer versions (_v2, _updated) come first
+
+        Returns
+        -------
+        LinkRegistry
+        """
+
+        registry = cls()
+        for pattern in patterns:
+            #reverse name order puts privacy_links_df_updated_v2 before privacy_links_df_updated before privacy_links_df
+            for file in sorted(glob.glob(os.path.join(corpus_folder, pattern)), reverse = True):
+                registry.add_csv(file)
+        return registry
+
+    @classmethod
+    def from_frame(cls, url_table : pd.DataFrame, source : str = "frame"):
+        registry = cls()
+        registry.add_frame(url_table, source)
+        return registry
+
+    def add_csv(self, file : str):
+        """Adds one link table csv, see add_frame"""
+
+        table = pd.read_csv(file, dtype = str, keep_default_na = False, usecols = lambda name: name in COLUMN_ALIASES)
+        self.add_frame(table, os.path.basename(file))
+
+    def add_frame(self, url_table : pd.DataFrame, source : str):
+        """Adds the rows of a link table (needs hash and privacy_link or url, domain/valid_language/init_language optional)
+
+        Parameters
+        ----------
+        url_table : link table
+        source : name the rows are reported under
+        """
+
+        self.sources.append(source)
+        columns = {COLUMN_ALIASES[name]: url_table[name].tolist() for name in url_table.columns if name in COLUMN_ALIASES}
+        empty = [""] * len(url_table)
+        seen = set()
+
+        for hash, url, domain, language, init_language in zip(columns["hash"], columns["url"], columns.get("domain", empty), columns.get("language", empty), columns.get("init_language", empty)):
+            if not hash:
+                continue
+            if hash in seen:
+                self.duplicate_rows[source] += 1
+            seen.add(hash)
+
+            if url:
+                hashes = self.url_conflicts[url]
+                hashes.add(hash)
+                self.by_url.setdefault(url, hash)
+
+            entry = self.entries.get(hash)
+            if entry is None:
+                self.entries[hash] = LinkEntry(hash, url or None, domain or None, language or None, init_language or None, source)
+                continue
+
+            if entry.sources[-1] != source:
+                entry.sources.append(source)
+            for field, value in (("url", url), ("domain", domain), ("language", language), ("init_language", init_language)):
+                if not value:
+                    continue
+                current = getattr(entry, field)
+                if current is None:
+                    setattr(entry, field, value)
+                elif current != value:
+                    self.conflicts[hash].setdefault(field, {current}).add(value)
+
+    #-------- lookups: ---------#
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, hash : str):
+        return hash in self.entries
+
+    def get(self, hash : str):
+        """LinkEntry of hash, None if no table has it"""
+
+        return self.entries.get(hash)
+
+    def url(self, hash : str):
+        entry = self.entries.get(hash)
+        return entry.url if entry is not None else None
+
+    def domain(self, hash : str):
+        entry = self.entries.get(hash)
+        return entry.domain if entry is not None else None
+
+    def language(self, hash : str):
+        entry = self.entries.get(hash)
+        return entry.language if entry is not None else None
+
+    def hash_for(self, url : str):
+        """Hash of a policy url, None if no table has it"""
+
+        return self.by_url.get(url)
+
+    def url_count(self, hash : str):
+        """Number of distinct urls recorded for hash (0 if missing)"""
+
+        entry = self.entries.get(hash)
+        if entry is None or entry.url is None:
+            return 0
+        return len(self.conflicts.get(hash, {}).get("url", ())) or 1
+
+    def join(self, hashes, fields : list = ("url", "domain", "language")):
+        """Looks up many hashes at once
+
+        Parameters
+        ----------
+        hashes : iterable of hashes (e.g. a hash list or a DataFrame column)
+        fields : LinkEntry fields to return
+
+        Returns
+        -------
+        pd.DataFrame
+            hash column plus one column per field, None where the hash is missing, in the order of hashes
+        """
+
+        hashes = list(hashes)
+        entries = [self.entries.get(hash) for hash in hashes]
+        data = {"hash": hashes}
+        for field in fields:
+            data[field] = [getattr(entry, field) if entry is not None else None for entry in entries]
+        return pd.DataFrame(data)
+
+    def to_frame(self):
+        """Every entry as a DataFrame (hash, url, domain, language, init_language)"""
+
+        return pd.DataFrame([entry.as_dict() for entry in self.entries.values()])
+
+    #-------- reporting: ---------#
+
+    def missing(self, hashes):
+        """Hashes (e.g. file names of a policy folder) that no link table knows"""
+
+        return [hash for hash in hashes if hash not in self.entries]
+
+    def duplicate_urls(self):
+        """url -> hashes for urls recorded under more than one hash"""
+
+        return {url: sorted(hashes) for url, hashes in self.url_conflicts.items() if len(hashes) > 1}
+
+    def report(self, hashes = None):
+        """Counts of entries, duplicates, conflicts and (if hashes are given) missing hashes
+
+        Returns
+        -------
+        dict
+            entries, sources, duplicate_rows (per source), conflicting_hashes (per field), duplicate_urls, missing
+        """
+
+        fields = collections.Counter(field for fields in self.conflicts.values() for field in fields)
+        report = {
+            "entries": len(self.entries),
+            "sources": list(self.sources),
+            "duplicate_rows": dict(self.duplicate_rows),
+            "conflicting_hashes": dict(fields),
+            "duplicate_urls": len(self.duplicate_urls()),
+        }
+        if hashes is not None:
+            report["missing"] = len(self.missing(hashes))
+        return report
@@ -0,0 +1,107 @@
+import collections
+import sudachipy
+
+#-------- morpheme feature cache: ---------#
+# Policies repeat the same few thousand words over and over, so the per token feature calls of tokenize_rows
+# (normalized/reading/dictionary form, part of speech) are memoized by Sudachi word id - a repeated word then
+# costs a word_id() call and a dict lookup instead of several calls into SudachiPy and new strings.
+
+class MorphemeCache:
+    """Bounded LRU cache of morpheme features keyed by Sudachi word id
+
+    Parameters
+    ----------
+    max_size : maximum number of words (and of split entries) kept, least recently used are evicted
+
+    Notes
+    -----
+    OOV morphemes are never cached, their word ids are made up per analysis and their features depend on the input text
+    Part of speech tuples are interned by part of speech id (there are only ~1,500 of them in the dictionary)
+    Split strings are made of input surfaces, so they are keyed by (word id, surface) and not by word id alone
+    """
+
+    def __init__(self, max_size : int = 100000):
+        self.max_size = max_size
+        self._features = collections.OrderedDict() #word id -> (word id, normalized, reading, dictionary, pos)
+        self._splits = collections.OrderedDict() #(word id, surface) -> (b split, a split)
+        self._pos = {} #pos id -> pos tuple
+        self.hits = 0
+        self.misses = 0
+        self.split_hits = 0
+        self.split_misses = 0
+        self.oov = 0
+
+    def features(self, token : sudachipy.Morpheme):
+        """(word id, normalized, reading, dictionary, pos) of token, from the cache if the word was seen before
+
+        word id is None for OOV morphemes
+        """
+
+        if token.dictionary_id() < 0:
+            self.oov += 1
+            return None, token.normalized_form(), token.reading_form(), token.dictionary_form(), token.part_of_speech()
+
+        word_id = token.word_id()
+        features = self._features.get(word_id)
+        if features is not None:
+            self.hits += 1
+            self._features.move_to_end(word_id)
+            return features
+
+        self.misses += 1
+        pos_id = token.part_of_speech_id()
+        pos = self._pos.get(pos_id)
+        if pos is None:
+            pos = self._pos[pos_id] = token.part_of_speech()
+
+        features = (word_id, token.normalized_form(), token.reading_form(), token.dictionary_form(), pos)
+        self._features[word_id] = features
+        if len(self._features) > self.max_size:
+            self._features.popitem(last = False)
+        return features
+
+    def get_splits(self, word_id : int, surface : str):
+        """(b split, a split) strings for a non OOV word seen with this surface, None if not cached"""
+
+        key = (word_id, surface)
+        splits = self._splits.get(key)
+        if splits is None:
+            self.split_misses += 1
+            return None
+        self.split_hits += 1
+        self._splits.move_to_end(key)
+        return splits
+
+    def put_splits(self, word_id : int, surface : str, splits : tuple):
+        self._splits[(word_id, surface)] = splits
+        if len(self._splits) > self.max_size:
+            self._splits.popitem(last = False)
+
+    def stats(self):
+        """Hit counters and hit rates of the feature and split caches
+
+        Returns
+        -------
+        dict
+            hits, misses, hit_rate, split_hits, split_misses, split_hit_rate, oov, size, split_size, pos_size
+        """
+
+        lookups = self.hits + self.misses
+        split_lookups = self.split_hits + self.split_misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "split_hits": self.split_hits,
+            "split_misses": self.split_misses,
+            "split_hit_rate": self.split_hits / split_lookups if split_lookups else 0.0,
+            "oov": self.oov,
+            "size": len(self._features),
+            "split_size": len(self._splits),
+            "pos_size": len(self._pos),
+        }
+
+    def clear(self):
+        self._features.clear()
+        self._splits.clear()
+        self._pos.clear()
@@ -0,0 +1,228 @@
+import os
+import glob
+import collections
+import zlib
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import corpus_stats
+
+#-------- near duplicate detection: ---------#
+# Boilerplate policies copied across sister domains (or the same policy behind several urls) are found with
+# MinHash signatures over shingles and locality sensitive hashing: documents only get compared when one of
+# their signature bands collides, so the cost grows with the number of documents, not with its square.
+# Every cluster of near duplicates is reduced to one canonical hash that tokenization/analytics can keep.
+#   signatures = text_folder_signatures("../policy_corpus/policies")
+#   clusters = near_duplicate_clusters(signatures, threshold = 0.8)
+#   skip = redundant_hashes(clusters)
+
+#odd 64 bit multipliers make (a * x + b) >> 32 a 2-universal hash family, numpy uint64 arithmetic wraps mod 2**64
+_SHIFT = np.uint64(32)
+#buckets up to this size are compared pairwise, larger ones only against their first document
+MAX_BUCKET_PAIRS = 32
+#base of the polynomial rolling hash that combines k token hashes into a shingle hash
+_SHINGLE_BASE = np.uint64(0x100000001B3)
+
+class MinHasher:
+    """MinHash signatures of shingle sets
+
+    Parameters
+    ----------
+    num_perm : number of hash functions, the signature length
+    shingle_size : number of consecutive tokens (or characters) in a shingle
+    seed : seed of the hash functions, signatures are only comparable with the same seed and num_perm
+    """
+
+    def __init__(self, num_perm : int = 128, shingle_size : int = 5, seed : int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._a = (rng.integers(0, 2**63, num_perm, dtype = np.uint64) << np.uint64(1)) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, num_perm, dtype = np.uint64)
+
+    def shingles(self, ids : np.ndarray):
+        """Distinct shingle hashes (uint64) of a sequence of token ids, a shorter sequence is one shingle"""
+
+        ids = ids.astype(np.uint64)
+        k = min(self.shingle_size, len(ids))
+        if k == 0:
+            return ids
+
+        n = len(ids) - k + 1
+        shingles = np.zeros(n, dtype = np.uint64)
+        with np.errstate(over = "ignore"):
+            for j in range(k):
+                shingles = shingles * _SHINGLE_BASE + ids[j:j + n]
+        return np.unique(shingles)
+
+    def signature(self, shingles : np.ndarray, block : int = 4096):
+        """MinHash signature (uint32 array of num_perm) of a set of shingle hashes, uint32 max everywhere for an empty set"""
+
+        signature = np.full(self.num_perm, np.iinfo(np.uint32).max, dtype = np.uint64)
+        #shingles are hashed in blocks so a long policy never needs a (num_perm x shingles) matrix at once
+        with np.errstate(over = "ignore"):
+            for start in range(0, len(shingles), block):
+                values = (self._a[:, None] * shingles[None, start:start + block] + self._b[:, None]) >> _SHIFT
+                np.minimum(signature, values.min(axis = 1), out = signature)
+        return signature.astype(np.uint32)
+
+    def text_signature(self, text : str):
+        """Signature over character shingles, works for japanese/chinese/korean text without tokenization"""
+
+        text = " ".join(text.split())
+        return self.signature(self.shingles(np.frombuffer(text.encode("utf-32-le"), dtype = np.uint32)))
+
+    def token_signature(self, tokens : list):
+        """Signature over token shingles"""
+
+        ids = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens), dtype = np.uint64, count = len(tokens))
+        return self.signature(self.shingles(ids))
+
+#-------- signatures of corpus folders: ---------#
+
+def text_folder_signatures(in_folder : str, hasher : MinHasher = None, hash_list : list = None):
+    """Signatures of raw policy texts ({hash}.txt)
+
+    Parameters
+    ----------
+    in_folder : folder of {hash}.txt files, e.g. policy_corpus/policies
+    hasher : MinHasher to use, default MinHasher()
+    hash_list : only these hashes, None for every txt file in in_folder
+
+    Returns
+    -------
+    dict
+        hash -> signature
+    """
+
+    hasher = hasher or MinHasher()
+    if hash_list is None:
+        hash_list = sorted(os.path.splitext(os.path.basename(file))[0] for file in glob.glob(os.path.join(in_folder, "*.txt")))
+
+    signatures = {}
+    for hash in hash_list:
+        with open(os.path.join(in_folder, f"{hash}.txt"), "r", encoding = "utf-8") as f:
+            signatures[hash] = hasher.text_signature(f.read())
+    return signatures
+
+def csv_folder_signatures(in_folder : str, language : str, hasher : MinHasher = None):
+    """Signatures over the normalized tokens of a tokenized corpus folder (e.g. corpus/japanese_preprocessed)
+
+    Parameters
+    ----------
+    in_folder : folder of {hash}.csv files
+    language : key of corpus_stats.LANGUAGE_RULES
+    hasher : MinHasher to use, default MinHasher()
+
+    Returns
+    -------
+    dict
+        hash -> signature
+    """
+
+    hasher = hasher or MinHasher()
+    tokens = corpus_stats.read_csv_folder(in_folder, language)
+
+    #token ids once for the whole corpus, rows of one document are contiguous in the table
+    hash_column = tokens.column("hash").combine_chunks()
+    doc = hash_column.indices.to_numpy(zero_copy_only = False)
+    hashes = hash_column.dictionary.to_pylist()
+    forms = pc.dictionary_encode(tokens.column("Normalized")).combine_chunks()
+    form_ids = np.fromiter((zlib.crc32(form.encode("utf-8")) for form in forms.dictionary.to_pylist()), dtype = np.uint64, count = len(forms.dictionary))
+    ids = form_ids[forms.indices.to_numpy(zero_copy_only = False)]
+
+    bounds = np.searchsorted(doc, np.arange(len(hashes) + 1))
+    return {hashes[i]: hasher.signature(hasher.shingles(ids[bounds[i]:bounds[i + 1]])) for i in range(len(hashes)) if bounds[i + 1] > bounds[i]}
+
+#-------- locality sensitive hashing: ---------#
+
+def lsh_params(num_perm : int, threshold : float):
+    """(bands, rows) with bands * rows <= num_perm whose candidate threshold (1 / bands) ** (1 / rows) is closest to threshold"""
+
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+def candidate_pairs(signatures : dict, bands : int, rows : int):
+    """Pairs of hashes whose signatures are equal on at least one band
+
+    Returns
+    -------
+    set(tuple)
+        (hash, hash) pairs, each pair once in sorted order
+    """
+
+    hashes = sorted(signatures)
+    matrix = np.stack([signatures[hash] for hash in hashes]) if hashes else np.zeros((0, bands * rows), dtype = np.uint32)
+
+    pairs = set()
+    for band in range(bands):
+        buckets = collections.defaultdict(list)
+        for i, key in enumerate(matrix[:, band * rows:(band + 1) * rows]):
+            buckets[key.tobytes()].append(i)
+
+        for bucket in buckets.values():
+            if len(bucket) <= MAX_BUCKET_PAIRS:
+                pairs.update((hashes[i], hashes[j]) for n, i in enumerate(bucket) for j in bucket[n + 1:])
+            else:
+                #huge buckets are mass copied boilerplate, linking everything to the first document keeps it linear
+                pairs.update((hashes[bucket[0]], hashes[i]) for i in bucket[1:])
+    return pairs
+
+def _find(parent : dict, x : str):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+def near_duplicate_clusters(signatures : dict, threshold : float = 0.8, sizes : dict = None):
+    """Clusters documents whose estimated Jaccard similarity is at least threshold
+
+    Parameters
+    ----------
+    signatures : hash -> signature, all from the same MinHasher
+    threshold : minimum estimated Jaccard similarity of shingle sets
+    sizes : hash -> document size (e.g. token count), the largest document of a cluster becomes canonical
+
+    Returns
+    -------
+    pd.DataFrame
+        hash, canonical, cluster_size, similarity (estimated Jaccard similarity to the canonical document)
+        one row per hash, documents without near duplicates are their own canonical
+    """
+
+    if not signatures:
+        return pd.DataFrame(columns = ["hash", "canonical", "cluster_size", "similarity"])
+
+    num_perm = len(next(iter(signatures.values())))
+    bands, rows = lsh_params(num_perm, threshold)
+
+    #candidates are verified on the full signature, band collisions alone have false positives
+    parent = {hash: hash for hash in signatures}
+    for x, y in candidate_pairs(signatures, bands, rows):
+        if np.mean(signatures[x] == signatures[y]) >= threshold:
+            root_x, root_y = _find(parent, x), _find(parent, y)
+            if root_x != root_y:
+                parent[root_y] = root_x
+
+    clusters = collections.defaultdict(list)
+    for hash in signatures:
+        clusters[_find(parent, hash)].append(hash)
+
+    rows_out = []
+    for members in clusters.values():
+        #largest document first, hash as tie breaker so the choice does not depend on input order
+        canonical = min(members, key = lambda hash: (-(sizes or {}).get(hash, 0), hash))
+        for hash in members:
+            rows_out.append((hash, canonical, len(members), float(np.mean(signatures[hash] == signatures[canonical]))))
+
+    return pd.DataFrame(rows_out, columns = ["hash", "canonical", "cluster_size", "similarity"]).sort_values(["canonical", "hash"], ignore_index = True)
+
+def redundant_hashes(clusters : pd.DataFrame):
+    """Hashes that are near duplicates of another (canonical) document and can be skipped"""
+
+    return set(clusters.loc[clusters["hash"] != clusters["canonical"], "hash"])
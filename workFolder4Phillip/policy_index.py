@@ -0,0 +1,368 @@
+import os
+import json
+import glob
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import corpus_stats
+import tokenize_manifest
+
+#-------- on disk inverted index: ---------#
+# Normalized form -> every (document, position, section) it occurs at, over all tokenized corpora, so term,
+# phrase, proximity and same section queries are answered from a few postings instead of loading every csv.
+#   index = PolicyIndex("policy_index")
+#   index.update({"ja": "../policy_corpus/corpus/japanese_preprocessed", "ko": ..., "zh": ...})
+#   index.same_section(["第三者", "提供"], "委託")
+#
+# Layout of the index folder:
+#   index.json            documents (hash -> segment, language, source file stats, whether the csv has sections)
+#                         and the list of segments
+#   {segment}.terms.json  terms of the segment, term i owns postings bytes offsets[i]:offsets[i + 1]
+#   {segment}.offsets.npy
+#   {segment}.postings    varint stream of (document gap, position, section) per occurrence, sorted by
+#                         (term, document, position). Inside a document position and section are deltas to
+#                         the previous occurrence, the first occurrence of a document stores them as is.
+# Every update writes the new/changed documents as one new segment, older copies of a document are ignored
+# from then on. compact() rewrites all live documents into a single segment.
+
+INDEX_NAME = "index.json"
+
+#-------- varint coding: ---------#
+
+def varint_encode(values : np.ndarray):
+    """LEB128 bytes of non negative integers, vectorized
+
+    Returns
+    -------
+    tuple
+        (bytes as uint8 array, number of bytes per value)
+    """
+
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype = np.int64)
+    for k in range(1, 10):
+        lengths += values >= np.uint64(1 << (7 * k))
+
+    starts = np.cumsum(lengths) - lengths
+    out = np.zeros(int(lengths.sum()), dtype = np.uint8)
+    for k in range(int(lengths.max(initial = 0))):
+        mask = lengths > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        byte |= np.where(lengths[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+        out[starts[mask] + k] = byte.astype(np.uint8)
+    return out, lengths
+
+def varint_decode(data : np.ndarray):
+    """Inverse of varint_encode, uint8 array -> int64 values"""
+
+    if len(data) == 0:
+        return np.zeros(0, dtype = np.int64)
+
+    last = (data & 0x80) == 0
+    group = np.cumsum(last) - last #value index of every byte
+    starts = np.flatnonzero(np.r_[True, last[:-1]])
+    shift = (np.arange(len(data)) - starts[group]) * 7
+    return np.add.reduceat((data & 0x7F).astype(np.int64) << shift, starts)
+
+def _segmented_cumsum(values : np.ndarray, new_group : np.ndarray):
+    """Cumulative sum that restarts wherever new_group is True"""
+
+    total = np.cumsum(values)
+    starts = np.flatnonzero(new_group)
+    base = total[starts] - values[starts]
+    return total - base[np.cumsum(new_group) - 1]
+
+#-------- segments: ---------#
+
+class Segment:
+    """One immutable batch of indexed documents
+
+    Parameters
+    ----------
+    folder : index folder
+    name : segment name
+    hashes : hashes of the segment's documents, position in the list is the local document id
+    """
+
+    def __init__(self, folder : str, name : str, hashes : list):
+        self.name = name
+        self.hashes = hashes
+        with open(os.path.join(folder, f"{name}.terms.json"), "r", encoding = "utf-8") as f:
+            self.terms = {term: i for i, term in enumerate(json.load(f))}
+        self.offsets = np.load(os.path.join(folder, f"{name}.offsets.npy"))
+        path = os.path.join(folder, f"{name}.postings")
+        self.postings = np.memmap(path, dtype = np.uint8, mode = "r") if os.path.getsize(path) else np.zeros(0, dtype = np.uint8)
+
+    def occurrences(self, term : str):
+        """(local documents, positions, sections) of term, all int64 arrays sorted by (document, position)"""
+
+        i = self.terms.get(term)
+        if i is None:
+            empty = np.zeros(0, dtype = np.int64)
+            return empty, empty, empty
+
+        triples = varint_decode(np.asarray(self.postings[self.offsets[i]:self.offsets[i + 1]])).reshape(-1, 3)
+        gaps = triples[:, 0]
+        new_doc = gaps > 0
+        docs = np.cumsum(gaps) - 1
+        return docs, _segmented_cumsum(triples[:, 1], new_doc), _segmented_cumsum(triples[:, 2], new_doc)
+
+def write_segment(folder : str, name : str, tokens : pa.Table):
+    """Writes the postings of a token table (hash, Normalized, Section columns) as segment name
+
+    Returns
+    -------
+    tuple
+        (hashes of the segment in local document id order, bool array: document has section data)
+    """
+
+    hash_column = tokens.column("hash").combine_chunks()
+    docs = hash_column.indices.to_numpy(zero_copy_only = False).astype(np.int64)
+    hashes = hash_column.dictionary.to_pylist()
+
+    #positions count every stored token of a document. Csvs without a Section column are stored as section 0
+    #and flagged, so same section queries leave them out instead of treating the whole document as one section
+    bounds = np.searchsorted(docs, np.arange(len(hashes) + 1))
+    positions = np.arange(len(docs), dtype = np.int64) - bounds[docs]
+    sections = pc.cast(pc.if_else(pc.equal(tokens.column("Section"), ""), pa.scalar(None, pa.string()), tokens.column("Section")), pa.int64())
+    sectioned = np.bincount(docs, weights = pc.is_valid(sections).to_numpy(zero_copy_only = False), minlength = len(hashes)) > 0
+    sections = pc.fill_null(sections, 0).to_numpy().astype(np.int64)
+
+    normalized = pc.dictionary_encode(pc.fill_null(tokens.column("Normalized"), "")).combine_chunks()
+    terms = normalized.dictionary.to_pylist()
+    term_ids = normalized.indices.to_numpy(zero_copy_only = False).astype(np.int64)
+
+    order = np.lexsort((positions, docs, term_ids))
+    term_ids, docs, positions, sections = term_ids[order], docs[order], positions[order], sections[order]
+
+    #delta coding, restarting at every term and every document
+    new_term = np.r_[True, term_ids[1:] != term_ids[:-1]]
+    previous_doc = np.where(new_term, -1, np.r_[-1, docs[:-1]])
+    gaps = docs - previous_doc
+    new_doc = gaps > 0
+    position_values = np.where(new_doc, positions, positions - np.r_[0, positions[:-1]])
+    section_values = np.where(new_doc, sections, sections - np.r_[0, sections[:-1]])
+
+    data, lengths = varint_encode(np.column_stack((gaps, position_values, section_values)).ravel())
+    value_ends = np.cumsum(lengths)
+    occurrence_ends = value_ends[2::3]
+    term_starts = np.flatnonzero(new_term)
+    offsets = np.r_[0, occurrence_ends[np.r_[term_starts[1:] - 1, len(term_ids) - 1]]] if len(term_ids) else np.zeros(1, dtype = np.int64)
+
+    #terms are stored in posting order, a term without occurrences cannot exist
+    with open(os.path.join(folder, f"{name}.terms.json"), "w", encoding = "utf-8") as f:
+        json.dump([terms[i] for i in term_ids[term_starts]], f, ensure_ascii = False)
+    np.save(os.path.join(folder, f"{name}.offsets.npy"), offsets.astype(np.int64))
+    data.tofile(os.path.join(folder, f"{name}.postings"))
+    return hashes, sectioned
+
+#-------- index: ---------#
+
+class PolicyIndex:
+    """Inverted index over the tokenized policy corpora
+
+    Parameters
+    ----------
+    folder : index folder, created if missing
+    """
+
+    def __init__(self, folder : str):
+        self.folder = folder
+        os.makedirs(folder, exist_ok = True)
+        self.path = os.path.join(folder, INDEX_NAME)
+        self.documents = {} #hash -> {"segment", "language", "file", "size", "mtime", "sha256", "sectioned"}
+        self.segment_names = []
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding = "utf-8") as f:
+                state = json.load(f)
+            self.documents = state["documents"]
+            self.segment_names = state["segments"]
+        self._load_segments()
+
+    def _load_segments(self):
+        """Opens every segment and maps live (segment, local document) pairs to global document ids"""
+
+        self.segments = []
+        self.hashes = [] #global document id -> hash
+        self._live = [] #per segment: local document id -> global document id, -1 if superseded
+        for name in self.segment_names:
+            with open(os.path.join(self.folder, f"{name}.hashes.json"), "r", encoding = "utf-8") as f:
+                hashes = json.load(f)
+            segment = Segment(self.folder, name, hashes)
+            live = np.full(len(hashes), -1, dtype = np.int64)
+            for local, hash in enumerate(hashes):
+                entry = self.documents.get(hash)
+                if entry is not None and entry["segment"] == name:
+                    live[local] = len(self.hashes)
+                    self.hashes.append(hash)
+            self.segments.append(segment)
+            self._live.append(live)
+        self.languages = np.array([self.documents[hash]["language"] for hash in self.hashes], dtype = object)
+        self.sectioned = np.array([self.documents[hash].get("sectioned", False) for hash in self.hashes], dtype = bool)
+
+    def save(self):
+        """Writes index.json atomically"""
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            json.dump({"segments": self.segment_names, "documents": self.documents}, f, ensure_ascii = False, indent = 1, sort_keys = True)
+        os.replace(tmp, self.path)
+
+    #-------- building: ---------#
+
+    def _is_current(self, hash : str, file : str, stat : os.stat_result):
+        entry = self.documents.get(hash)
+        #documents indexed before the sectioned flag existed are indexed again
+        if entry is None or entry["file"] != os.path.abspath(file) or "sectioned" not in entry:
+            return False
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return True
+        return entry["sha256"] == tokenize_manifest.file_sha256(file)
+
+    def update(self, folders : dict, remove_missing : bool = True, workers : int = 8):
+        """Indexes new and changed csvs as one new segment
+
+        Parameters
+        ----------
+        folders : language -> folder of tokenized {hash}.csv files
+        remove_missing : drop documents whose csv no longer exists in its folder
+        workers : threads reading csvs
+
+        Returns
+        -------
+        int
+            number of documents (re)indexed
+        """
+
+        changed = {}
+        seen = set()
+        for language, folder in folders.items():
+            for file in sorted(glob.glob(os.path.join(folder, "*.csv"))):
+                hash = os.path.splitext(os.path.basename(file))[0]
+                if hash == "readability":
+                    continue
+                seen.add(hash)
+                if not self._is_current(hash, file, os.stat(file)):
+                    changed[hash] = (language, file)
+
+        if remove_missing:
+            roots = {os.path.abspath(folder) for folder in folders.values()}
+            for hash in [hash for hash, entry in self.documents.items() if hash not in seen and os.path.dirname(entry["file"]) in roots]:
+                del self.documents[hash]
+
+        if changed:
+            self._write(changed, workers)
+        self.save()
+        self._load_segments()
+        return len(changed)
+
+    def _write(self, files : dict, workers : int):
+        """Writes hash -> (language, file) as a new segment and points the documents at it"""
+
+        name = f"segment-{max((int(name.split('-')[1]) for name in self.segment_names), default = -1) + 1:05d}"
+        paths = [file for _, file in files.values()]
+        tokens = corpus_stats.read_csv_files(paths, ["Normalized", "Section"], workers = workers)
+        hashes, sectioned = write_segment(self.folder, name, tokens)
+        with open(os.path.join(self.folder, f"{name}.hashes.json"), "w", encoding = "utf-8") as f:
+            json.dump(hashes, f)
+
+        sectioned = dict(zip(hashes, sectioned.tolist()))
+        for hash, (language, file) in files.items():
+            stat = os.stat(file)
+            self.documents[hash] = {"segment": name, "language": language, "file": os.path.abspath(file), "size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": tokenize_manifest.file_sha256(file), "sectioned": sectioned.get(hash, False)}
+        self.segment_names.append(name)
+
+    def compact(self, workers : int = 8):
+        """Rewrites every live document into one segment and deletes the old segment files"""
+
+        old = list(self.segment_names)
+        files = {hash: (entry["language"], entry["file"]) for hash, entry in self.documents.items()}
+        if files:
+            self._write(files, workers)
+        self.segment_names = self.segment_names[len(old):]
+        self.save()
+
+        for name in old:
+            for file in glob.glob(os.path.join(self.folder, f"{name}.*")):
+                os.remove(file)
+        self._load_segments()
+
+    #-------- queries: ---------#
+
+    def occurrences(self, term : str, languages : list = None):
+        """(documents, positions, sections) of term over all segments, documents are global ids sorted with positions"""
+
+        docs, positions, sections = [], [], []
+        for segment, live in zip(self.segments, self._live):
+            local, position, section = segment.occurrences(term)
+            ids = live[local]
+            keep = ids >= 0
+            docs.append(ids[keep])
+            positions.append(position[keep])
+            sections.append(section[keep])
+
+        docs, positions, sections = np.concatenate(docs or [np.zeros(0, np.int64)]), np.concatenate(positions or [np.zeros(0, np.int64)]), np.concatenate(sections or [np.zeros(0, np.int64)])
+        if languages is not None:
+            keep = np.isin(self.languages[docs], list(languages)) if len(docs) else np.zeros(0, dtype = bool)
+            docs, positions, sections = docs[keep], positions[keep], sections[keep]
+        order = np.lexsort((positions, docs))
+        return docs[order], positions[order], sections[order]
+
+    def _phrase(self, terms, languages : list = None):
+        """(documents, start positions, sections) where the terms occur consecutively, a str is a one term phrase"""
+
+        if isinstance(terms, str):
+            terms = [terms]
+
+        docs, positions, sections = self.occurrences(terms[0], languages)
+        for offset, term in enumerate(terms[1:], 1):
+            next_docs, next_positions, _ = self.occurrences(term, languages)
+            keep = np.isin(docs << 32 | positions, next_docs << 32 | (next_positions - offset))
+            docs, positions, sections = docs[keep], positions[keep], sections[keep]
+        return docs, positions, sections
+
+    def _hashes(self, docs : np.ndarray):
+        return sorted({self.hashes[doc] for doc in np.unique(docs)})
+
+    def search(self, terms, languages : list = None):
+        """Hashes of documents containing a term, or a phrase given as a list of consecutive terms"""
+
+        return self._hashes(self._phrase(terms, languages)[0])
+
+    def phrase_positions(self, terms, languages : list = None):
+        """hash -> start positions of a phrase in that document"""
+
+        docs, positions, _ = self._phrase(terms, languages)
+        result = {}
+        for doc, position in zip(docs.tolist(), positions.tolist()):
+            result.setdefault(self.hashes[doc], []).append(position)
+        return result
+
+    def near(self, first, second, distance : int = 10, languages : list = None):
+        """Hashes of documents where the two terms/phrases start within distance tokens of each other"""
+
+        a_docs, a_positions, _ = self._phrase(first, languages)
+        b_docs, b_positions, _ = self._phrase(second, languages)
+        if len(a_docs) == 0 or len(b_docs) == 0:
+            return []
+
+        #nearest occurrence of first on both sides of every occurrence of second
+        a_keys = a_docs << 32 | a_positions
+        i = np.searchsorted(a_keys, b_docs << 32 | b_positions)
+        hit = np.zeros(len(b_docs), dtype = bool)
+        for candidate in (np.minimum(i, len(a_keys) - 1), np.maximum(i - 1, 0)):
+            hit |= (a_docs[candidate] == b_docs) & (np.abs(a_positions[candidate] - b_positions) <= distance)
+        return self._hashes(b_docs[hit])
+
+    def same_section(self, first, second, languages : list = None):
+        """Hashes of documents where the two terms/phrases occur in the same section
+
+        Documents whose csv has no section data (korean, chinese and older japanese csvs) are never returned
+        """
+
+        a_docs, _, a_sections = self._phrase(first, languages)
+        b_docs, _, b_sections = self._phrase(second, languages)
+        a_keep, b_keep = self.sectioned[a_docs], self.sectioned[b_docs]
+        a_docs, a_sections, b_docs, b_sections = a_docs[a_keep], a_sections[a_keep], b_docs[b_keep], b_sections[b_keep]
+        keys = np.intersect1d(a_docs << 32 | a_sections, b_docs << 32 | b_sections)
+        return self._hashes(keys >> 32)
@@ -0,0 +1,123 @@
+import unicodedata
+
+#-------- streaming sentence chunker: ---------#
+# SudachiPy refuses inputs over 49149 bytes, and inputs over 65535 bytes after its input normalization. Instead of tokenizing, catching the error and recursively halving
+# the text (safe_split in preprocess.ipynb), oversized text is cut into byte bounded chunks in one linear pass
+# before tokenization. Cuts prefer paragraph ends, then sentence ends (Japanese/Chinese/Korean/western), then
+# clause or word boundaries, and only split a run of text mid-word if nothing else fits.
+# Normalization can make a chunk grow (㍿ -> 株式会社 is 3 -> 12 bytes), so a chunk whose normalized form would be
+# too long is cut shorter. Chunks are yielded as they are found and joining them gives back the input unchanged.
+
+#SudachiPy input size limit in utf-8 bytes
+SUDACHI_MAX_BYTES = 49149
+
+#SudachiPy limit on the normalized input in utf-8 bytes, less a margin for its own rewrite rules that NFKC and
+#lowercasing (see normalized_size) don't reproduce exactly
+SUDACHI_MAX_NORMALIZED_BYTES = 65535 - 1024
+
+#cut points from most to least preferred, as utf-8 bytes - a chunk ends right after the matched sequence
+BOUNDARIES = [
+    [b"\n"],
+    [s.encode("utf-8") for s in ["。", "．", "！", "？", "；", "…", ". ", "! ", "? ", "; "]],
+    [s.encode("utf-8") for s in ["、", "，", ", ", " ", "　", "\t"]],
+]
+
+def _cut(data : bytes, start : int, max_bytes : int):
+    """End offset of the chunk starting at start, at the best boundary in the back half of the window"""
+
+    end = start + max_bytes
+    low = start + max_bytes // 2 #cuts are only searched in the back half so every chunk is at least half full
+    for seps in BOUNDARIES:
+        best = -1
+        for sep in seps:
+            i = data.rfind(sep, low, end)
+            if i >= 0 and i + len(sep) <= end:
+                best = max(best, i + len(sep))
+        if best > 0:
+            return best
+
+    #hard cut - step back over utf-8 continuation bytes so no character is split
+    while end > start and (data[end] & 0xC0) == 0x80:
+        end -= 1
+    return end
+
+def normalized_size(text : str):
+    """utf-8 size of text after NFKC and lowercasing, the input normalization SudachiPy applies by default"""
+
+    return len(unicodedata.normalize("NFKC", text.lower()).encode("utf-8"))
+
+def _cut_normalized(data : bytes, start : int, max_bytes : int, max_normalized_bytes : int):
+    """End offset of the chunk starting at start that fits max_bytes, and max_normalized_bytes once normalized"""
+
+    window = min(max_bytes, len(data) - start)
+    while True:
+        end = len(data) if start + window == len(data) else _cut(data, start, window)
+        size = normalized_size(data[start:end].decode("utf-8"))
+        if size <= max_normalized_bytes:
+            return end
+        #shrink the window by how much the chunk grew, at least one character has to stay in it
+        window = max(4, (end - start) * max_normalized_bytes // size - 4)
+
+def iter_chunks(text, max_bytes : int = SUDACHI_MAX_BYTES, max_normalized_bytes : int = SUDACHI_MAX_NORMALIZED_BYTES):
+    """Splits text into chunks of at most max_bytes utf-8 bytes, cut at sentence or paragraph boundaries
+
+    Parameters
+    ----------
+    text : str, or an iterable of str pieces (e.g. a file object) so huge inputs are never held whole
+    max_bytes : maximum utf-8 size of a chunk
+    max_normalized_bytes : maximum utf-8 size of a chunk after normalization (see normalized_size)
+
+    Returns
+    -------
+    generator(str)
+        Chunks in order, "".join(chunks) == text
+    """
+
+    if isinstance(text, str):
+        #short texts are the common case, skip the encoding
+        if len(text) * 4 <= max_bytes and normalized_size(text) <= max_normalized_bytes:
+            if text:
+                yield text
+            return
+        text = [text]
+
+    buffer = b""
+    for piece in text:
+        buffer += piece.encode("utf-8")
+        if len(buffer) <= max_bytes:
+            continue
+
+        #emit all full chunks, keep the tail for the next piece
+        start = 0
+        while len(buffer) - start > max_bytes:
+            end = _cut_normalized(buffer, start, max_bytes, max_normalized_bytes)
+            yield buffer[start:end].decode("utf-8")
+            start = end
+        buffer = buffer[start:]
+
+    #the tail fits max_bytes, but may still need cutting for its normalized size
+    start = 0
+    while start < len(buffer):
+        end = _cut_normalized(buffer, start, max_bytes, max_normalized_bytes)
+        yield buffer[start:end].decode("utf-8")
+        start = end
+
+def iter_file_chunks(path : str, max_bytes : int = SUDACHI_MAX_BYTES, block_size : int = 1 << 20, encoding : str = "utf-8", max_normalized_bytes : int = SUDACHI_MAX_NORMALIZED_BYTES):
+    """iter_chunks over a text file, read block_size characters at a time
+
+    Parameters
+    ----------
+    path : text file to chunk
+    max_bytes : maximum utf-8 size of a chunk
+    block_size : number of characters read per block
+    encoding : encoding of the file
+    max_normalized_bytes : maximum utf-8 size of a chunk after normalization (see normalized_size)
+
+    Returns
+    -------
+    generator(str)
+        Chunks of the file in order
+    """
+
+    with open(path, "r", encoding = encoding) as f:
+        yield from iter_chunks(iter(lambda: f.read(block_size), ""), max_bytes, max_normalized_bytes)
@@ -0,0 +1,221 @@
+import os
+import csv
+import glob
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+#-------- columnar token store: ---------#
+# One parquet dataset for the whole tokenized corpus, hive partitioned by language:
+#   {root}/language=ja/part-0.parquet
+#   {root}/language=ko/part-0.parquet
+# Every row carries the policy hash, so cross-document queries are a single scan.
+
+#unified schema - korean/chinese outputs only fill Surface, Normalized, Dictionary and POS1
+TOKEN_SCHEMA = pa.schema([
+    ("hash", pa.dictionary(pa.int32(), pa.string())),
+    ("Surface", pa.string()),
+    ("Normalized", pa.string()),
+    ("Reading", pa.dictionary(pa.int32(), pa.string())),
+    ("Dictionary", pa.string()),
+    ("POS1", pa.dictionary(pa.int32(), pa.string())),
+    ("POS2", pa.dictionary(pa.int32(), pa.string())),
+    ("POS3", pa.dictionary(pa.int32(), pa.string())),
+    ("POS4", pa.dictionary(pa.int32(), pa.string())),
+    ("Conj_Type", pa.dictionary(pa.int32(), pa.string())),
+    ("Conj", pa.dictionary(pa.int32(), pa.string())),
+    ("OOV", pa.bool_()),
+    ("B_Split", pa.string()),
+    ("A_Split", pa.string()),
+    ("Section", pa.int32()),
+])
+
+#columns that repeat heavily and are stored dictionary encoded in the parquet files
+DICTIONARY_COLUMNS = [field.name for field in TOKEN_SCHEMA if pa.types.is_dictionary(field.type)]
+
+#column names used by the pandas written korean/chinese csvs
+LOWERCASE_COLUMNS = {"surface": "Surface", "normalized": "Normalized", "dictionary": "Dictionary", "pos": "POS1", "POS": "POS1"}
+
+class TokenStoreWriter:
+    """Buffered writer for one language partition of the token store
+
+    Parameters
+    ----------
+    root : path to the dataset root folder
+    language : partition value, e.g. "ja", "ko", "zh"
+    basename : file name (without extension) inside the partition, use a different one per process
+    batch_size : number of rows to buffer before a row group is written
+    """
+
+    def __init__(self, root : str, language : str, basename : str = "part-0", batch_size : int = 65536):
+        self.path = os.path.join(partition_path(root, language), f"{basename}.parquet")
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        self.batch_size = batch_size
+        self._columns = {name: [] for name in TOKEN_SCHEMA.names}
+        self._rows = 0
+        self._writer = pq.ParquetWriter(self.path, TOKEN_SCHEMA, compression = "zstd", use_dictionary = DICTIONARY_COLUMNS)
+
+    def add(self, hash : str, rows):
+        """Adds all token rows of one document
+
+        Parameters
+        ----------
+        hash : hash (file name) of the document
+        rows : iterable of tuples in the order of Preprocessing.TOKEN_COLUMNS
+        """
+
+        names = TOKEN_SCHEMA.names[1:]
+        for row in rows:
+            self._columns["hash"].append(hash)
+            for name, value in zip(names, row):
+                self._columns[name].append(value)
+            self._rows += 1
+
+            if self._rows >= self.batch_size:
+                self.flush()
+
+    def add_frame(self, hash : str, tokens : pd.DataFrame):
+        """Adds a tokenized DataFrame (korean/chinese column names are mapped onto the store schema)"""
+
+        tokens = tokens.rename(columns = LOWERCASE_COLUMNS)
+        n = len(tokens)
+        for name in TOKEN_SCHEMA.names[1:]:
+            if name in tokens.columns:
+                self._columns[name].extend(tokens[name].tolist())
+            else:
+                self._columns[name].extend([None] * n)
+        self._columns["hash"].extend([hash] * n)
+        self._rows += n
+
+        if self._rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered rows as a row group"""
+
+        if self._rows == 0:
+            return
+        table = pa.Table.from_pydict(self._columns, schema = TOKEN_SCHEMA)
+        self._writer.write_table(table)
+        self._columns = {name: [] for name in TOKEN_SCHEMA.names}
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def partition_path(root : str, language : str):
+    """Folder holding the parquet files of one language"""
+
+    return os.path.join(root, f"language={language}")
+
+def clear_partition(root : str, language : str):
+    """Removes the parquet files of one language so it can be rewritten from scratch"""
+
+    for file in glob.glob(os.path.join(partition_path(root, language), "*.parquet")):
+        os.remove(file)
+
+#-------- loading: ---------#
+
+def open_token_store(root : str):
+    """Opens the token store as a pyarrow dataset (lazy, nothing is read yet)"""
+
+    return ds.dataset(root, format = "parquet", partitioning = "hive", schema = TOKEN_SCHEMA.append(pa.field("language", pa.string())))
+
+def load_tokens(root : str, columns : list = None, filter : ds.Expression = None, languages : list = None):
+    """Loads tokens from the store, only reading the requested columns and row groups
+
+    Parameters
+    ----------
+    root : path to the dataset root folder
+    columns : columns to read, None reads all of them
+    filter : pyarrow expression pushed down to the scan, e.g. ds.field("POS1") == "名詞"
+    languages : only read these language partitions
+
+    Returns
+    -------
+    pa.Table
+        Matching rows, call .to_pandas() for a DataFrame
+    """
+
+    if languages is not None:
+        language_filter = ds.field("language").isin(languages)
+        filter = language_filter if filter is None else (filter & language_filter)
+
+    return open_token_store(root).to_table(columns = columns, filter = filter)
+
+#-------- converting existing csv output: ---------#
+
+def sniff_csv(file : str):
+    """Header of a tokenized csv and whether it uses csv quoting
+
+    Preprocessing writes its japanese csvs by hand without quoting, so quotes in the text are literal. Korean and
+    chinese csvs are written by pandas and quote fields containing quotes or commas. The japanese csvs in the repo
+    come from both: the ones with a Section column are Preprocessing's, for the older ones the lines containing
+    quotes are checked - a pandas written file parses into complete rows, an unquoted one does not.
+
+    Returns
+    -------
+    tuple
+        (list of column names, True if the csv is quoted)
+    """
+
+    with open(file, "r", encoding = "utf-8") as f:
+        header = f.readline().rstrip("\n").split(",")
+        if header[0] != "Surface":
+            return header, True
+        if "Section" in header:
+            return header, False
+        lines = [line for line in f if '"' in line]
+    return header, all(len(row) == len(header) for row in csv.reader(lines))
+
+def read_token_csv(file : str):
+    """Reads one tokenized csv, either a Preprocessing written japanese one or a pandas written one (see sniff_csv)
+
+    Csvs written before section tagging have no Section column, it is left out and stored as nulls
+    """
+
+    header, quoted = sniff_csv(file)
+    if header[0] == "Surface":
+        tokens = pd.read_csv(file, sep = ",", quoting = csv.QUOTE_MINIMAL if quoted else csv.QUOTE_NONE, dtype = str, keep_default_na = False)
+        tokens["OOV"] = tokens["OOV"] == "True"
+        if "Section" in tokens.columns:
+            tokens["Section"] = tokens["Section"].astype("int32")
+        return tokens
+
+    return pd.read_csv(file, dtype = str, keep_default_na = False)
+
+def csv_folder_to_store(in_folder : str, root : str, language : str):
+    """Packs a folder of per-document csvs (e.g. corpus/japanese_preprocessed) into the token store
+
+    Parameters
+    ----------
+    in_folder : folder of {hash}.csv files
+    root : path to the dataset root folder
+    language : partition to write, existing files of that partition are replaced
+
+    Returns
+    -------
+    int
+        number of documents written
+    """
+
+    clear_partition(root, language)
+    count = 0
+
+    with TokenStoreWriter(root, language) as writer:
+        for file in sorted(glob.glob(os.path.join(in_folder, "*.csv"))):
+            hash = os.path.splitext(os.path.basename(file))[0]
+            if hash == "readability":
+                continue
+            writer.add_frame(hash, read_token_csv(file))
+            count += 1
+
+    return count
@@ -0,0 +1,130 @@
+import os
+import json
+import hashlib
+from importlib import metadata
+
+#-------- re-tokenization manifest: ---------#
+# Records what every output file was built from, so reruns only tokenize new or changed inputs.
+# Stored as {out_folder}/manifest.json:
+#   {"<name>": {"input_sha256": ..., "input_size": ..., "input_mtime": ..., "dict_version": ...,
+#               "stopwords_sha256": ..., "settings": {...}, "output": "<name>.csv" or null}}
+
+MANIFEST_NAME = "manifest.json"
+
+def file_sha256(path : str):
+    """sha256 of a file's bytes"""
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def stopwords_sha256(stopwords : set):
+    """Order independent hash of a stopword set"""
+
+    return hashlib.sha256("\n".join(sorted(stopwords)).encode("utf-8")).hexdigest()
+
+def dictionary_version(dict_type : str = "full"):
+    """Version string of sudachipy and the sudachi dictionary package in use"""
+
+    versions = []
+    for package in ("sudachipy", f"sudachidict_{dict_type}"):
+        try:
+            versions.append(f"{package}=={metadata.version(package)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{package}==unknown")
+    return ";".join(versions)
+
+class TokenizeManifest:
+    """Per output folder record of tokenizer inputs
+
+    Parameters
+    ----------
+    out_folder : folder the tokenized files are written to, manifest.json lives there too
+    dict_version : see dictionary_version()
+    stopwords : stopword set used for this run
+    settings : any other tokenizer settings that change the output (split mode, output format, ...)
+    """
+
+    def __init__(self, out_folder : str, dict_version : str, stopwords : set, settings : dict):
+        self.out_folder = out_folder
+        self.path = os.path.join(out_folder, MANIFEST_NAME)
+        self.dict_version = dict_version
+        self.stopwords_sha256 = stopwords_sha256(stopwords)
+        self.settings = settings
+        self.entries = {}
+        self._hashes = {} #input hashes computed during this run
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding = "utf-8") as f:
+                self.entries = json.load(f)
+
+    def _input_sha256(self, name : str, file : str, stat : os.stat_result):
+        if name in self._hashes:
+            return self._hashes[name]
+
+        #size and mtime unchanged -> reuse the recorded hash instead of re-reading the file
+        entry = self.entries.get(name)
+        if entry and entry["input_size"] == stat.st_size and entry["input_mtime"] == stat.st_mtime_ns:
+            return entry["input_sha256"]
+
+        self._hashes[name] = file_sha256(file)
+        return self._hashes[name]
+
+    def is_current(self, file : str):
+        """True if file was already tokenized with identical input, dictionary, stopwords and settings
+
+        Parameters
+        ----------
+        file : path to the input text file
+
+        Returns
+        -------
+        bool
+            False for new or changed inputs, or if the recorded output has gone missing
+        """
+
+        name = os.path.splitext(os.path.basename(file))[0]
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+
+        if (entry["dict_version"] != self.dict_version
+                or entry["stopwords_sha256"] != self.stopwords_sha256
+                or entry["settings"] != self.settings):
+            return False
+
+        if entry["output"] is not None and not os.path.exists(os.path.join(self.out_folder, entry["output"])):
+            return False
+
+        return entry["input_sha256"] == self._input_sha256(name, file, os.stat(file))
+
+    def record(self, file : str, output : str = None):
+        """Records that file was tokenized in this run
+
+        Parameters
+        ----------
+        file : path to the input text file
+        output : output file name relative to out_folder, None if the input was skipped (e.g. not japanese)
+        """
+
+        name = os.path.splitext(os.path.basename(file))[0]
+        stat = os.stat(file)
+        self.entries[name] = {
+            "input_sha256": self._input_sha256(name, file, stat),
+            "input_size": stat.st_size,
+            "input_mtime": stat.st_mtime_ns,
+            "dict_version": self.dict_version,
+            "stopwords_sha256": self.stopwords_sha256,
+            "settings": self.settings,
+            "output": output,
+        }
+
+    def save(self):
+        """Writes the manifest atomically"""
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii = False, indent = 1, sort_keys = True)
+        os.replace(tmp, self.path)